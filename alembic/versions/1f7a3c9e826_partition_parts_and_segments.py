@@ -0,0 +1,26 @@
+"""partition parts and segments
+
+Revision ID: 1f7a3c9e826
+Revises: 5e2b7d04c61
+Create Date: 2026-10-17 16:58:12.204417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f7a3c9e826'
+down_revision = '5e2b7d04c61'
+
+from alembic import op
+
+import pynab.partitions
+
+
+def upgrade():
+    # only if db.partitioned_parts is on, otherwise there's nothing to do
+    if pynab.partitions.enabled():
+        pynab.partitions.partition(op.get_bind())
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        pynab.partitions.unpartition(op.get_bind())
@@ -13,6 +13,9 @@ stats = {
 
     # write a separate .csv file for use in excel.
     'write_csv': True,
+
+    # show each group's current adaptive OVER size with the header
+    'show_over_sizes': True,
 }
 
 monitor = {
@@ -103,6 +106,63 @@ scan = {
     # make sure there's no quotes around it
     'message_scan_limit': 20000,
 
+    # part_save_batch: number of segments to hold in memory while scanning
+    # before handing them to the db. keeps memory flat no matter how big
+    # message_scan_limit is, so that can be raised a long way
+    'part_save_batch': 50000,
+
+    # group_scan_connections: number of connections to scan a single group with
+    # a group's range is split into message_scan_limit chunks and fetched in parallel
+    # useful for very busy groups. total connections used is roughly
+    # update_threads * group_scan_connections, so keep that under max_connections
+    'group_scan_connections': 1,
+
+    # over_pipeline_depth: number of OVER commands to keep in flight at once
+    # each message_scan_limit chunk is split into over_pipeline_size ranges
+    # and requested without waiting for the previous response
+    # helps a lot on high-latency links. set to 1 to disable
+    'over_pipeline_depth': 4,
+
+    # over_pipeline_size: number of messages per pipelined OVER
+    # with over_size_adaptive on, this is just where new groups start
+    'over_pipeline_size': 5000,
+
+    # over_size_adaptive: grow or shrink each group's OVER size as it scans
+    # sizes grow while responses come back quickly and shrink when they're slow
+    # or fail, within over_size_min and over_size_max, and are saved per group
+    # current sizes are shown in scripts/stats.py
+    'over_size_adaptive': True,
+
+    # over_size_min / over_size_max: bounds for the adaptive OVER size
+    'over_size_min': 500,
+    'over_size_max': 20000,
+
+    # over_target_time: how long, in seconds, we'd like each OVER to take
+    'over_target_time': 5,
+
+    # header_cache_size: number of decoded subjects/posters to remember per scan
+    # they repeat a lot, so this saves decoding the same ones over and over
+    'header_cache_size': 50000,
+
+    # blacklist_check_interval: how often, in seconds, to check whether the
+    # blacklists table has changed and the compiled blacklists need reloading
+    'blacklist_check_interval': 60,
+
+    # regex_check_interval: same again, but for the compiled binary regexes
+    'regex_check_interval': 60,
+
+    # binary_stem_cache_size: number of subjects (with the part counter taken out)
+    # to remember the matching regex for. every part of a binary after the first
+    # then skips the regexes entirely. 0 to turn it off
+    'binary_stem_cache_size': 100000,
+
+    # async_scan: scan every group from a single asyncio event loop
+    # instead of a thread and a blocking connection per group
+    # connections are shared between groups, up to max_connections
+    # only scans from the main news server: other providers and failover are ignored
+    # experimental, leave off unless you've got a lot of groups
+    'async_scan': False,
+
     # group_scan_limit: maximum number of messages to take from each group per scan
     # useful for very active groups on limited hardware
     # a scan iteration will only take this many messages per group before processing
@@ -138,6 +198,13 @@ scan = {
     # ...i probably wouldn't go much higher than that
     'binary_process_chunk_size': 10000,
 
+    # binary_process_workers: number of processes to match parts against regex with
+    # binary processing is cpu-bound and normally only uses one core, so on a
+    # big backlog set this to (about) the number of cores you have
+    # each worker keeps its own copy of the regex, so memory goes up a bit too
+    # 1 does it all in the scan process, like before
+    'binary_process_workers': 1,
+
     # dead_binary_age: number of days to keep binaries for matching
     # realistically if they're not completed after a day or two, they're not going to be
     # set this to 3 days or so
@@ -199,6 +266,8 @@ postprocess = {
     # if it's lower than this, it'll get removed eventually
     # it'll only create releases of this completion if 3 hours have passed to make sure
     # we're not accidentally cutting off the end of a new release
+    # completion is worked out as parts and segments are saved, so changes to this
+    # only apply to binaries once they get more parts or segments
     'min_completion': 100,
 
     # 100% completion resulted in about 11,000 unmatched releases after 4 weeks over 6 groups
@@ -274,6 +343,20 @@ postprocess = {
     # this can be used to clean release names, etc
     'process_sfvs': False,
 
+    # body_pipeline_depth: number of article BODYs to keep in flight at once
+    # when fetching nfos, sfvs and rars for post-processing
+    # these are small and plentiful, so round trips are most of the cost. set to 1 to disable
+    'body_pipeline_depth': 8,
+
+    # article_cache_dir: directory to keep downloaded nfo/sfv/rar articles in
+    # saves downloading them again when releases are reprocessed, and lets
+    # you re-run post-processing offline. set to None to disable
+    'article_cache_dir': None,
+
+    # article_cache_size: maximum size of the article cache, in bytes
+    # articles are stored gzipped, and the least recently used go first
+    'article_cache_size': 1024 * 1024 * 1024,
+
     # process requests: query the pre table to
     # try and discover names from request ids
     'process_requests': True,
@@ -332,6 +415,53 @@ db = {
     'user': '',
     'pass': '',
     'db': 'pynab',
+
+    # binary_copy: save parts and segments with postgres' binary COPY
+    # rather than csv, which is a fair bit quicker on big scans
+    # postgres only, and falls back to csv if it fails
+    'binary_copy': True,
+
+    # upsert_parts: save parts and segments through temporary staging tables
+    # and let postgres work out which are new (insert ... on conflict)
+    # rather than loading every existing segment to compare against
+    # postgres 9.5+ only, and needs alembic to be up to date
+    'upsert_parts': True,
+
+    # compact_message_ids: store message-ids with their domain (ie. @JBinUp.local)
+    # swapped for an id from a lookup table, since a few domains are most of the
+    # repetition. they're put back when nzbs are made
+    # existing segments are converted by alembic upgrade head (postgres only)
+    'compact_message_ids': True,
+
+    # packed_segments: store each part's segments packed into arrays on the part
+    # instead of as one row each in the segments table. roughly 50x fewer rows
+    # to index and vacuum. isn't used with partitioned_parts
+    # postgres only. run alembic upgrade head after turning it on to pack existing segments
+    'packed_segments': False,
+
+    # partitioned_parts: keep parts and segments in unlogged, partitioned tables
+    # they're only scratch space, so this skips writing them to the WAL and lets
+    # expired parts be dropped a partition at a time instead of row by row,
+    # so they don't need vacuum full any more. postgres 12+ only
+    # unlogged tables are emptied if postgres crashes - you'll just need to rescan
+    # set this before running install.py or alembic upgrade head. to switch an
+    # existing db, stop scan.py, change this and run scripts/switch_partitioning.py
+    # (don't alembic downgrade to the partitioning migration - that also undoes
+    # every migration after it, ie. packed segments, message-id domains and
+    # completion counts)
+    'partitioned_parts': False,
+
+    # partition_size: number of part ids per partition
+    # older partitions are dropped once all their parts are past dead_binary_age
+    # don't change this once partitions exist
+    'partition_size': 1000000,
+
+    # server_side_cursors: stream ids for big batch jobs (binary processing,
+    # post-processing, requests) from a server-side cursor on its own connection
+    # rather than looking up each window as it goes
+    # both start returning rows straight away, this just saves a query per window
+    # postgres only
+    'server_side_cursors': False,
 }
 
 # usenet server details
@@ -354,6 +484,33 @@ news = {
     
     # timeout: don't change this
     'timeout': 60,
+
+    # max_connections: maximum number of connections to open to the server
+    # this is shared by everything in a process (scan threads, postprocess threads)
+    # so keep it under your provider's limit, leaving room for scan and postprocess
+    # to run at the same time
+    'max_connections': 10,
+
+    # idle_timeout: close pooled connections that haven't been used in this many seconds
+    'idle_timeout': 300,
+
+    # providers: any other providers to use alongside this one
+    # each is set up like this block (host, user, password, port, ssl, timeout,
+    # max_connections, idle_timeout) plus:
+    #   name: what to call it in the logs
+    #   role: 'primary' - scanned from alongside this one, least-loaded first
+    #                     article numbers are per-backbone, so only use this for
+    #                     providers on the same backbone as this one
+    #         'fill' - only asked for articles the primaries don't have (430s)
+    #         'backup' - only used when nothing else will connect
+    #   priority: lower gets asked first (this block is 0)
+    # ie.
+    # 'providers': [
+    #     {'name': 'blockaccount', 'host': 'news.example.com', 'user': '', 'password': '',
+    #      'port': 563, 'ssl': True, 'timeout': 60, 'max_connections': 5,
+    #      'role': 'fill', 'priority': 10},
+    # ],
+    'providers': [],
 }
 
 # xmpp pubsub bot
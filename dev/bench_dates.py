@@ -0,0 +1,52 @@
+"""Times pynab.dates.parse_date against dateutil.parser.parse on a chunk's
+worth of overview dates, most of them repeats like a real scan.
+
+Usage: python dev/bench_dates.py [<dates>] [<runs>]"""
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import dateutil.parser
+
+import pynab.dates
+
+DATES = [
+    'Sat, 17 Oct 2015 10:02:41 +0000',
+    'Sat, 17 Oct 2015 10:02:41 -0500',
+    '17 Oct 2015 10:02:41 GMT',
+    'Sat, 17 Oct 15 10:02 +0130 (CEST)',
+    'Saturday, 17 October 2015 10:02:41 UTC',
+    '17 Oct 2015 10:02:41',
+    '2015-10-17T10:02:41Z',
+]
+
+
+def bench(count=10000, runs=3):
+    # the first four are the usual rfc 5322 ones, which is what a scan mostly sees
+    chunk = [DATES[i % 4] for i in range(count)]
+    # and every one different, so the cache can't help
+    unique = ['Sat, 17 Oct 2015 {:02d}:{:02d}:{:02d} +0000'.format(i // 3600 % 24, i // 60 % 60, i % 60)
+              for i in range(count)]
+
+    for date in DATES:
+        if pynab.dates.parse_date(date) != dateutil.parser.parse(date):
+            print('mismatch: {}'.format(date))
+
+    def run(name, fn, dates):
+        pynab.dates.parse_date.cache_clear()
+        taken = timeit.timeit(lambda: [fn(d) for d in dates], number=runs)
+        print('{:<28} {:.3f}s ({:.1f}us each)'.format(name, taken, taken / runs / len(dates) * 1000000))
+
+    print('{} dates, {} runs each'.format(count, runs))
+    run('dateutil', dateutil.parser.parse, chunk)
+    run('parse_date', pynab.dates.parse_date, chunk)
+    run('parse_date (uncached)', pynab.dates.parse_date.__wrapped__, chunk)
+    run('dateutil, unique', dateutil.parser.parse, unique)
+    run('parse_date, unique', pynab.dates.parse_date, unique)
+
+
+if __name__ == '__main__':
+    bench(*[int(arg) for arg in sys.argv[1:3]])
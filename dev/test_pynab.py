@@ -216,6 +216,570 @@ class TestPynab(unittest.TestCase):
 
         print('accuracy={}'.format(1 - (len(errors)/i)))
 
+    def test_parse_date(self):
+        import datetime
+        import dateutil.parser
+        import pynab.dates
+
+        def tz(hours, minutes=0):
+            return datetime.timezone(datetime.timedelta(hours=hours, minutes=minutes))
+
+        dates = [
+            ('Sat, 17 Oct 2015 10:02:41 +0000', datetime.datetime(2015, 10, 17, 10, 2, 41, tzinfo=tz(0))),
+            ('Sat, 17 Oct 2015 10:02:41 -0500', datetime.datetime(2015, 10, 17, 10, 2, 41, tzinfo=tz(-5))),
+            ('Sat,17 Oct 2015 10:02:41 +0530', datetime.datetime(2015, 10, 17, 10, 2, 41, tzinfo=tz(5, 30))),
+            ('17 Oct 2015 10:02:41 GMT', datetime.datetime(2015, 10, 17, 10, 2, 41, tzinfo=tz(0))),
+            ('17 Oct 2015 10:02:41 EDT', datetime.datetime(2015, 10, 17, 10, 2, 41, tzinfo=tz(-4))),
+            # two-digit years, no seconds and a comment
+            ('Sat, 17 Oct 15 10:02 +0130 (CEST)', datetime.datetime(2015, 10, 17, 10, 2, 0, tzinfo=tz(1, 30))),
+            ('Fri, 17 Oct 97 10:02:41 +0000', datetime.datetime(1997, 10, 17, 10, 2, 41, tzinfo=tz(0))),
+            # no zone at all comes back naive
+            ('17 Oct 2015 10:02:41', datetime.datetime(2015, 10, 17, 10, 2, 41)),
+        ]
+
+        for date, expected in dates:
+            parsed = pynab.dates.parse_date(date)
+            self.assertEqual(parsed, expected, date)
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset(), date)
+
+        # anything the regex doesn't handle goes to dateutil
+        for date in ['2015-10-17T10:02:41Z', 'Saturday, 17 October 2015 10:02:41 UTC',
+                     '17 Oct 2015 10:02:41 A', '29 Feb 2015 10:02:41 +0000']:
+            try:
+                expected = dateutil.parser.parse(date)
+            except ValueError:
+                self.assertRaises(ValueError, pynab.dates.parse_date, date)
+            else:
+                self.assertEqual(pynab.dates.parse_date(date), expected, date)
+
+        self.assertRaises(ValueError, pynab.dates.parse_date, 'not a date')
+
+    def test_required_literals(self):
+        import pynab.regexes
+
+        # pattern, case-insensitive, a subject it matches
+        cases = [
+            (r'^(?P<name>.+?)\.part\d+\.rar', False, 'something.part01.rar'),
+            (r'\[(?P<parts>\d+/\d+)\] - "(?P<name>.*?)" yEnc', False, '[01/10] - "file.nfo" yEnc'),
+            (r'abc?def', False, 'abdef'),
+            (r'x{0,3}yz{2}w', False, 'yzzw'),
+            (r'(?P<name>.+?)\.vol\d+\+\d+\.PAR2', True, 'thing.VOL01+02.par2'),
+            (r'TEST', True, 'a test with a dotless \u0131: TEST'),
+            # classes with things nested in them don't end at the first ]
+            (r'abc[[:alpha:]]de', False, 'abcXde'),
+            (r'(?P<name>[[:alnum:]_]+)\.nfo', False, 'some_file.nfo'),
+            (r'(?V1)abc[[a-z]--[aeiou]]de', False, 'abcxde'),
+            (r'(?V1)abc[\w&&[^\d]]de', False, 'abcxde'),
+        ]
+
+        for pattern, insensitive, subject in cases:
+            self.assertTrue(regex.search(pattern, subject, regex.I if insensitive else 0), pattern)
+            for literal in pynab.regexes.required_literals(pattern):
+                if insensitive:
+                    self.assertIn(pynab.regexes.fold(literal), pynab.regexes.fold(subject), pattern)
+                else:
+                    self.assertIn(literal, subject, pattern)
+
+        self.assertEqual(pynab.regexes.required_literals(r'foo|bar'), [])
+        self.assertEqual(pynab.regexes.required_literals(r'abc[[:alpha:]]de'), [])
+        self.assertEqual(pynab.regexes.required_literals(r'(?V1)[[a-z]--[aeiou]]de'), [])
+
+    def test_yenc_decode(self):
+        import pynab.yenc
+
+        data = b'\x13\xd3\xd6\xe3\xe0A=\x00\xffpynab'
+        # escaped =, a == (some encoders escape more than they have to), NUL, CR and LF
+        lines = [
+            b'=ybegin line=128 size=14 name=test.bin',
+            b'=}===@=M=Jkg*)\x9a\xa3\x98\x8b\x8c',
+            b'=yend size=14 crc32=a4e50f46',
+        ]
+        self.assertEqual(pynab.yenc.yenc_decode(lines), data)
+
+        # same again as a part, with a bad part crc
+        lines = [
+            b'=ybegin part=1 total=1 line=128 size=14 name=test.bin',
+            b'=ypart begin=1 end=14',
+            b'=}===@=M=Jkg*)\x9a\xa3\x98\x8b\x8c',
+            b'=yend size=14 part=1 pcrc32=00000000',
+        ]
+        self.assertIsNone(pynab.yenc.yenc_decode(lines))
+
+        self.assertEqual(pynab.yenc.yenc_unescape(b'a==b=}c'), b'a\xfdb=c')
+
+    def test_connection_pool(self):
+        import pynab.server
+
+        class Connection:
+            dirty = False
+            closed = False
+
+            def quit(self):
+                self.closed = True
+
+        pool = pynab.server.ConnectionPool(
+            {'name': 'test', 'role': 'primary', 'priority': 0}, max_connections=2
+        )
+        pool._create = lambda compression: Connection()
+
+        first = pool.checkout()
+        second = pool.checkout()
+        self.assertEqual(pool.in_use, 2)
+
+        # a clean connection goes back to be reused
+        pool.checkin(first)
+        self.assertEqual(pool.in_use, 1)
+        self.assertIs(pool.checkout(), first)
+
+        # one left out of sync gets closed instead
+        first.dirty = True
+        pool.checkin(first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.idle, [])
+        self.assertEqual(pool.in_use, 1)
+
+        # and so does a broken one, freeing its slot for a new one
+        pool.discard(second)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.in_use, 0)
+        self.assertIsNot(pool.checkout(), second)
+
+    def test_copy_binary_stream(self):
+        import datetime
+        import struct
+        from pynab.db import CopyBinaryStream, COPY_BINARY_HEADER, COPY_BINARY_TRAILER, _pack_field
+
+        self.assertEqual(_pack_field(None, 'int8'), struct.pack('>i', -1))
+        self.assertEqual(_pack_field(5, 'int4'), struct.pack('>ii', 4, 5))
+        self.assertEqual(_pack_field(2 ** 40, 'int8'), struct.pack('>iq', 8, 2 ** 40))
+        # microseconds since 2000-01-01
+        self.assertEqual(_pack_field(datetime.datetime(2000, 1, 2, 0, 0, 1, 5), 'timestamp'),
+                         struct.pack('>iq', 8, 86401000005))
+        # nulls can't go in text
+        self.assertEqual(_pack_field('a\x00é', 'text'), struct.pack('>i', 3) + b'a\xc3\xa9')
+        self.assertEqual(_pack_field([1, 2], 'int4[]'),
+                         struct.pack('>i', 36) + struct.pack('>iiiii', 1, 0, 23, 2, 1) +
+                         struct.pack('>iiii', 4, 1, 4, 2))
+        # varchar arrays have to say so, or postgres won't take them
+        self.assertEqual(_pack_field(['ab'], 'varchar[]'),
+                         struct.pack('>i', 26) + struct.pack('>iiiii', 1, 0, 1043, 1, 1) +
+                         struct.pack('>i', 2) + b'ab')
+
+        columns = [('id', 'int8'), ('name', 'text')]
+        rows = [{'id': 1, 'name': 'x'}, {'id': 2, 'name': None}]
+
+        # read it in awkward sizes, to make sure nothing gets lost between rows
+        stream = CopyBinaryStream(rows, columns)
+        data = b''
+        while True:
+            chunk = stream.read(7)
+            if not chunk:
+                break
+            data += chunk
+
+        self.assertEqual(data, COPY_BINARY_HEADER +
+                         struct.pack('>h', 2) + _pack_field(1, 'int8') + _pack_field('x', 'text') +
+                         struct.pack('>h', 2) + _pack_field(2, 'int8') + _pack_field(None, 'text') +
+                         COPY_BINARY_TRAILER)
+        self.assertEqual(CopyBinaryStream([], columns).read(), COPY_BINARY_HEADER + COPY_BINARY_TRAILER)
+
+    def test_save_parts_twice(self):
+        import config
+        import pynab.msgids
+        from pynab.server import add_segment
+        from pynab.db import Part
+
+        def overview(segment):
+            return {
+                'subject': 'pynab test - "test.rar" yEnc ({}/3)'.format(segment),
+                'from': 'tester <test@pynab.local>',
+                ':bytes': '100',
+                'date': 'Sat, 17 Oct 2015 10:02:41 +0000',
+                'xref': '',
+                'message-id': '<{}.part@pynab.local>'.format(segment),
+            }
+
+        savers = [('alt.binaries.pynab.test', pynab.parts.save_all)]
+        if 'postgre' in config.db.get('engine'):
+            # make sure the upsert itself gets tested, whatever the config says
+            savers.append(('alt.binaries.pynab.test.upsert', pynab.parts._upsert_all))
+
+        for group_name, save in savers:
+            try:
+                # the second scan sees a segment we've already got, and one we haven't
+                for segments in [(1, 2), (2, 3)]:
+                    parts = {}
+                    for segment in segments:
+                        add_segment(parts, group_name, overview(segment))
+                    pynab.msgids.encode_parts(parts)
+                    self.assertTrue(save(parts), group_name)
+
+                with db_session() as db:
+                    parts = db.query(Part).filter(Part.group_name == group_name).all()
+                    self.assertEqual(len(parts), 1, group_name)
+                    self.assertEqual(sorted(s.segment for s in parts[0].get_segments()), [1, 2, 3], group_name)
+                    self.assertEqual(parts[0].available_segments, 3, group_name)
+            finally:
+                with db_session() as db:
+                    db.query(Part).filter(Part.group_name == group_name).delete()
+                    db.commit()
+
+    def test_message_id_round_trip(self):
+        import pynab.msgids
+
+        codec = pynab.msgids.codec
+        for message_id in ['part1of10.abc123@powerpost2000AA.local', 'x@JBinUp.local', 'a@b@c.example']:
+            encoded = codec.encode(message_id)
+            self.assertNotEqual(encoded, message_id)
+            self.assertIn(pynab.msgids.SEPARATOR, encoded)
+            self.assertEqual(codec.decode(encoded), message_id)
+            # encoding twice changes nothing
+            self.assertEqual(codec.encode(encoded), encoded)
+
+        # the same domain gets the same id
+        self.assertEqual(codec.encode('a@JBinUp.local').split(pynab.msgids.SEPARATOR)[1],
+                         codec.encode('b@JBinUp.local').split(pynab.msgids.SEPARATOR)[1])
+
+        # anything that isn't a normal message-id, or was stored before, is left alone
+        for stored in ['no-domain-here', 'trailing@', '', None]:
+            self.assertEqual(codec.encode(stored), stored)
+            self.assertEqual(codec.decode(stored), stored)
+
+    def test_update_completion(self):
+        import datetime
+        import config
+        import pynab.binaries
+        from pynab.db import Binary, Part
+
+        min_completion = int(config.postprocess.get('min_completion', 100))
+        posted = datetime.datetime(2015, 10, 17, 10, 2, 41)
+
+        with db_session() as db:
+            binary = Binary(hash=-1, name='pynab test', total_parts=2, posted=posted, posted_by='tester',
+                            xref='', group_name='alt.binaries.pynab.test')
+            db.add(binary)
+            db.flush()
+
+            try:
+                parts = [
+                    Part(hash=-1 - i, subject='pynab test', total_segments=10, available_segments=available,
+                         posted=posted, posted_by='tester', xref='', group_name='alt.binaries.pynab.test',
+                         binary_id=binary.id)
+                    for i, available in enumerate([10, 9])
+                ]
+
+                # only one of the two parts so far
+                db.add(parts[0])
+                db.flush()
+                pynab.binaries.update_completion(db, [binary.id])
+                db.commit()
+                db.refresh(binary)
+                self.assertEqual((binary.available_parts, binary.available_segments, binary.total_segments),
+                                 (1, 10, 10))
+                self.assertFalse(binary.complete)
+
+                # both, with 19 of 20 segments
+                db.add(parts[1])
+                db.flush()
+                pynab.binaries.update_completion(db, [binary.id])
+                db.commit()
+                db.refresh(binary)
+                self.assertEqual((binary.available_parts, binary.available_segments, binary.total_segments),
+                                 (2, 19, 20))
+                self.assertEqual(binary.complete, 95 >= min_completion)
+
+                # and the last segment turns up
+                parts[1].available_segments = 10
+                db.flush()
+                pynab.binaries.update_completion(db, [binary.id])
+                db.commit()
+                db.refresh(binary)
+                self.assertTrue(binary.complete)
+            finally:
+                db.query(Binary).filter(Binary.id == binary.id).delete()
+                db.commit()
+
+    def test_stem_cache(self):
+        import pynab.binaries
+
+        class Regexes:
+            """Stands in for the regex engine, counting searches."""
+            generation = 1
+            searches = 0
+            patterns = [
+                (1, regex.compile(r'^(?P<name>.+?) \[(?P<parts>\d+/\d+)\]')),
+                (2, regex.compile(r'^\[(?P<name>\d+)/\d+\] nfo')),
+            ]
+
+            def search(self, group_name, subject):
+                self.searches += 1
+                for id, compiled in self.patterns:
+                    result = compiled.search(subject)
+                    if result:
+                        yield id, result
+
+        regexes = Regexes()
+        stems = pynab.binaries.StemCache(max_size=10)
+        group_name = 'alt.binaries.pynab.test'
+
+        self.assertEqual(stems.match(regexes, group_name, 'some.file [01/10]'), (1, 'some.file', '01', '10'))
+        # same stem, so no searching
+        self.assertEqual(stems.match(regexes, group_name, 'some.file [02/10]'), (1, 'some.file', '02', '10'))
+        self.assertEqual((stems.hits, stems.misses, regexes.searches), (1, 1, 1))
+
+        # a different number of digits is a different stem
+        self.assertEqual(stems.match(regexes, group_name, 'some.file [100/120]'), (1, 'some.file', '100', '120'))
+        self.assertEqual(regexes.searches, 2)
+
+        # the name comes from the counter, so it can't be reused
+        self.assertEqual(stems.match(regexes, group_name, '[1/10] nfo'), (2, '1', '1', '10'))
+        self.assertEqual(stems.match(regexes, group_name, '[2/10] nfo'), (2, '2', '2', '10'))
+        self.assertEqual(regexes.searches, 4)
+
+        # no match is remembered too
+        self.assertIsNone(stems.match(regexes, group_name, 'nothing (1/2) here'))
+        self.assertIsNone(stems.match(regexes, group_name, 'nothing (2/2) here'))
+        self.assertEqual(regexes.searches, 5)
+
+        # and everything's forgotten when the regexes change
+        regexes.generation += 1
+        stems.match(regexes, group_name, 'some.file [03/10]')
+        self.assertEqual(regexes.searches, 6)
+
+    def test_windowed_query(self):
+        import config
+        from pynab.db import Regex, windowed_query, _keyset_windows, _streamed_windows
+
+        with db_session() as db:
+            ids = [id for id, in db.query(Regex.id).order_by(Regex.id)]
+            self.assertTrue(ids, 'needs regexes loaded')
+            chunks = [ids[i:i + 7] for i in range(0, len(ids), 7)]
+
+            query = db.query(Regex)
+            self.assertEqual([r.id for r in windowed_query(query, Regex.id, 7)], ids)
+            self.assertEqual(list(windowed_query(query.filter(Regex.id < 0), Regex.id, 7)), [])
+
+            # windows go up by id, but the query's own order holds inside each one
+            self.assertEqual([r.id for r in windowed_query(query.order_by(Regex.id.desc()), Regex.id, 7)],
+                             [id for chunk in chunks for id in reversed(chunk)])
+
+            windows = [_keyset_windows]
+            if 'postgre' in config.db.get('engine'):
+                windows.append(_streamed_windows)
+
+            for window in windows:
+                found = []
+                for whereclause in window(query, Regex.id, 7):
+                    found.append([r.id for r in query.filter(whereclause).order_by(Regex.id)])
+                # the last keyset window is just 'anything after', so it can come up empty
+                self.assertEqual([f for f in found if f], chunks, window.__name__)
+
+    def test_save_packed_parts(self):
+        import config
+        import pynab.partitions
+        from pynab.server import add_segment
+        from pynab.db import Part
+
+        if 'postgre' not in config.db.get('engine') or pynab.partitions.enabled():
+            self.skipTest('packed segments need postgres, without partitions')
+
+        group_name = 'alt.binaries.pynab.test.packed'
+
+        def overview(segment):
+            return {
+                'subject': 'pynab test - "test.rar" yEnc ({}/3)'.format(segment),
+                'from': 'tester <test@pynab.local>',
+                ':bytes': '100',
+                'date': 'Sat, 17 Oct 2015 10:02:41 +0000',
+                'xref': '',
+                'message-id': '<{}.packed@pynab.local>'.format(segment),
+            }
+
+        try:
+            for segments in [(1, 2), (2, 3)]:
+                parts = {}
+                for segment in segments:
+                    add_segment(parts, group_name, overview(segment))
+                # False would mean it fell back to saving segments as rows
+                self.assertTrue(pynab.parts._upsert_packed(parts))
+
+            with db_session() as db:
+                part = db.query(Part).filter(Part.group_name == group_name).one()
+                self.assertEqual(sorted(part.segment_numbers), [1, 2, 3])
+                self.assertEqual(sorted(part.segment_ids), ['{}.packed@pynab.local'.format(i) for i in (1, 2, 3)])
+                self.assertEqual(part.segments, [])
+                self.assertEqual(part.available_segments, 3)
+        finally:
+            with db_session() as db:
+                db.query(Part).filter(Part.group_name == group_name).delete()
+                db.commit()
+
+    def test_compressed_over(self):
+        import zlib
+        import lib.nntplib as nntplib
+
+        class SocketFile:
+            """Hands out what's been 'received' a chunk at a time, like recv()."""
+            def __init__(self, *chunks):
+                self.chunks = [chunk for chunk in chunks if chunk]
+                self.sent = b''
+
+            def peek(self, size=1):
+                return self.chunks[0][:size] if self.chunks else b''
+
+            def read(self, size):
+                data = b''
+                while size and self.chunks:
+                    taken, self.chunks[0] = self.chunks[0][:size], self.chunks[0][size:]
+                    if not self.chunks[0]:
+                        self.chunks.pop(0)
+                    data += taken
+                    size -= len(taken)
+                return data
+
+            def readline(self):
+                line = b''
+                while self.chunks and not line.endswith(b'\n'):
+                    end = self.chunks[0].find(b'\n')
+                    line += self.read(end + 1 if end >= 0 else len(self.chunks[0]))
+                return line
+
+            def write(self, data):
+                self.sent += data
+
+            def flush(self):
+                pass
+
+        def connection(*chunks):
+            conn = object.__new__(nntplib._NNTPBase)
+            conn.file = SocketFile(*chunks)
+            conn.debugging = 0
+            conn.bytes_received = 0
+            conn.dirty = False
+            conn.compressionstatus = True
+            conn._caps = {'OVER': []}
+            conn._cachedoverviewfmt = nntplib._DEFAULT_OVERVIEW_FMT[:]
+            return conn
+
+        body = b'1\tsubject one\tposter\tSat, 17 Oct 2015 10:02:41 +0000\t<one@example>\t\t100\t1\r\n' \
+               b'2\tsubject two\tposter\tSat, 17 Oct 2015 10:02:42 +0000\t<two@example>\t\t200\t2\r\n'
+        lines = body.split(b'\r\n')[:-1]
+
+        # terminator compressed inside the last block, with the next response right behind it
+        conn = connection(zlib.compress(body + b'.\r\n') + b'224 next\r\n')
+        self.assertEqual(list(conn._itercompresp()), lines)
+        self.assertEqual(conn._getresp(), '224 next')
+
+        # terminator split across two blocks
+        compressor = zlib.compressobj()
+        first = compressor.compress(body + b'.') + compressor.flush(zlib.Z_SYNC_FLUSH)
+        conn = connection(first, compressor.compress(b'\r\n') + compressor.flush() + b'224 next\r\n')
+        self.assertEqual(list(conn._itercompresp()), lines)
+        self.assertEqual(conn._getresp(), '224 next')
+
+        # compressed data ending on a block boundary, terminator in the clear after it
+        data = zlib.compress(body)
+        conn = connection(data[:len(data) // 2], data[len(data) // 2:], b'.\r\n', b'224 next\r\n')
+        self.assertEqual(list(conn._itercompresp()), lines)
+        self.assertEqual(conn._getresp(), '224 next')
+        self.assertEqual(conn.bytes_received, len(data) + len(b'.\r\n') + len(b'224 next\r\n'))
+
+        # empty responses, either way of terminating them
+        conn = connection(zlib.compress(b'.\r\n') + b'224 next\r\n')
+        self.assertEqual(list(conn._itercompresp()), [])
+        self.assertEqual(conn._getresp(), '224 next')
+
+        conn = connection(zlib.compress(b''), b'.\r\n')
+        self.assertEqual(list(conn._itercompresp()), [])
+
+        # and the connection dropping halfway
+        conn = connection(data[:len(data) // 2])
+        self.assertRaises(EOFError, list, conn._itercompresp())
+
+        # pipelined, with a refused range in the middle and an empty one at the end
+        conn = connection(b'224 ok\r\n' + zlib.compress(body + b'.\r\n'), b'423 no articles\r\n',
+                          b'224 ok\r\n', zlib.compress(b'.\r\n'))
+        results = [(spec, list(overviews))
+                   for spec, overviews in conn.over_pipelined([(1, 2), (3, 4), (5, 6)], depth=2)]
+
+        self.assertEqual(conn.file.sent, b'OVER 1-2\r\nOVER 3-4\r\nOVER 5-6\r\n')
+        self.assertEqual([spec for spec, _ in results], [(1, 2), (3, 4), (5, 6)])
+        self.assertEqual([number for number, _ in results[0][1]], [1, 2])
+        self.assertEqual(results[0][1][1][1]['message-id'], '<two@example>')
+        self.assertEqual(results[1][1], [])
+        self.assertEqual(results[2][1], [])
+        self.assertFalse(conn.dirty)
+
+        # stopping early reads off whatever's still in flight
+        conn = connection(b'224 ok\r\n' + zlib.compress(body + b'.\r\n'), b'224 ok\r\n' + zlib.compress(body),
+                          b'.\r\n')
+        pipeline = conn.over_pipelined([(1, 2), (3, 4)], depth=2)
+        next(pipeline)
+        pipeline.close()
+        self.assertEqual(conn.file.chunks, [])
+        self.assertFalse(conn.dirty)
+
+    def test_blacklist_matcher(self):
+        import types
+        import regex
+        import pynab.blacklists
+
+        blacklists = [types.SimpleNamespace(id=id, group_name=group_name, field=field, regex=pattern, status=True)
+                      for id, (group_name, field, pattern) in enumerate([
+                          ('alt\\.binaries\\.(tv|hdtv)', 'subject', 'german|\\.ger\\.'),
+                          ('alt\\.binaries\\.tv', 'subject', '^\\[\\d+/\\d+\\] - "sample'),
+                          ('.*', 'subject', '(?i)password'),
+                          ('.*', 'subject', '(\\w+)\\.\\1\\.'),
+                          ('.*', 'posted_by', '@spam\\.example'),
+                          ('alt\\.binaries\\.e-book', 'subject', '\\.(exe|scr)"'),
+                          ('.*', 'subject', 'dutch|NLSubs'),
+                      ], start=1)]
+
+        def old_is_blacklisted(part, group_name):
+            # the loop the matcher replaced
+            for blacklist in blacklists:
+                if regex.search(blacklist.group_name, group_name):
+                    if regex.search(blacklist.regex, part[blacklist.field]):
+                        return True
+            return False
+
+        subjects = [
+            'Some.Show.S01E01.German.720p [01/20] - "show.part01.rar"',
+            'some.show.s01e01.ger.720p [01/20] - "show.part01.rar"',
+            '[01/20] - "sample.mkv" yEnc',
+            'PassWord protected [1/1] - "a.rar"',
+            'movie.movie.2015 [1/5] - "movie.nfo"',
+            'book [1/1] - "book.exe" yEnc',
+            'Film.2015.DUTCH [1/5] - "film.rar"',
+            'Film.2015.NLSubs [1/5] - "film.rar"',
+            'Perfectly.Fine.2015.1080p [1/5] - "fine.rar"',
+        ]
+        posters = ['someone@example.com', 'bot@spam.example']
+        groups = ['alt.binaries.tv', 'alt.binaries.hdtv', 'alt.binaries.e-book', 'alt.binaries.misc']
+
+        matcher = pynab.blacklists.BlacklistMatcher(blacklists=blacklists)
+        by_id = dict((blacklist.id, blacklist) for blacklist in blacklists)
+        for group_name in groups:
+            for subject in subjects:
+                for poster in posters:
+                    part = {'subject': subject, 'posted_by': poster}
+                    id = matcher.match(group_name, part)
+                    self.assertEqual(id is not None, old_is_blacklisted(part, group_name),
+                                     (group_name, subject, poster))
+
+                    # and it says which one did it
+                    if id is not None:
+                        blacklist = by_id[id]
+                        self.assertTrue(regex.search(blacklist.group_name, group_name))
+                        self.assertTrue(regex.search(blacklist.regex, part[blacklist.field]))
+
+        # a bad regex is skipped rather than taking the rest down with it
+        broken = blacklists + [types.SimpleNamespace(id=99, group_name='.*', field='subject', regex='(unclosed',
+                                                     status=True)]
+        matcher = pynab.blacklists.BlacklistMatcher(blacklists=broken)
+        self.assertEqual(matcher.match('alt.binaries.misc', {'subject': 'film.dutch', 'posted_by': ''}), 7)
+        self.assertIsNone(matcher.match('alt.binaries.misc', {'subject': '(unclosed', 'posted_by': ''}))
+
     def tearDown(self):
         try:
             self.server.connection.quit()
@@ -31,6 +31,12 @@ if __name__ == '__main__':
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
 
+    import pynab.partitions
+    if pynab.partitions.enabled():
+        print('Partitioning parts and segments...')
+        with engine.begin() as conn:
+            pynab.partitions.partition(conn)
+
     from alembic.config import Config
     from alembic import command
 
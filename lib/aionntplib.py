@@ -0,0 +1,345 @@
+"""An asyncio NNTP client, with the same command surface as lib.nntplib
+for the commands pynab actually uses (GROUP, OVER/XOVER, BODY, HEAD, STAT
+and XFEATURE COMPRESS GZIP).
+
+Example:
+
+>>> import asyncio
+>>> from lib.aionntplib import NNTP
+>>> async def main():
+...     s = NNTP('news')
+...     await s.connect()
+...     resp, count, first, last, name = await s.group('comp.lang.python')
+...     resp, overviews = await s.over((last - 10, last))
+...     await s.quit()
+>>> asyncio.get_event_loop().run_until_complete(main())
+
+Responses are parsed with the same helpers as lib.nntplib, and errors are
+raised as the same exceptions, so callers can handle both the same way.
+"""
+
+import asyncio
+import zlib
+
+try:
+    import ssl
+except ImportError:
+    _have_ssl = False
+else:
+    _have_ssl = True
+
+from lib.nntplib import NNTPError, NNTPReplyError, NNTPTemporaryError, NNTPPermanentError, \
+    NNTPProtocolError, NNTPDataError, ArticleInfo, NNTP_PORT, NNTP_SSL_PORT, \
+    _LONGRESP, _CRLF, _DEFAULT_OVERVIEW_FMT, _parse_overview_fmt, _parse_overview
+
+__all__ = ["NNTP",
+           "NNTPError", "NNTPReplyError", "NNTPTemporaryError",
+           "NNTPPermanentError", "NNTPProtocolError", "NNTPDataError",
+           ]
+
+# How much to read off the socket at a time
+_READ_SIZE = 65536
+
+
+class NNTP:
+    # see lib.nntplib._NNTPBase for why these are what they are
+    encoding = 'utf-8'
+    errors = 'surrogateescape'
+
+    def __init__(self, host, port=None, user=None, password=None, ssl=False,
+                 ssl_context=None, readermode=None, timeout=60, compression=True):
+        """Set up an instance. Nothing happens on the network until
+        connect() is awaited. Arguments are as for lib.nntplib.NNTP, plus:
+        - ssl: whether to connect over SSL/TLS
+        - ssl_context: SSL context to use for the encrypted connection
+        """
+        self.host = host
+        self.port = port or (NNTP_SSL_PORT if ssl else NNTP_PORT)
+        self.user = user
+        self.password = password
+        self.ssl = ssl
+        self.ssl_context = ssl_context
+        self.readermode = readermode
+        self.timeout = timeout
+        self.compression_requested = compression
+
+        self.reader = None
+        self.writer = None
+        self.welcome = None
+        self.compressionstatus = False
+        self.current_group = None
+
+        self._caps = {}
+        self._buffer = bytearray()
+        self._cachedoverviewfmt = None
+
+    async def connect(self):
+        """Open the connection, log in and turn on compression if asked."""
+        context = None
+        if self.ssl:
+            if not _have_ssl:
+                raise NNTPError('SSL support is not available.')
+            context = self.ssl_context
+            if context is None:
+                context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+                context.options |= ssl.OP_NO_SSLv2
+                context.options |= ssl.OP_NO_SSLv3
+
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context,
+                                    server_hostname=self.host if context else None),
+            self.timeout
+        )
+
+        self.welcome = await self._getresp()
+        self._caps = await self._getcapabilities()
+
+        if self.readermode and 'READER' not in self._caps:
+            try:
+                self.welcome = await self._shortcmd('mode reader')
+            except NNTPPermanentError:
+                pass
+
+        if self.user:
+            await self.login(self.user, self.password)
+
+        if self.compression_requested:
+            self.compressionstatus = await self.compression()
+
+        return self.welcome
+
+    # -----------------------------------------------------------------
+    # low-level line handling
+    # we keep our own buffer rather than relying on the StreamReader's,
+    # so that anything read past the end of a compressed response can
+    # be left where the next response will find it
+    # -----------------------------------------------------------------
+
+    async def _fill(self):
+        data = await asyncio.wait_for(self.reader.read(_READ_SIZE), self.timeout)
+        if not data:
+            raise EOFError
+        self._buffer += data
+
+    async def _putcmd(self, line):
+        self.writer.write(line.encode(self.encoding, self.errors) + _CRLF)
+        await self.writer.drain()
+
+    async def _getline(self):
+        """Return one line from the server without the CRLF, as bytes."""
+        while True:
+            i = self._buffer.find(b'\n')
+            if i >= 0:
+                line = bytes(self._buffer[:i + 1])
+                del self._buffer[:i + 1]
+                break
+            await self._fill()
+
+        if line[-2:] == _CRLF:
+            return line[:-2]
+        return line[:-1]
+
+    async def _getresp(self):
+        resp = (await self._getline()).decode(self.encoding, self.errors)
+        c = resp[:1]
+        if c == '4':
+            raise NNTPTemporaryError(resp)
+        if c == '5':
+            raise NNTPPermanentError(resp)
+        if c not in '123':
+            raise NNTPProtocolError(resp)
+        return resp
+
+    async def _getlongresp(self):
+        resp = await self._getresp()
+        if resp[:3] not in _LONGRESP:
+            raise NNTPReplyError(resp)
+
+        lines = []
+        while True:
+            line = await self._getline()
+            if line == b'.':
+                break
+            if line.startswith(b'..'):
+                line = line[1:]
+            lines.append(line)
+        return resp, lines
+
+    async def _getcompresp(self):
+        """Read a compressed OVER/XOVER response, decompressing as it
+        arrives. The end is found from the end of the deflate stream, as
+        in lib.nntplib._NNTPBase._itercompresp()."""
+        resp = await self._getresp()
+        if resp[:3] != '224':
+            raise NNTPReplyError(resp)
+
+        dc_obj = zlib.decompressobj()
+        decomp = []
+        while not dc_obj.eof:
+            if not self._buffer:
+                await self._fill()
+            data = bytes(self._buffer)
+            try:
+                decomp.append(dc_obj.decompress(data))
+            except zlib.error:
+                raise NNTPDataError('Data from NNTP could not be decompressed.')
+            del self._buffer[:len(data) - len(dc_obj.unused_data)]
+
+        lines = b''.join(decomp).split(_CRLF)
+        if lines and not lines[-1]:
+            lines.pop()
+
+        if lines and lines[-1] == b'.':
+            lines.pop()
+        elif await self._getline() != b'.':
+            raise NNTPDataError('Compressed response wasn\'t terminated.')
+
+        return resp, lines
+
+    async def _shortcmd(self, line):
+        await self._putcmd(line)
+        return await self._getresp()
+
+    async def _longcmd(self, line):
+        await self._putcmd(line)
+        return await self._getlongresp()
+
+    async def _longcmdstring(self, line):
+        resp, lines = await self._longcmd(line)
+        return resp, [line.decode(self.encoding, self.errors) for line in lines]
+
+    # -----------------------------------------------------------------
+    # commands
+    # -----------------------------------------------------------------
+
+    async def _getcapabilities(self):
+        try:
+            resp, lines = await self._longcmdstring('CAPABILITIES')
+        except (NNTPPermanentError, NNTPTemporaryError):
+            return {}
+
+        caps = {}
+        for line in lines:
+            name, *tokens = line.split()
+            caps[name] = tokens
+        return caps
+
+    def getcapabilities(self):
+        """The server capabilities, as read on connect."""
+        return self._caps
+
+    async def login(self, user, password=None):
+        resp = await self._shortcmd('authinfo user ' + user)
+        if resp.startswith('381'):
+            if not password:
+                raise NNTPReplyError(resp)
+            resp = await self._shortcmd('authinfo pass ' + password)
+            if not resp.startswith('281'):
+                raise NNTPPermanentError(resp)
+        # capabilities might have changed after login
+        self._caps = await self._getcapabilities()
+
+    async def compression(self):
+        """Process an XFEATURE GZIP COMPRESS command.
+        Returns whether the server understood it."""
+        try:
+            resp = await self._shortcmd('XFEATURE COMPRESS GZIP')
+            return resp[:3] == '290'
+        except (NNTPTemporaryError, NNTPPermanentError):
+            return False
+
+    async def group(self, name):
+        """Process a GROUP command. Returns as lib.nntplib.NNTP.group()."""
+        self.current_group = None
+        resp = await self._shortcmd('GROUP ' + name)
+        if not resp.startswith('211'):
+            raise NNTPReplyError(resp)
+        self.current_group = name
+
+        words = resp.split()
+        count = first = last = 0
+        n = len(words)
+        if n > 1:
+            count = words[1]
+            if n > 2:
+                first = words[2]
+                if n > 3:
+                    last = words[3]
+                    if n > 4:
+                        name = words[4].lower()
+        return resp, int(count), int(first), int(last), name
+
+    async def _getoverviewfmt(self):
+        if self._cachedoverviewfmt is None:
+            try:
+                resp, lines = await self._longcmdstring('LIST OVERVIEW.FMT')
+            except NNTPPermanentError:
+                self._cachedoverviewfmt = _DEFAULT_OVERVIEW_FMT[:]
+            else:
+                self._cachedoverviewfmt = _parse_overview_fmt(lines)
+        return self._cachedoverviewfmt
+
+    async def over(self, message_spec):
+        """Process an OVER command, falling back to XOVER. Arguments and
+        return value as for lib.nntplib.NNTP.over()."""
+        fmt = await self._getoverviewfmt()
+
+        cmd = 'OVER' if 'OVER' in self._caps else 'XOVER'
+        if isinstance(message_spec, (tuple, list)):
+            start, end = message_spec
+            cmd += ' {0}-{1}'.format(start, end or '')
+        elif message_spec is not None:
+            cmd = cmd + ' ' + message_spec
+
+        await self._putcmd(cmd)
+        if self.compressionstatus:
+            resp, lines = await self._getcompresp()
+        else:
+            resp, lines = await self._getlongresp()
+
+        return resp, _parse_overview([line.decode(self.encoding, self.errors) for line in lines], fmt)
+
+    def _statparse(self, resp):
+        if not resp.startswith('22'):
+            raise NNTPReplyError(resp)
+        words = resp.split()
+        return resp, int(words[1]), words[2]
+
+    async def stat(self, message_spec=None):
+        """Process a STAT command. Returns (resp, art_num, message_id)."""
+        if message_spec:
+            resp = await self._shortcmd('STAT {0}'.format(message_spec))
+        else:
+            resp = await self._shortcmd('STAT')
+        return self._statparse(resp)
+
+    async def _artcmd(self, line):
+        resp, lines = await self._longcmd(line)
+        resp, art_num, message_id = self._statparse(resp)
+        return resp, ArticleInfo(art_num, message_id, lines)
+
+    async def head(self, message_spec=None):
+        """Process a HEAD command. Returns (resp, ArticleInfo)."""
+        if message_spec is not None:
+            return await self._artcmd('HEAD {0}'.format(message_spec))
+        return await self._artcmd('HEAD')
+
+    async def body(self, message_spec=None):
+        """Process a BODY command. Returns (resp, ArticleInfo)."""
+        if message_spec is not None:
+            return await self._artcmd('BODY {0}'.format(message_spec))
+        return await self._artcmd('BODY')
+
+    async def quit(self):
+        """Process a QUIT command and close the connection."""
+        try:
+            resp = await self._shortcmd('QUIT')
+        finally:
+            self.close()
+        return resp
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
@@ -157,6 +157,9 @@ _OVERVIEW_FMT_ALTERNATIVES = {
 # Line terminators (we always output CRLF, but accept any of CRLF, CR, LF)
 _CRLF = b'\r\n'
 
+# How much compressed data to hand to zlib at a time
+_COMPRESSED_READ_SIZE = 65536
+
 GroupInfo = collections.namedtuple('GroupInfo',
                                    ['group', 'last', 'first', 'flag'])
 
@@ -206,8 +209,13 @@ def _parse_overview_fmt(lines):
 def _parse_overview(lines, fmt, data_process_func=None):
     """Parse the response to a OVER or XOVER command according to the
     overview format `fmt`."""
+    return list(_iter_overview(lines, fmt))
+
+
+def _iter_overview(lines, fmt):
+    """Generator version of _parse_overview(), yielding each
+    (article_number, fields) record as its line is parsed."""
     n_defaults = len(_DEFAULT_OVERVIEW_FMT)
-    overview = []
     for line in lines:
         fields = {}
         article_number, *tokens = line.split('\t')
@@ -239,8 +247,7 @@ def _parse_overview(lines, fmt, data_process_func=None):
             fields[fmt[i]] = token
         if not valid:
             continue
-        overview.append((article_number, fields))
-    return overview
+        yield article_number, fields
 
 
 def _parse_datetime(date_str, time_str=None):
@@ -375,6 +382,17 @@ class _NNTPBase:
         # Log in and encryption setup order is left to subclasses.
         self.authenticated = False
 
+        # The currently selected group, so callers can avoid re-issuing
+        # GROUP for a group that's already selected on this connection.
+        self.current_group = None
+
+        # Bytes read off the wire, for throughput measurement.
+        self.bytes_received = 0
+
+        # Set when a response was only partly read, so whatever's left on
+        # the socket would be taken as the answer to the next command.
+        self.dirty = False
+
     def __enter__(self):
         return self
 
@@ -452,6 +470,7 @@ class _NNTPBase:
         if self.debugging > 1:
             print('*get*', repr(line))
         if not line: raise EOFError
+        self.bytes_received += len(line)
         if strip_crlf:
             if line[-2:] == _CRLF:
                 line = line[:-2]
@@ -521,6 +540,63 @@ class _NNTPBase:
 
         return resp, lines
 
+    def _itercompresp(self):
+        """Internal: read the body of a compressed XOVER/OVER response,
+        feeding it through zlib as it arrives. Yields each decompressed
+        line as a bytes object, without the CRLF.
+
+        The end of the response is found from the end of the deflate
+        stream itself, and only the bytes zlib actually used are taken
+        off the socket, so we never read into a response queued up
+        behind this one.
+        """
+        dc_obj = zlib.decompressobj()
+        remainder = b''
+        terminated = False
+        while not dc_obj.eof:
+            data = self.file.peek(_COMPRESSED_READ_SIZE)
+            if not data:
+                raise EOFError
+            try:
+                decomp = dc_obj.decompress(data)
+            except zlib.error:
+                raise NNTPDataError('Data from NNTP could not be decompressed.')
+            used = len(data) - len(dc_obj.unused_data)
+            self.file.read(used)
+            self.bytes_received += used
+
+            if decomp:
+                lines = (remainder + decomp).split(_CRLF)
+                remainder = lines.pop()
+                for line in lines:
+                    # some servers compress the terminator along with the data
+                    if line == b'.':
+                        terminated = True
+                        continue
+                    yield line
+
+        if remainder and remainder != b'.':
+            yield remainder
+
+        # the rest send it in the clear after the compressed data
+        if not terminated and remainder != b'.':
+            line = self._getline()
+            if line != b'.':
+                raise NNTPDataError('Compressed response wasn\'t terminated.')
+
+    def _iterlongresp(self):
+        """Internal: yield the body lines of a multi-line response as
+        bytes objects, as they're read. The status line must already
+        have been read."""
+        terminator = b'.'
+        while 1:
+            line = self._getline()
+            if line == terminator:
+                break
+            if line.startswith(b'..'):
+                line = line[1:]
+            yield line
+
     def _getcompresp(self, file=None):
         """Modified _getlongresp for reading gzip data from the
         XOVER command.
@@ -534,63 +610,7 @@ class _NNTPBase:
         if resp[:3] != '224':
             raise NNTPReplyError(resp)
 
-        lines = b''
-        terminator = False
-        while 1:
-            # Check if we found a possible terminator (.\r\n)
-            if terminator:
-                # The socket is non blocking, so it throws an
-                # exception if the server sends back nothing.
-                try:
-                    # The server sent back something.
-                    line = self._getline(False)
-                    # So set back the socket to blocking.
-                    self.sock.settimeout(120)
-                    # And reset the terminator check.
-                    terminator = False
-                # The socket buffer was empty.
-                except Exception as e:
-                    # This was the final line, so remove the
-                    # terminator and append it.
-                    lines += termline[:-3]
-                    # Set the socket back to blocking.
-                    self.sock.settimeout(120)
-                    # And break out of the loop.
-                    break
-                # The buffer was not empty, so write the last line.
-                lines += termline
-                # And write the current line.
-                lines += line
-            else:
-                # We didn't find a terminator, so fetch the next line.
-                line = self._getline(False)
-                # We found a terminator.
-                if line[-3:] == b'.\r\n':
-                    # So add the line to a temp line for later.
-                    termline = line
-                    # And set the socket to non blocking.
-                    self.sock.settimeout(0)
-                    # And mark that we found a terminator.
-                    terminator = True
-                else:
-                    # Add the current line to the final buffer.
-                    lines += line
-
-        try:
-            # Try to decompress.
-            dc_obj = zlib.decompressobj()
-            decomp = dc_obj.decompress(lines)
-            # Remove the last crlf and split the line into a list @crlf's
-            if decomp[-2:] == b'\r\n':
-                decomp = decomp[:-2].split(b'\r\n')
-            else:
-                decomp = decomp.split(b'\r\n')
-        except Exception as e:
-            raise NNTPDataError('Data from NNTP could not be decompressed.')
-
-        # Check if the decompressed string is not empty.
-        if decomp[0] == b'':
-            decomp = []
+        decomp = list(self._itercompresp())
 
         openedFile = None
         try:
@@ -601,7 +621,7 @@ class _NNTPBase:
             # Write the lines to the file.
             if file is not None:
                 for header in decomp:
-                    file.write("%s\n" % header)
+                    file.write(header + b'\n')
 
         finally:
             # If this method created the file, then it must close it
@@ -773,9 +793,11 @@ class _NNTPBase:
         - last: last article number
         - name: the group name
         """
+        self.current_group = None
         resp = self._shortcmd('GROUP ' + name)
         if not resp.startswith('211'):
             raise NNTPReplyError(resp)
+        self.current_group = name
         words = resp.split()
         count = first = last = 0
         n = len(words)
@@ -968,6 +990,137 @@ class _NNTPBase:
         fmt = self._getoverviewfmt()
         return resp, _parse_overview(lines, fmt)
 
+    def _iteroverresp(self):
+        """Internal: read the status line of an OVER/XOVER response.
+        Returns (resp, lines) where `lines` is a generator over the
+        decoded lines of the body, compressed or not, read off the
+        socket as it's iterated."""
+        resp = self._getresp()
+        if resp[:3] != '224':
+            raise NNTPReplyError(resp)
+        if self.compressionstatus:
+            lines = self._itercompresp()
+        else:
+            lines = self._iterlongresp()
+        return resp, (line.decode(self.encoding, self.errors) for line in lines)
+
+    def over_pipelined(self, ranges, depth=4):
+        """Process a series of OVER commands for the given ranges, keeping
+        up to `depth` of them in flight at once. Arguments:
+        - ranges: list of (start, end) tuples
+        - depth: maximum number of commands sent but not yet answered
+        Yields, in order:
+        - ((start, end), overviews) as each response arrives, where
+          overviews is a generator of (article_number, fields) records
+          parsed as they come off the socket. A range the server refused
+          (ie. 423, no articles) yields no records.
+
+        Anything the caller doesn't read of one response is read off and
+        thrown away before moving on to the next.
+        """
+        cmd = 'OVER' if 'OVER' in self._caps else 'XOVER'
+        fmt = self._getoverviewfmt()
+        depth = max(1, depth)
+
+        ranges = iter(ranges)
+        in_flight = collections.deque()
+        overviews = iter(())
+
+        def send():
+            for message_spec in ranges:
+                start, end = message_spec
+                self._putcmd('{0} {1}-{2}'.format(cmd, start, end or ''))
+                in_flight.append(message_spec)
+                if len(in_flight) >= depth:
+                    break
+
+        try:
+            send()
+            while in_flight:
+                try:
+                    resp, lines = self._iteroverresp()
+                except (NNTPTemporaryError, NNTPPermanentError):
+                    # single-line error, the stream is still in sync
+                    lines = iter(())
+                message_spec = in_flight.popleft()
+                # top the pipeline back up before parsing
+                send()
+                overviews = _iter_overview(lines, fmt)
+                yield message_spec, overviews
+                for _ in overviews:
+                    pass
+        except GeneratorExit:
+            # the caller stopped early, so read off anything still in
+            # flight to leave the connection in a usable state. if the
+            # connection's what broke, don't bother
+            try:
+                for _ in overviews:
+                    pass
+                while in_flight:
+                    in_flight.popleft()
+                    try:
+                        for _ in self._iteroverresp()[1]:
+                            pass
+                    except (NNTPTemporaryError, NNTPPermanentError):
+                        pass
+            except Exception:
+                self.dirty = True
+            raise
+        except Exception:
+            # whatever's in flight is still on the socket
+            self.dirty = True
+            raise
+
+    def body_pipelined(self, message_specs, depth=8):
+        """Process a series of BODY commands, keeping up to `depth` of them
+        in flight at once. Arguments:
+        - message_specs: list of article numbers or message ids
+        - depth: maximum number of commands sent but not yet answered
+        Yields, in order:
+        - (message_spec, resp, lines) as each response arrives, where lines
+          is the list of body lines, or None if the server refused that
+          article (ie. 430, no such article). resp is the server response
+          either way.
+        """
+        depth = max(1, depth)
+
+        message_specs = iter(message_specs)
+        in_flight = collections.deque()
+
+        def send():
+            for message_spec in message_specs:
+                self._putcmd('BODY {0}'.format(message_spec))
+                in_flight.append(message_spec)
+                if len(in_flight) >= depth:
+                    break
+
+        try:
+            send()
+            while in_flight:
+                try:
+                    resp, lines = self._getlongresp()
+                except (NNTPTemporaryError, NNTPPermanentError) as e:
+                    # single-line error, the stream is still in sync
+                    resp, lines = str(e), None
+                message_spec = in_flight.popleft()
+                send()
+                yield message_spec, resp, lines
+        except GeneratorExit:
+            # read off anything still in flight, as in over_pipelined()
+            try:
+                while in_flight:
+                    in_flight.popleft()
+                    try:
+                        self._getlongresp()
+                    except (NNTPTemporaryError, NNTPPermanentError):
+                        pass
+            except Exception:
+                self.dirty = True
+            raise
+        except Exception:
+            self.dirty = True
+            raise
+
     def xgtitle(self, group, *, file=None):
         """Process an XGTITLE command (optional server extension) Arguments:
         - group: group name wildcard (i.e. news.*)
@@ -15,6 +15,7 @@ import pynab.nfos
 import pynab.sfvs
 import pynab.requests
 import pynab.ids
+import pynab.server
 import scripts.quick_postprocess
 import scripts.rename_bad_releases
 import config
@@ -232,4 +233,8 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        # the nfo/sfv/rar lookups use pooled connections too
+        pynab.server.close_pools()
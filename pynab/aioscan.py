@@ -0,0 +1,367 @@
+"""An asyncio scan driver.
+
+Rather than a thread (and a blocking connection) per group, every group is
+scanned from a single event loop over a shared pool of asyncio NNTP
+connections. Overviews are parsed with the same code as Server.scan(), and
+anything that touches the database is pushed off to a thread pool so it
+doesn't hold up the network side.
+
+Only the main primary provider (config.news) is used. There's no failover
+to other primaries or backups here, so if that goes down, the scan fails
+and is retried next iteration - use the threaded scan if you need that."""
+
+import asyncio
+import concurrent.futures
+import socket
+import time
+
+import lib.aionntplib as aionntplib
+from pynab import log
+from pynab.db import db_session, Group
+from pynab.server import POOL_OPTIONS, HeaderCache, add_segment, take_batch
+import pynab.server
+import pynab.groups
+import pynab.chunks
+import pynab.parts
+import pynab.blacklists
+import config
+
+
+class ConnectionPool:
+    """The asyncio equivalent of pynab.server.ConnectionPool."""
+
+    def __init__(self, provider=None, max_connections=None, idle_timeout=None):
+        # only the main primary for now, see pynab.server.providers()
+        self.provider = provider or pynab.server.providers()[0]
+        self.max_connections = max_connections or self.provider.get('max_connections', 10)
+        self.idle_timeout = idle_timeout or self.provider.get('idle_timeout', 300)
+
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+
+        # (connection, last_used), most recently used last
+        self.idle = []
+
+    async def _create(self):
+        news_config = self.provider.copy()
+        for option in POOL_OPTIONS:
+            news_config.pop(option, None)
+
+        connection = aionntplib.NNTP(compression=True, **news_config)
+        await connection.connect()
+        return connection
+
+    async def checkout(self):
+        await self.semaphore.acquire()
+        try:
+            now = time.time()
+            while self.idle:
+                connection, last_used = self.idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection
+                connection.close()
+
+            return await self._create()
+        except:
+            self.semaphore.release()
+            raise
+
+    def checkin(self, connection):
+        self.idle.append((connection, time.time()))
+        self.semaphore.release()
+
+    def discard(self, connection):
+        connection.close()
+        self.semaphore.release()
+
+    async def close_all(self):
+        while self.idle:
+            connection, _ = self.idle.pop()
+            try:
+                await connection.quit()
+            except Exception:
+                connection.close()
+
+
+async def group(pool, group_name):
+    """Returns (count, first, last) for a group."""
+    connection = await pool.checkout()
+    try:
+        _, count, first, last, _ = await connection.group(group_name)
+    except:
+        pool.discard(connection)
+        raise
+    pool.checkin(connection)
+    return count, first, last
+
+
+async def over(pool, group_name, first, last):
+    """Fetch the overviews for a range on any free connection.
+    Ranges the server doesn't have come back empty."""
+    for attempt in range(3):
+        connection = await pool.checkout()
+        try:
+            if connection.current_group != group_name:
+                await connection.group(group_name)
+            _, overviews = await connection.over((first, last))
+        except (aionntplib.NNTPTemporaryError, aionntplib.NNTPPermanentError) as e:
+            pool.checkin(connection)
+            log.debug('aioscan: {}: no overviews for {}-{}: {}'.format(group_name, first, last, e))
+            return []
+        except (socket.error, EOFError, asyncio.TimeoutError, aionntplib.NNTPError) as e:
+            pool.discard(connection)
+            log.warning('aioscan: {}: problem fetching {}-{}, retrying: {}'.format(group_name, first, last, e))
+            continue
+        except:
+            pool.discard(connection)
+            raise
+
+        pool.checkin(connection)
+        return overviews
+
+    raise aionntplib.NNTPError('timed out a bunch fetching {}-{}'.format(first, last))
+
+
+async def scan_range(pool, executor, sizer, group_name, first, last, blacklists):
+    """The asyncio equivalent of Server.scan() over a single range. Overviews
+    are parsed as each OVER comes back, and parts are saved (in the
+    executor) every part_save_batch segments, so memory stays flat however
+    big the chunk is. Only the leftovers are returned."""
+    loop = asyncio.get_event_loop()
+    start = time.time()
+
+    parts = {}
+    messages = []
+    headers = HeaderCache()
+    buffered = 0
+    ignored = 0
+    total_parts = 0
+    blacklisted_parts = 0
+    batch_size = config.scan.get('part_save_batch', 50000)
+
+    def blacklist(batch):
+        nonlocal total_parts, blacklisted_parts
+        blacklisted = [k for k, v in batch.items() if pynab.parts.is_blacklisted(v, group_name, blacklists)]
+        blacklisted_parts += len(blacklisted)
+        total_parts += len(batch)
+        for k in blacklisted:
+            del batch[k]
+        return batch
+
+    cursor = first
+    while cursor <= last:
+        range_first, range_last = cursor, min(cursor + sizer.size - 1, last)
+        range_start = time.time()
+        try:
+            received = await over(pool, group_name, range_first, range_last)
+        except:
+            sizer.error()
+            raise
+        # the async client doesn't count bytes, so that's left out
+        sizer.record(len(received), 0, time.time() - range_start)
+        cursor = range_last + 1
+
+        for id, overview in received:
+            messages.append(id)
+            result = add_segment(parts, group_name, overview, headers)
+            if result is False:
+                ignored += 1
+            elif result:
+                buffered += 1
+        del received
+
+        if buffered >= batch_size:
+            batch = blacklist(take_batch(parts))
+            if batch and not await loop.run_in_executor(executor, pynab.parts.save_all, batch):
+                raise Exception('problem saving parts')
+            buffered = sum(len(v['segments']) for v in parts.values())
+
+    parts = blacklist(parts)
+
+    missed = list(set(range(first, last)) - set(messages))
+
+    log.info('aioscan: {}: retrieved {} - {} in {:.2f}s [{} recv, {} pts, {} ign, {} blk]'.format(
+        group_name,
+        first, last,
+        time.time() - start,
+        len(messages),
+        total_parts,
+        ignored,
+        blacklisted_parts
+    ))
+
+    return parts, messages, missed
+
+
+def load_group(provider, group_name, first, last, direction, date, target):
+    """Plan a group's scan. Runs in the executor, since it hits the db."""
+    with db_session() as db:
+        group = db.query(Group).filter(Group.name == group_name).first()
+        if not group:
+            return direction, target, None
+
+        # new groups get backfilled, and finding a backfill target
+        # needs a blocking connection for day_to_post, so borrow one
+        # from the same provider, since article numbers differ between them
+        if (direction == 'backward' or not (group.first or group.last)) and not target:
+            with pynab.server.Server(provider) as server:
+                direction, target, chunks = pynab.groups.plan_scan(group, first, last, direction, date, target,
+                                                                   server)
+        else:
+            direction, target, chunks = pynab.groups.plan_scan(group, first, last, direction, date, target)
+
+        db.merge(group)
+        db.commit()
+
+        return direction, target, chunks
+
+
+def save_range(group_name, direction, parts, missed):
+    """Save what we got from a chunk. Runs in the executor."""
+    # don't save misses if we're backfilling, there are too many
+    if missed and config.scan.get('retry_missed') and direction == 'forward':
+        pynab.groups.save_missing_segments(group_name, missed)
+
+    if parts:
+        return pynab.parts.save_all(parts)
+    return True
+
+
+def move_group(group_name, direction, marker):
+    """Move a group's first/last along. Runs in the executor."""
+    with db_session() as db:
+        group = db.query(Group).filter(Group.name == group_name).first()
+        if direction == 'forward':
+            group.last = marker
+        elif direction == 'backward':
+            group.first = marker
+        db.merge(group)
+        db.commit()
+
+
+async def scan_group(pool, executor, blacklists, group_name, direction='forward', date=None, target=None, limit=None):
+    """The asyncio equivalent of pynab.groups.scan()."""
+    loop = asyncio.get_event_loop()
+
+    log.info('aioscan: {}: scanning group'.format(group_name))
+
+    count, first, last = await group(pool, group_name)
+    if not count:
+        return None
+
+    direction, target, chunks = await loop.run_in_executor(
+        executor, load_group, pool.provider['name'], group_name, first, last, direction, date, target
+    )
+
+    if chunks is None:
+        return True
+
+    # the first time a group's seen, this loads its range size from the db
+    sizer = await loop.run_in_executor(executor, pynab.chunks.sizer, group_name)
+
+    # same deal as pynab.groups.scan(): several chunks in flight, but only move
+    # first/last over chunks that are done and contiguous with what we've got
+    connections = max(1, config.scan.get('group_scan_connections', 1))
+    completed = {}
+    contiguous = 0
+    submitted = 0
+    failed = False
+    tasks = {}
+
+    while True:
+        while not failed and submitted < len(chunks) and len(tasks) < connections \
+                and not (limit and submitted >= 3):
+            begin, end = chunks[submitted]
+            tasks[asyncio.ensure_future(
+                scan_range(pool, executor, sizer, group_name, begin, end, blacklists)
+            )] = submitted
+            submitted += 1
+
+        if not tasks:
+            break
+
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            index = tasks.pop(task)
+            begin, end = chunks[index]
+
+            try:
+                parts, messages, missed = task.result()
+            except Exception as e:
+                log.error('aioscan: {}: problem scanning {}-{}: {}'.format(group_name, begin, end, e))
+                failed = True
+                continue
+
+            if not messages:
+                log.error('aioscan: {}: problem updating group ({}-{})'.format(group_name, begin, end))
+                failed = True
+                continue
+
+            if not await loop.run_in_executor(executor, save_range, group_name, direction, parts, missed):
+                log.error('aioscan: {}: problem saving parts to db, restarting scan'.format(group_name))
+                failed = True
+                continue
+
+            completed[index] = max(messages) if direction == 'forward' else min(messages)
+
+        marker = None
+        while contiguous in completed:
+            marker = completed.pop(contiguous)
+            contiguous += 1
+
+        if marker is not None:
+            await loop.run_in_executor(executor, move_group, group_name, direction, marker)
+
+            begin, end = chunks[contiguous - 1]
+            to_go = abs(target - (end if direction == 'forward' else begin))
+            log.info('aioscan: {}: {:.0f} iterations ({} messages) to go'.format(
+                group_name,
+                to_go / config.scan.get('message_scan_limit'),
+                to_go
+            ))
+
+    await loop.run_in_executor(executor, sizer.save)
+
+    if failed:
+        return False
+
+    if contiguous < len(chunks):
+        log.info('aioscan: {}: scan limit reached, ending early (will continue later)'.format(group_name))
+        return False
+
+    log.info('aioscan: {}: scan completed'.format(group_name))
+    return True
+
+
+async def scan_groups(groups, direction='forward', date=None, limit=None):
+    """Scan a dict of {group_name: target} at once, returning a list of results."""
+    pool = ConnectionPool()
+
+    blacklists = pynab.blacklists.matcher()
+
+    with concurrent.futures.ThreadPoolExecutor(config.scan.get('update_threads', None)) as executor:
+        try:
+            results = await asyncio.gather(*[
+                scan_group(pool, executor, blacklists, group_name, direction, date, target, limit)
+                for group_name, target in groups.items()
+            ], return_exceptions=True)
+        finally:
+            await pool.close_all()
+
+    data = []
+    for group_name, result in zip(groups, results):
+        if isinstance(result, Exception):
+            log.error('aioscan: {}: nntp server is flipping out: {}'.format(group_name, result))
+            result = None
+        data.append(result)
+
+    return data
+
+
+def run(groups, direction='forward', date=None, limit=None):
+    """Run a scan of a dict of {group_name: target} on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(scan_groups(groups, direction, date, limit))
+    finally:
+        loop.close()
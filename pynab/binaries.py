@@ -1,11 +1,15 @@
 import time
+import collections
+import contextlib
+import concurrent.futures
 import pyhashxx
 
 import regex
 from sqlalchemy import *
 
-from pynab.db import db_session, Binary, Part, Regex, windowed_query
+from pynab.db import db_session, Binary, Part, windowed_query
 from pynab import log
+import pynab.regexes
 import config
 
 
@@ -21,6 +25,238 @@ def generate_hash(name, group_name, posted_by, total_parts):
     )
 
 
+def match_subject(regexes, group_name, subject):
+    """Runs a part's subject through the regexes for its group. Returns
+    ((regex id, name, current part, total parts), regex match) for the first
+    one that gives a name and a part count, or (None, None)."""
+    for regex_id, result in regexes.search(group_name, subject):
+        match = result.groupdict() if result else None
+        if match:
+            # remove whitespace in dict values
+            try:
+                match = {k: v.strip() for k, v in match.items()}
+            except:
+                pass
+
+            # fill name if reqid is available
+            if match.get('reqid') and not match.get('name'):
+                match['name'] = '{}'.format(match['reqid'])
+
+            # make sure the regex returns at least some name
+            if not match.get('name'):
+                match['name'] = ' '.join([v for v in match.values() if v])
+
+            # if regex are shitty, look for parts manually
+            # segment numbers have been stripped by this point, so don't worry
+            # about accidentally hitting those instead
+            if not match.get('parts'):
+                part_result = PART_REGEX.search(subject)
+                if part_result:
+                    match['parts'] = part_result.group(1)
+
+            if match.get('name') and match.get('parts'):
+                current, total = split_parts(match['parts'])
+                if current is None:
+                    continue
+
+                return (regex_id, match['name'], current, total), result
+
+    return None, None
+
+
+def split_parts(parts):
+    """Splits a part count like '01/10', '[1 of 10]' or '1-10' into (current, total)."""
+    if parts.find('/') == -1:
+        parts = parts.replace('-', '/').replace('~', '/').replace(' of ', '/')
+
+    parts = parts.replace('[', '').replace(']', '').replace('(', '').replace(')', '')
+
+    if '/' not in parts:
+        return None, None
+
+    current, total = parts.split('/')
+    return current, total
+
+
+class StemCache:
+    """Remembers which regex matched a subject, with the part counter masked out.
+
+    Every part of a binary has the same subject apart from the counter, so
+    once one's matched, the rest can reuse its regex and name and just read
+    their own counter, rather than going through every regex again.
+    Subjects that nothing matched are remembered too. Only subjects with
+    exactly one counter are cached, and only if the name didn't come from
+    the counter. Digits are masked one for one, so '9/10' and '10/10' don't
+    share a stem. Least-recently-used entries are dropped past max_size,
+    and everything's dropped when the regexes change."""
+
+    # stands in for 'never seen it' in the cache, since None means 'no match'
+    UNSEEN = object()
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or config.scan.get('binary_stem_cache_size', 100000)
+        self.cache = collections.OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stem(subject):
+        """Returns (stem, current, total, span of current), or None if the
+        subject doesn't have exactly one part counter."""
+        counters = PART_REGEX.finditer(subject)
+        counter = next(counters, None)
+        if not counter or next(counters, None):
+            return None
+
+        current, total = split_parts(counter.group(1))
+        if current is None:
+            return None
+
+        start = counter.start(1)
+        end = start + len(current)
+        return subject[:start] + '#' * len(current) + subject[end:], current, total, (start, end)
+
+    def _cacheable(self, result, span):
+        """Whether a match can be reused for the rest of its stem: it has to
+        have a real name, and nothing but parts can come from the counter."""
+        if not result.groupdict().get('name'):
+            return False
+
+        for group, value in result.groupdict().items():
+            if group == 'parts' or value is None:
+                continue
+            start, end = result.span(group)
+            if start < span[1] and end > span[0]:
+                return False
+
+        return True
+
+    def _put(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def match(self, regexes, group_name, subject):
+        """Same as match_subject(), but through the cache."""
+        if regexes.generation != self.generation:
+            self.cache.clear()
+            self.generation = regexes.generation
+
+        stemmed = self.stem(subject) if self.max_size else None
+        if not stemmed:
+            matched, _ = match_subject(regexes, group_name, subject)
+            return matched
+
+        stem, current, total, span = stemmed
+        key = (group_name, stem)
+
+        cached = self.cache.get(key, self.UNSEEN)
+        if cached is not self.UNSEEN:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            if cached is None:
+                return None
+
+            regex_id, name = cached
+            return regex_id, name, current, total
+
+        self.misses += 1
+        matched, result = match_subject(regexes, group_name, subject)
+        if not matched:
+            self._put(key, None)
+        elif matched[2:] == (current, total) and self._cacheable(result, span):
+            self._put(key, matched[:2])
+
+        return matched
+
+
+_stem_cache = None
+
+
+def stem_cache():
+    """Returns the shared stem cache, which lives between runs."""
+    global _stem_cache
+    if _stem_cache is None:
+        _stem_cache = StemCache()
+    return _stem_cache
+
+
+def _match(regexes, stems, group_name, subject, posted_by):
+    """Matches a part and works out its binary's hash. Returns
+    (regex id, name, current part, total parts, hash), or None."""
+    matched = stems.match(regexes, group_name, subject)
+    if not matched:
+        return None
+
+    regex_id, name, current, total = matched
+    return regex_id, name, current, total, generate_hash(name, group_name, posted_by, total)
+
+
+def _match_batch(batch):
+    """Runs in a worker process. batch is a list of (part id, group_name,
+    subject, posted_by), and the results come back as (part id, match)
+    so the parent doesn't have to send whole parts back and forth.
+    Each worker keeps its own regexes and stem cache between batches."""
+    regexes = pynab.regexes.engine()
+    stems = stem_cache()
+    return [(id, _match(regexes, stems, group_name, subject, posted_by))
+            for id, group_name, subject, posted_by in batch]
+
+
+def _match_parallel(executor, parts, chunk_size, workers):
+    """Yields (part, match) like the serial loop would, but matches each
+    chunk of parts across the worker processes. The chunk's split into
+    contiguous runs of ids, since parts of the same binary tend to be
+    found together and that keeps them in the same worker's stem cache."""
+    def chunks():
+        chunk = []
+        for part in parts:
+            chunk.append(part)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    batch_size = max(1, chunk_size // workers)
+    for chunk in chunks():
+        by_id = dict((part.id, part) for part in chunk)
+        batches = [
+            [(part.id, part.group_name, part.subject, part.posted_by) for part in chunk[i:i + batch_size]]
+            for i in range(0, len(chunk), batch_size)
+        ]
+        for results in executor.map(_match_batch, batches):
+            for id, matched in results:
+                yield by_id[id], matched
+
+
+def update_completion(db, binary_ids):
+    """Recounts the parts and segments of some binaries from their parts'
+    available_segments, and works out whether they're ready to be made
+    into releases. Only touches the binaries given, so it costs about
+    the same however big the backlog is. db can be a session or a raw cursor,
+    and it's left to the caller to commit."""
+    binary_ids = sorted(set(int(id) for id in binary_ids if id))
+    min_completion = int(config.postprocess.get('min_completion', 100))
+
+    for i in range(0, len(binary_ids), 1000):
+        ids = ', '.join(str(id) for id in binary_ids[i:i + 1000])
+        db.execute("""
+            UPDATE binaries SET
+                available_parts = (SELECT count(*) FROM parts WHERE parts.binary_id = binaries.id),
+                available_segments = (SELECT coalesce(sum(parts.available_segments), 0) FROM parts WHERE parts.binary_id = binaries.id),
+                total_segments = (SELECT coalesce(sum(parts.total_segments), 0) FROM parts WHERE parts.binary_id = binaries.id)
+            WHERE id IN ({})
+        """.format(ids))
+        db.execute("""
+            UPDATE binaries SET
+                complete = (available_parts >= total_parts AND available_segments * 100 >= total_segments * {})
+            WHERE id IN ({})
+        """.format(min_completion, ids))
+
+
 def save(db, binaries):
     """Helper function to save a set of binaries
     and delete associated parts from the DB. This
@@ -67,6 +303,7 @@ def save(db, binaries):
         if update_parts:
             p = Part.__table__.update().where(Part.id == bindparam('_id')).values(binary_id=bindparam('_binary_id'))
             db.execute(p, update_parts)
+            update_completion(db, [part['_binary_id'] for part in update_parts])
             db.commit()
 
 
@@ -93,147 +330,89 @@ def process():
         db.expire_on_commit = False
         relevant_groups = [x[0] for x in db.query(Part.group_name).group_by(Part.group_name).all()]
         if relevant_groups:
-            # grab all relevant regex
-            all_regex = db.query(Regex).filter(Regex.status == True).filter(
-                Regex.group_name.in_(relevant_groups + ['.*'])).order_by(Regex.ordinal).all()
-
-            # cache compiled regex
-            compiled_regex = {}
-            for reg in all_regex:
-                r = reg.regex
-                flags = r[r.rfind('/') + 1:]
-                r = r[r.find('/') + 1:r.rfind('/')]
-                regex_flags = regex.I if 'i' in flags else 0
-                try:
-                    compiled_regex[reg.id] = regex.compile(r, regex_flags)
-                except Exception as e:
-                    log.error('binary: broken regex detected. id: {:d}, removing...'.format(reg.id))
-                    db.query(Regex).filter(Regex.id==reg.id).delete()
-                    db.commit()
+            # compiled regex, bucketed by group and kept between runs
+            regexes = pynab.regexes.engine()
+            stems = stem_cache()
 
             # noinspection PyComparisonWithNone
             query = db.query(Part).filter(Part.group_name.in_(relevant_groups)).filter(Part.binary_id == None)
             total_parts = query.count()
-            for part in windowed_query(query, Part.id, config.scan.get('binary_process_chunk_size', 1000)):
-                found = False
-                total_processed += 1
-                count += 1
-
-                for reg in all_regex:
-                    if reg.group_name != part.group_name and reg.group_name != '.*':
-                        continue
-
-                    # convert php-style regex to python
-                    # ie. /(\w+)/i -> (\w+), regex.I
-                    # no need to handle s, as it doesn't exist in python
-
-                    # why not store it as python to begin with? some regex
-                    # shouldn't be case-insensitive, and this notation allows for that
-
-                    try:
-                        result = compiled_regex[reg.id].search(part.subject)
-                    except:
-                        log.error('binary: broken regex detected. id: {:d}, removing...'.format(reg.id))
-                        all_regex.remove(reg)
-                        db.query(Regex).filter(Regex.id==reg.id).delete()
-                        db.commit()
-                        continue
-
-                    match = result.groupdict() if result else None
-                    if match:
-                        # remove whitespace in dict values
-                        try:
-                            match = {k: v.strip() for k, v in match.items()}
-                        except:
-                            pass
-
-                        # fill name if reqid is available
-                        if match.get('reqid') and not match.get('name'):
-                            match['name'] = '{}'.format(match['reqid'])
-
-                        # make sure the regex returns at least some name
-                        if not match.get('name'):
-                            match['name'] = ' '.join([v for v in match.values() if v])
-
-                        # if regex are shitty, look for parts manually
-                        # segment numbers have been stripped by this point, so don't worry
-                        # about accidentally hitting those instead
-                        if not match.get('parts'):
-                            result = PART_REGEX.search(part.subject)
-                            if result:
-                                match['parts'] = result.group(1)
-
-                        if match.get('name') and match.get('parts'):
-                            if match['parts'].find('/') == -1:
-                                match['parts'] = match['parts'].replace('-', '/') \
-                                    .replace('~', '/').replace(' of ', '/')
-
-                            match['parts'] = match['parts'].replace('[', '').replace(']', '') \
-                                .replace('(', '').replace(')', '')
-
-                            if '/' not in match['parts']:
-                                continue
-
-                            current, total = match['parts'].split('/')
-
-                            # calculate binary hash for matching
-                            hash = generate_hash(match['name'], part.group_name, part.posted_by, total)
-
-                            # if the binary is already in our chunk,
-                            # just append to it to reduce query numbers
-                            if hash in binaries:
-                                if current in binaries[hash]['parts']:
-                                    # but if we already have this part, pick the one closest to the binary
-                                    if binaries[hash]['posted'] - part.posted < binaries[hash]['posted'] - \
-                                            binaries[hash]['parts'][current].posted:
-                                        binaries[hash]['parts'][current] = part
-                                    else:
-                                        dead_parts.append(part.id)
-                                        break
-                                else:
+            chunk_size = config.scan.get('binary_process_chunk_size', 1000)
+            parts = windowed_query(query, Part.id, chunk_size)
+
+            # matching's all cpu, so it can be farmed out to other processes.
+            # they only match and hash, everything else (and all the writing) stays here
+            workers = config.scan.get('binary_process_workers', 1)
+            with contextlib.ExitStack() as stack:
+                if workers > 1 and total_parts > chunk_size:
+                    # forked workers get a copy of the compiled regexes for free
+                    executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(workers))
+                    matches = _match_parallel(executor, parts, chunk_size, workers)
+                else:
+                    matches = ((part, _match(regexes, stems, part.group_name, part.subject, part.posted_by))
+                               for part in parts)
+
+                for part, matched in matches:
+                    found = False
+                    total_processed += 1
+                    count += 1
+
+                    if matched:
+                        regex_id, name, current, total, hash = matched
+
+                        # if the binary is already in our chunk,
+                        # just append to it to reduce query numbers
+                        if hash in binaries:
+                            if current in binaries[hash]['parts']:
+                                # but if we already have this part, pick the one closest to the binary
+                                if binaries[hash]['posted'] - part.posted < binaries[hash]['posted'] - \
+                                        binaries[hash]['parts'][current].posted:
                                     binaries[hash]['parts'][current] = part
+                                    found = True
                             else:
-                                log.debug('binaries: new binary found: {}'.format(match['name']))
-
-                                b = {
-                                    'hash': hash,
-                                    'name': match['name'],
-                                    'posted': part.posted,
-                                    'posted_by': part.posted_by,
-                                    'group_name': part.group_name,
-                                    'xref': part.xref,
-                                    'regex_id': reg.id,
-                                    'total_parts': int(total),
-                                    'parts': {current: part}
-                                }
-
-                                binaries[hash] = b
+                                binaries[hash]['parts'][current] = part
+                                found = True
+                        else:
+                            log.debug('binaries: new binary found: {}'.format(name))
+
+                            b = {
+                                'hash': hash,
+                                'name': name,
+                                'posted': part.posted,
+                                'posted_by': part.posted_by,
+                                'group_name': part.group_name,
+                                'xref': part.xref,
+                                'regex_id': regex_id,
+                                'total_parts': int(total),
+                                'parts': {current: part}
+                            }
+
+                            binaries[hash] = b
                             found = True
-                            break
 
-                # the part matched no regex, so delete it
-                if not found:
-                    dead_parts.append(part.id)
+                    # the part matched no regex (or lost out to a closer copy), so delete it
+                    if not found:
+                        dead_parts.append(part.id)
 
-                if count >= config.scan.get('binary_process_chunk_size', 1000) or (total_parts - count) == 0:
-                    total_parts -= count
-                    total_binaries += len(binaries)
+                    if count >= config.scan.get('binary_process_chunk_size', 1000) or (total_parts - count) == 0:
+                        total_parts -= count
+                        total_binaries += len(binaries)
 
-                    save(db, binaries)
-                    if dead_parts:
-                        deleted = db.query(Part).filter(Part.id.in_(dead_parts)).delete(synchronize_session='fetch')
-                    else:
-                        deleted = 0
+                        save(db, binaries)
+                        if dead_parts:
+                            deleted = db.query(Part).filter(Part.id.in_(dead_parts)).delete(synchronize_session='fetch')
+                        else:
+                            deleted = 0
 
-                    db.commit()
-                    log.info(
-                        'binary: saved {} binaries and deleted {} dead parts ({} parts left)...'.format(len(binaries),
-                                                                                                        deleted,
-                                                                                                        total_parts))
+                        db.commit()
+                        log.info(
+                            'binary: saved {} binaries and deleted {} dead parts ({} parts left)...'.format(len(binaries),
+                                                                                                            deleted,
+                                                                                                            total_parts))
 
-                    binaries = {}
-                    dead_parts = []
-                    count = 0
+                        binaries = {}
+                        dead_parts = []
+                        count = 0
 
         db.expire_on_commit = True
         db.close()
@@ -243,6 +422,8 @@ def process():
     log.info('binary: processed {} parts and formed {} binaries in {:.2f}s'
              .format(total_processed, total_binaries, end - start)
     )
+    # (these only cover the serial path, workers keep their own)
+    log.debug('binary: stem cache: {} hits, {} misses'.format(stem_cache().hits, stem_cache().misses))
 
 
 def parse_xref(xref):
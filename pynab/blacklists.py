@@ -0,0 +1,152 @@
+"""Compiled blacklist matching for parts and binaries.
+
+Every part in a scan and every binary in release processing gets checked
+against every active blacklist, so rather than regex.search()ing the raw
+strings each time, we compile them once, work out which apply to each group
+once, and glue each field's patterns into a single regex where it's safe.
+Matchers reload themselves when the blacklists table changes."""
+
+import hashlib
+import threading
+import time
+
+import regex
+
+from pynab import log
+from pynab.db import db_session, Blacklist
+import config
+
+# things that don't survive being glued into a bigger pattern:
+# numbered/named backreferences and leading global flags
+UNCOMBINABLE_REGEX = regex.compile(r'\\[1-9]|\\g<|\(\?P=|^\(\?[a-zA-Z]+\)')
+
+
+class BlacklistMatcher:
+    def __init__(self, blacklists=None):
+        """Compile the given blacklists, or all the active ones in the db."""
+        self.lock = threading.Lock()
+        self.check_interval = config.scan.get('blacklist_check_interval', 60)
+        self.checked = 0
+        self.signature = None
+
+        if blacklists is None:
+            self.reload()
+        else:
+            self._compile(blacklists)
+
+    @staticmethod
+    def _signature():
+        """A hash of every active blacklist, so any change at all shows up."""
+        digest = hashlib.md5()
+        with db_session() as db:
+            for row in db.query(Blacklist.id, Blacklist.regex, Blacklist.group_name, Blacklist.field) \
+                    .filter(Blacklist.status == True).order_by(Blacklist.id):
+                digest.update(repr(tuple(row)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def reload(self):
+        with db_session() as db:
+            blacklists = db.query(Blacklist).filter(Blacklist.status == True).all()
+            for blacklist in blacklists:
+                db.expunge(blacklist)
+
+        self._compile(blacklists)
+        self.signature = self._signature()
+        self.checked = time.time()
+
+    def refresh(self):
+        """Reload if the table's changed, checking at most every blacklist_check_interval seconds."""
+        with self.lock:
+            if time.time() - self.checked < self.check_interval:
+                return
+
+            self.checked = time.time()
+            if self._signature() != self.signature:
+                log.info('blacklist: blacklists changed, reloading')
+                self.reload()
+
+    def _compile(self, blacklists):
+        self.blacklists = []
+        for blacklist in blacklists:
+            try:
+                self.blacklists.append((
+                    blacklist.id,
+                    regex.compile(blacklist.group_name),
+                    blacklist.field,
+                    regex.compile(blacklist.regex),
+                    blacklist.regex
+                ))
+            except regex.error as e:
+                log.error('blacklist: bad regex in blacklist {}: {}'.format(blacklist.id, e))
+
+        # group_name: {field: (combined pattern or None, [(id, pattern), ...])}
+        self.groups = {}
+
+    def _for_group(self, group_name):
+        try:
+            return self.groups[group_name]
+        except KeyError:
+            pass
+
+        fields = {}
+        for id, group_regex, field, pattern, raw in self.blacklists:
+            if group_regex.search(group_name):
+                fields.setdefault(field, []).append((id, pattern, raw))
+
+        compiled = {}
+        for field, patterns in fields.items():
+            combinable = [raw for _, _, raw in patterns if not UNCOMBINABLE_REGEX.search(raw)]
+            combined = None
+            if len(combinable) > 1:
+                try:
+                    combined = regex.compile('|'.join('(?:{})'.format(raw) for raw in combinable))
+                except regex.error:
+                    combined = None
+
+            if combined:
+                # the rest still get checked one by one
+                singles = [(id, pattern) for id, pattern, raw in patterns if UNCOMBINABLE_REGEX.search(raw)]
+            else:
+                singles = [(id, pattern) for id, pattern, _ in patterns]
+
+            compiled[field] = (combined, singles, [(id, pattern) for id, pattern, _ in patterns])
+
+        self.groups[group_name] = compiled
+        return compiled
+
+    def match(self, group_name, record, get=None):
+        """Returns the id of the first blacklist that matches the record,
+        or None. By default fields are looked up as record[field], or
+        pass `get(field)` to do it some other way."""
+        for field, (combined, singles, everything) in self._for_group(group_name).items():
+            value = get(field) if get else record[field]
+            if value is None:
+                continue
+
+            if combined and combined.search(value):
+                # it's a hit, so it's worth finding out which one
+                for id, pattern in everything:
+                    if pattern.search(value):
+                        return id
+
+            for id, pattern in singles:
+                if pattern.search(value):
+                    return id
+
+        return None
+
+
+_matcher = None
+_lock = threading.Lock()
+
+
+def matcher():
+    """Returns the shared matcher, reloading it if the blacklists have changed."""
+    global _matcher
+    with _lock:
+        if _matcher is None:
+            _matcher = BlacklistMatcher()
+            return _matcher
+
+    _matcher.refresh()
+    return _matcher
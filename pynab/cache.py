@@ -0,0 +1,123 @@
+"""A local on-disk cache of decoded articles, keyed by message-id.
+
+Post-processing keeps coming back to the same first segments (metablack
+expiry, rename_bad_releases, re-imports), so we keep what we've downloaded
+around, gzipped, and throw out the least-recently-used when it gets too big."""
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+
+from pynab import log
+import config
+
+
+class ArticleCache:
+    def __init__(self, path=None, max_size=None):
+        self.path = path or config.postprocess.get('article_cache_dir', None)
+        self.max_size = max_size or config.postprocess.get('article_cache_size', 1024 * 1024 * 1024)
+
+        self.lock = threading.Lock()
+        # worked out the first time we need it
+        self.size = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _filename(self, message_id):
+        key = hashlib.sha1(message_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def _files(self):
+        """(mtime, size, filename) of everything in the cache."""
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    # someone else evicted it
+                    continue
+                yield stat.st_mtime, stat.st_size, filename
+
+    def get(self, message_id):
+        """Returns the cached article, or None if we don't have it."""
+        if not self.enabled:
+            return None
+
+        filename = self._filename(message_id)
+        try:
+            with open(filename, 'rb') as f:
+                data = gzip.decompress(f.read())
+        except (OSError, EOFError):
+            return None
+
+        # bump it to the front of the queue
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, message_id, data):
+        """Stores an article, evicting old ones if we're over size."""
+        if not self.enabled or not data:
+            return
+
+        filename = self._filename(message_id)
+        compressed = gzip.compress(data)
+
+        t = None
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+            # write somewhere else first, so nobody reads half an article
+            with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(filename), delete=False) as t:
+                t.write(compressed)
+            os.replace(t.name, filename)
+        except OSError as e:
+            log.warning('cache: couldn\'t cache article: {}'.format(e))
+
+            # don't leave the half-written one lying around
+            if t:
+                try:
+                    os.remove(t.name)
+                except OSError:
+                    pass
+            return
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._files())
+            else:
+                self.size += len(compressed)
+
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Deletes the least-recently-used articles until we're back down
+        to 90% of the max, so we're not doing this on every put."""
+        files = sorted(self._files())
+        self.size = sum(size for _, size, _ in files)
+
+        target = self.max_size * 0.9
+        deleted = 0
+        for _, size, filename in files:
+            if self.size <= target:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self.size -= size
+            deleted += 1
+
+        log.debug('cache: evicted {} articles'.format(deleted))
+
+
+cache = ArticleCache()
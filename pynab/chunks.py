@@ -0,0 +1,94 @@
+"""Adaptive OVER range sizing.
+
+A single over_pipeline_size doesn't suit every group: quiet groups waste
+round trips on tiny ranges, and the busiest ones time out and burn through
+Server.scan's retries. Each group gets a sizer that watches how long its
+ranges take and how often they fail, and grows or shrinks the range size
+between over_size_min and over_size_max to keep responses near
+over_target_time seconds. Sizes are saved on the group, so the next run
+starts where the last one left off."""
+
+import threading
+
+from pynab import log
+from pynab.db import db_session, Group
+import config
+
+# weight given to the newest measurement in the running averages
+SMOOTHING = 0.2
+
+
+class ChunkSizer:
+    def __init__(self, group_name, size=None):
+        self.group_name = group_name
+
+        self.min_size = config.scan.get('over_size_min', 500)
+        self.max_size = config.scan.get('over_size_max', 20000)
+        self.target_time = config.scan.get('over_target_time', 5)
+        self.adaptive = config.scan.get('over_size_adaptive', True)
+
+        self.lock = threading.Lock()
+        self.size = self._clamp(size or config.scan.get('over_pipeline_size', 5000))
+
+        # running averages, for stats
+        self.articles_per_second = 0.0
+        self.bytes_per_second = 0.0
+        self.error_rate = 0.0
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    @staticmethod
+    def _average(current, new):
+        return new if not current else current + SMOOTHING * (new - current)
+
+    def record(self, articles, received, seconds):
+        """Record a range that came back: the number of articles it had,
+        the bytes it took and how long it took to arrive."""
+        with self.lock:
+            seconds = max(seconds, 0.001)
+            self.articles_per_second = self._average(self.articles_per_second, articles / seconds)
+            self.bytes_per_second = self._average(self.bytes_per_second, received / seconds)
+            self.error_rate *= 1 - SMOOTHING
+
+            if not self.adaptive:
+                return
+
+            if seconds > self.target_time:
+                # too slow, shrink in proportion (but no more than half at once)
+                self.size = self._clamp(self.size * max(0.5, self.target_time / seconds))
+            elif seconds < self.target_time / 2:
+                # plenty of headroom, grow gently
+                self.size = self._clamp(self.size * 1.25)
+
+    def error(self):
+        """Record a range that failed."""
+        with self.lock:
+            self.error_rate += SMOOTHING * (1 - self.error_rate)
+            if self.adaptive:
+                self.size = self._clamp(self.size / 2)
+
+    def save(self):
+        """Save the current size on the group, and log how it's going."""
+        log.debug('chunks: {}: over size {} [{:.0f} art/s, {:.0f} KB/s, {:.1%} err]'.format(
+            self.group_name, self.size, self.articles_per_second, self.bytes_per_second / 1024, self.error_rate
+        ))
+
+        with db_session() as db:
+            db.query(Group).filter(Group.name == self.group_name).update({Group.over_size: self.size})
+            db.commit()
+
+
+_sizers = {}
+_lock = threading.Lock()
+
+
+def sizer(group_name):
+    """Returns the sizer for a group, shared between everything scanning it."""
+    with _lock:
+        if group_name not in _sizers:
+            with db_session() as db:
+                size = db.query(Group.over_size).filter(Group.name == group_name).scalar()
+            _sizers[group_name] = ChunkSizer(group_name, size)
+
+        return _sizers[group_name]
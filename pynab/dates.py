@@ -0,0 +1,78 @@
+"""Fast parsing for the dates in overviews and headers.
+
+Usenet dates are almost all RFC 5322 (ie. 'Sat, 17 Oct 2015 10:02:41 +0000')
+and the same few strings come up over and over within a chunk, so we match
+those with one regex and cache the results. Anything odd goes to dateutil,
+which is what we used for everything before and is very slow."""
+
+import datetime
+import functools
+
+import regex
+import dateutil.parser
+
+DATE_REGEX = regex.compile(
+    r'^\s*(?:[a-z]{3},?\s*)?(\d{1,2})\s+([a-z]{3})[a-z]*\s+(\d{2,4})\s+'
+    r'(\d{1,2}):(\d{2})(?::(\d{2}))?\s*(?:([+-])(\d{2})(\d{2})|([a-z]{1,5}))?\s*(?:\(.*\))?\s*$',
+    regex.I
+)
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+# obsolete zone names from RFC 5322 4.3, in minutes
+ZONES = {
+    'ut': 0, 'utc': 0, 'gmt': 0, 'z': 0,
+    'est': -300, 'edt': -240, 'cst': -360, 'cdt': -300,
+    'mst': -420, 'mdt': -360, 'pst': -480, 'pdt': -420
+}
+
+_timezones = {}
+
+
+def _timezone(minutes):
+    if minutes not in _timezones:
+        if minutes:
+            _timezones[minutes] = datetime.timezone(datetime.timedelta(minutes=minutes))
+        else:
+            _timezones[minutes] = datetime.timezone.utc
+    return _timezones[minutes]
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(date):
+    """Parses a date header. Dates with a zone come back aware, dates
+    without come back naive, same as dateutil.parser.parse().
+    Raises ValueError if it can't be parsed at all."""
+    result = DATE_REGEX.match(date)
+    if result:
+        day, month, year, hour, minute, second, sign, tz_hours, tz_minutes, zone = result.groups()
+
+        month = MONTHS.get(month.lower())
+        if month:
+            year = int(year)
+            if year < 100:
+                # RFC 5322 4.3
+                year += 2000 if year < 50 else 1900
+
+            tzinfo = None
+            if sign:
+                minutes = int(tz_hours) * 60 + int(tz_minutes)
+                tzinfo = _timezone(-minutes if sign == '-' else minutes)
+            elif zone:
+                if zone.lower() in ZONES:
+                    tzinfo = _timezone(ZONES[zone.lower()])
+                else:
+                    # military zones and whatever else, leave it to dateutil
+                    return dateutil.parser.parse(date)
+
+            try:
+                return datetime.datetime(year, month, int(day), int(hour), int(minute), int(second or 0),
+                                         tzinfo=tzinfo)
+            except ValueError:
+                # out of range, ie. 31 Feb. dateutil will complain properly
+                pass
+
+    return dateutil.parser.parse(date)
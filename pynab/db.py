@@ -6,12 +6,17 @@ import time
 import tempfile
 import os
 import hashlib
+import io
+import struct
+import collections
 
 import psycopg2
 from sqlalchemy import Column, Integer, BigInteger, LargeBinary, Text, String, Boolean, DateTime, ForeignKey, \
     create_engine, UniqueConstraint, Enum, Index, func, and_, exc, event
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql import expression
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref, sessionmaker, scoped_session
+from sqlalchemy.orm import relationship, backref, sessionmaker, scoped_session, deferred
 from sqlalchemy.pool import Pool
 
 import config
@@ -91,6 +96,118 @@ def copy_file(engine, data, ordering, type):
 
     return True
 
+
+# binary copy header: signature, flags, header extension length
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+COPY_EPOCH = datetime.datetime(2000, 1, 1)
+# element type oids for arrays. these have to match the column exactly,
+# postgres won't take a text[] for a varchar[]
+ARRAY_OIDS = {'int4': 23, 'int8': 20, 'text': 25, 'varchar': 1043}
+
+
+def _pack_field(value, type):
+    """Packs a single value in postgres' binary wire format."""
+    if value is None:
+        return struct.pack('>i', -1)
+    if type == 'int8':
+        return struct.pack('>iq', 8, int(value))
+    if type == 'int4':
+        return struct.pack('>ii', 4, int(value))
+    if type == 'timestamp':
+        # microseconds since 2000-01-01, wall clock, same as the csv did
+        delta = value.replace(tzinfo=None) - COPY_EPOCH
+        return struct.pack('>iq', 8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+    if type.endswith('[]'):
+        # one-dimensional array: ndim, has nulls, element oid, length, lower bound, elements
+        element = type[:-2]
+        data = struct.pack('>iiiii', 1, 0, ARRAY_OIDS[element], len(value), 1) + \
+            b''.join(_pack_field(item, element) for item in value)
+        return struct.pack('>i', len(data)) + data
+
+    # text or varchar, which can't have nulls in them
+    data = str(value).replace('\x00', '').encode('utf-8', 'replace')
+    return struct.pack('>i', len(data)) + data
+
+
+class CopyBinaryStream(io.RawIOBase):
+    """A file-like object that packs rows into a binary COPY as it's read,
+    so copy_expert can stream it without the whole thing sitting in memory."""
+
+    def __init__(self, rows, columns):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.count = struct.pack('>h', len(columns))
+        self.buffer = bytearray(COPY_BINARY_HEADER)
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1048576
+
+        while len(self.buffer) < size and not self.finished:
+            row = next(self.rows, None)
+            if row is None:
+                self.buffer += COPY_BINARY_TRAILER
+                self.finished = True
+                break
+
+            self.buffer += self.count
+            for name, type in self.columns:
+                self.buffer += _pack_field(row[name], type)
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def copy_binary(engine, rows, columns, type):
+    """
+    Copies a list of dicts into a table with postgres' binary COPY, which
+    skips building and parsing csv text entirely. columns is a list of
+    (name, postgres type) pairs, where type is int8, int4, timestamp, text or
+    varchar, or an array of any of those but timestamp (ie. int4[]).
+
+    Returns False if it didn't work (or can't, ie. not on postgres), so the
+    caller can fall back to copy_file().
+    """
+    if 'postgre' not in config.db.get('engine') or not config.db.get('binary_copy', True):
+        return False
+
+    insert_start = time.time()
+
+    conn = engine.raw_connection()
+    cur = conn.cursor()
+    try:
+        copy_binary_cursor(cur, type.__tablename__, rows, columns)
+    except Exception as e:
+        log.error('db: binary copy failed, falling back to csv: {}'.format(e))
+        conn.rollback()
+        cur.close()
+        return False
+    conn.commit()
+    cur.close()
+
+    insert_end = time.time()
+    log.debug('parts: {} binary insert: {:.2f}s'.format(config.db.get('engine'), insert_end - insert_start))
+
+    return True
+
+
+def copy_binary_cursor(cur, table_name, rows, columns):
+    """Binary COPYs rows into a table on an existing cursor, without
+    committing - for when it's one step of something bigger."""
+    cur.copy_expert(
+        'COPY {} ({}) FROM STDIN WITH BINARY'.format(table_name, ', '.join(name for name, _ in columns)),
+        CopyBinaryStream(rows, columns),
+        size=1048576
+    )
+
+
 def truncate_table(engine, table_type):
     """
     Handles truncate table for given table type.
@@ -121,7 +238,12 @@ def vacuum(mode='scan', full=False):
         conn.connection.connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
 
         if mode == 'scan':
-            if full:
+            if full and config.db.get('partitioned_parts', False):
+                # parts and segments get their space back by dropping partitions
+                conn.execute('VACUUM FULL ANALYZE binaries')
+                conn.execute('VACUUM ANALYZE parts')
+                conn.execute('VACUUM ANALYZE segments')
+            elif full:
                 conn.execute('VACUUM FULL ANALYZE binaries')
                 conn.execute('VACUUM FULL ANALYZE parts')
                 conn.execute('VACUUM FULL ANALYZE segments')
@@ -245,9 +367,22 @@ def literalquery(statement):
         compile_kwargs={'literal_binds': True},
     ).string
 
+@event.listens_for(Pool, "connect")
+def remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
 # handle mysql disconnections
 @event.listens_for(Pool, "checkout")
 def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        # this came over from the parent in a fork (ie. a binary process worker)
+        # so it's the parent's socket. drop it without closing or using it
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('connection record belongs to pid {}, attempting to check out in pid {}'
+                                     .format(connection_record.info['pid'], pid))
+
     cursor = dbapi_connection.cursor()
     try:
         cursor.execute("SELECT 1")
@@ -274,74 +409,66 @@ def db_session():
         raise
 
 
-# thanks zzzeek! https://bitbucket.org/zzzeek/sqlalchemy/wiki/UsageRecipes/WindowedRangeQuery
-def column_windows(session, column, windowsize):
-    """Return a series of WHERE clauses against
-    a given column that break it into windows.
+def _keyset_windows(qry, pk, size):
+    """Windows of size rows, found with WHERE pk > last ORDER BY pk.
+    Only the end of each window is looked up (off the pk index), just before
+    it's needed, so nothing has to scan the whole set before the first row
+    comes back, and the caller can commit or change rows as it goes."""
+    ids = qry.with_entities(pk).order_by(None).order_by(pk)
+
+    last = None
+    while True:
+        q = ids if last is None else ids.filter(pk > last)
+        end = q.offset(size - 1).limit(1).scalar()
+
+        if last is None and end is None:
+            yield None
+        elif last is None:
+            yield pk <= end
+        elif end is None:
+            yield pk > last
+        else:
+            yield and_(pk > last, pk <= end)
 
-    Result is an iterable of tuples, consisting of
-    ((start, end), whereclause), where (start, end) are the ids.
+        if end is None:
+            break
+        last = end
 
-    Requires a database that supports window functions,
-    i.e. Postgresql, SQL Server, Oracle.
 
-    Enhance this yourself !  Add a "where" argument
-    so that windows of just a subset of rows can
-    be computed.
-    """
+def _streamed_windows(qry, pk, size):
+    """Windows of size rows, with the ids streamed from a named server-side
+    cursor (postgres only). The cursor gets its own connection, since
+    the caller's commits would close it otherwise."""
+    ids = qry.with_entities(pk).order_by(None).order_by(pk)
 
-    def int_for_range(start_id, end_id):
-        if end_id:
-            return and_(
-                column >= start_id,
-                column < end_id
-            )
-        else:
-            return column >= start_id
-
-    q = session.query(
-        column,
-        func.row_number().
-        over(order_by=column).
-        label('rownum')
-    ). \
-        from_self(column)
-    if windowsize > 1:
-        q = q.filter("rownum %% %d=1" % windowsize)
-
-    intervals = [id for id, in q]
-
-    while intervals:
-        start = intervals.pop(0)
-        if intervals:
-            end = intervals[0]
-        else:
-            end = None
-        yield int_for_range(start, end)
+    conn = engine.connect().execution_options(stream_results=True)
+    try:
+        result = conn.execute(ids.statement)
+        while True:
+            batch = result.fetchmany(size)
+            if not batch:
+                break
+            yield and_(pk >= batch[0][0], pk <= batch[-1][0])
+    finally:
+        conn.close()
 
 
 def windowed_query(qry, pk, size):
     """
     Break a Query into windows on a given column.
+    Rows come back in pk windows, ordered by the query's own order_by
+    (if it has one) and then pk within each window.
     """
 
-    if 'postgre' in config.db.get('engine'):
-        for whereclause in column_windows(qry.session, pk, size):
-            for row in qry.filter(whereclause).order_by(pk):
-                yield row
+    if 'postgre' in config.db.get('engine') and config.db.get('server_side_cursors', False):
+        windows = _streamed_windows(qry, pk, size)
     else:
-        # mysql etc
-        firstid = None
-        while True:
-            q = qry
-            if firstid is not None:
-                q = qry.filter(pk > firstid)
-            rec = None
-            for rec in q.order_by(pk).limit(size):
-                yield rec
-            if rec is None:
-                break
-            firstid = pk.__get__(rec, pk) if rec else None
+        windows = _keyset_windows(qry, pk, size)
+
+    for whereclause in windows:
+        q = qry if whereclause is None else qry.filter(whereclause)
+        for row in q.order_by(pk):
+            yield row
 
 
 def json_serial(obj):
@@ -516,6 +643,9 @@ class Group(Base):
     last = Column(BigInteger)
     name = Column(String(200))
 
+    # current OVER range size, see pynab.chunks
+    over_size = Column(Integer)
+
     __table_args__ = (
         {
             'mysql_engine': 'InnoDB',
@@ -543,12 +673,18 @@ class Binary(Base):
     regex_id = Column(Integer, ForeignKey('regexes.id', ondelete='SET NULL'), index=True)
     regex = relationship('Regex', backref=backref('binaries'))
 
+    # kept up to date as parts and segments come in, see pynab.binaries.update_completion()
+    available_parts = Column(Integer, default=0, server_default='0')
+    available_segments = Column(BigInteger, default=0, server_default='0')
+    total_segments = Column(BigInteger, default=0, server_default='0')
+    complete = Column(Boolean, default=False, server_default=expression.false(), index=True)
+
     parts = relationship('Part', passive_deletes=True, order_by="asc(Part.subject)")
 
     def size(self):
         size = 0
         for part in self.parts:
-            for segment in part.segments:
+            for segment in part.get_segments():
                 size += segment.size
 
         return size
@@ -561,6 +697,10 @@ class Binary(Base):
         }
     )
 
+# a segment unpacked from a part, looks enough like a Segment to use in its place
+PackedSegment = collections.namedtuple('PackedSegment', ['segment', 'size', 'message_id'])
+
+
 # it's unlikely these will ever be used in sqlalchemy
 # for performance reasons, but keep them to create tables etc
 class Part(Base):
@@ -578,11 +718,35 @@ class Part(Base):
     xref = Column(String(1024))
     group_name = Column(String(200), index=True)
 
+    # segments saved so far, counted as they're saved
+    available_segments = Column(Integer, default=0, server_default='0')
+
     binary_id = Column(Integer, ForeignKey('binaries.id', ondelete='CASCADE'), index=True)
 
     segments = relationship('Segment', passive_deletes=True, order_by="asc(Segment.segment)")
 
+    # with db.packed_segments on, segments are kept here instead of as rows
+    # as three arrays in segment number order. deferred, since binary
+    # processing goes through every part and doesn't care about segments
+    segment_numbers = deferred(Column(ARRAY(Integer).with_variant(Text, 'mysql')), group='packed')
+    segment_sizes = deferred(Column(ARRAY(Integer).with_variant(Text, 'mysql')), group='packed')
+    segment_ids = deferred(Column(ARRAY(String(256)).with_variant(Text, 'mysql')), group='packed')
+
+    def get_segments(self):
+        """All of the part's segments in order, whether they're rows or packed."""
+        if not self.segment_numbers:
+            return self.segments
+
+        packed = [PackedSegment(*s) for s in zip(self.segment_numbers, self.segment_sizes, self.segment_ids)]
+        if not self.segments:
+            return packed
+
+        # some got saved as rows, ie. if a packed save fell back
+        numbers = set(self.segment_numbers)
+        return sorted(packed + [s for s in self.segments if s.segment not in numbers], key=lambda s: s.segment)
+
     __table_args__ = (
+        UniqueConstraint(hash, group_name),
         {
             'mysql_engine': 'InnoDB',
             'mysql_charset': 'utf8',
@@ -603,6 +767,23 @@ class Segment(Base):
 
     part_id = Column(BigInteger, ForeignKey('parts.id', ondelete='CASCADE'), index=True)
 
+    __table_args__ = (
+        UniqueConstraint(part_id, segment),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8',
+            'mysql_row_format': 'DYNAMIC'
+        }
+    )
+
+
+# domains interned out of message-ids, see pynab.msgids
+class MessageIdDomain(Base):
+    __tablename__ = 'message_id_domains'
+
+    id = Column(Integer, primary_key=True)
+    domain = Column(String(255), unique=True, nullable=False)
+
     __table_args__ = (
         {
             'mysql_engine': 'InnoDB',
@@ -631,6 +812,26 @@ class Miss(Base):
     )
 
 
+class ArticleDate(Base):
+    __tablename__ = 'article_dates'
+
+    id = Column(Integer, primary_key=True)
+    group_name = Column(String(200), index=True)
+
+    article = Column(BigInteger, nullable=False)
+    date = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(group_name, article),
+        Index('ix_article_dates_group_name_date', group_name, date),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8',
+            'mysql_row_format': 'DYNAMIC'
+        }
+    )
+
+
 class Regex(Base):
     __tablename__ = 'regexes'
 
@@ -1,3 +1,5 @@
+import concurrent.futures
+
 from intspan import intspan
 from sqlalchemy.sql.expression import bindparam
 #from memory_profiler import profile
@@ -20,115 +22,186 @@ def scan(group_name, direction='forward', date=None, target=None, limit=None):
                 group = db.query(Group).filter(Group.name == group_name).first()
 
                 if group:
-                    # sort out missing first/lasts
-                    if not group.first and not group.last:
-                        group.first = last
-                        group.last = last
-                        direction = 'backward'
-                    elif not group.first:
-                        group.first = group.last
-                    elif not group.last:
-                        group.last = group.first
-
-                    # check that our firsts and lasts are valid
-                    if group.first < first:
-                        log.error('group: {}: first article was older than first on server'.format(group_name))
-                        return True
-                    elif group.last > last:
-                        log.error('group: {}: last article was newer than last on server'.format(group_name))
-                        return True
-
+                    direction, target, chunks = plan_scan(group, first, last, direction, date, target, server)
                     db.merge(group)
 
-                    # sort out a target
-                    start = 0
-                    mult = 0
-                    if direction == 'forward':
-                        start = group.last
-                        target = last
-                        mult = 1
-                    elif direction == 'backward':
-                        start = group.first
-                        if not target:
-                            target = server.day_to_post(group_name,
-                                                    server.days_old(date) if date else config.scan.get('backfill_days',
-                                                                                                       10))
-                        mult = -1
-
-                    if not target:
-                        log.info('group: {}: unable to continue'.format(group_name))
+                    if chunks is None:
                         return True
 
-                    if group.first <= target <= group.last:
-                        log.info('group: {}: nothing to do, already have target'.format(group_name))
-                        return True
-
-                    if first > target or last < target:
-                        log.error('group: {}: server doesn\'t carry target article'.format(group_name))
-                        return True
-
-                    iterations = 0
-                    num = config.scan.get('message_scan_limit') * mult
-                    for i in range(start, target, num):
-                        # set the beginning and ends of the scan to their respective values
-                        begin = i + mult
-                        end = i + (mult * config.scan.get('message_scan_limit'))
-
-                        # check if the target is before our end
-                        if abs(begin) <= abs(target) <= abs(end):
-                            # we don't want to overscan
-                            end = target
-
-                        # at this point, we care about order
-                        # flip them if one is bigger
-                        begin, end = (begin, end) if begin < end else (end, begin)
-
-                        status, parts, messages, missed = server.scan(group_name, first=begin, last=end)
-
-                        try:
-                            if direction == 'forward':
-                                group.last = max(messages)
-                            elif direction == 'backward':
-                                group.first = min(messages)
-                        except:
-                            log.error('group: {}: problem updating group ({}-{})'.format(group_name, start, end))
-                            return False
-
-                        # don't save misses if we're backfilling, there are too many
-                        if status and missed and config.scan.get('retry_missed') and direction == 'forward':
-                            save_missing_segments(group_name, missed)
-
-                        if status and parts:
-                            if pynab.parts.save_all(parts):
+                    # article numbers are per provider, so the workers have to
+                    # scan the one we planned against. hand our connection back
+                    # so they can use it
+                    provider = server.pool.name
+                    server.quit()
+
+                    # fetch chunks over several connections at once, but only move
+                    # first/last over chunks that are done and contiguous with what
+                    # we already have, so dying part-way never leaves a hole
+                    connections = max(1, config.scan.get('group_scan_connections', 1))
+                    completed = {}
+                    contiguous = 0
+                    submitted = 0
+                    failed = False
+                    futures = {}
+
+                    with concurrent.futures.ThreadPoolExecutor(connections) as executor:
+                        while True:
+                            while not failed and submitted < len(chunks) and len(futures) < connections \
+                                    and not (limit and submitted >= 3):#* config.scan.get('message_scan_limit') >= limit:
+                                begin, end = chunks[submitted]
+                                futures[executor.submit(scan_range, group_name, begin, end, provider)] = submitted
+                                submitted += 1
+
+                            if not futures:
+                                break
+
+                            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in done:
+                                index = futures.pop(future)
+                                begin, end = chunks[index]
+
+                                try:
+                                    status, parts, messages, missed = future.result()
+                                except Exception as e:
+                                    log.error('group: {}: problem scanning {}-{}: {}'.format(group_name, begin, end, e))
+                                    failed = True
+                                    continue
+
+                                if not messages:
+                                    log.error('group: {}: problem updating group ({}-{})'.format(group_name, begin, end))
+                                    failed = True
+                                    continue
+
+                                # don't save misses if we're backfilling, there are too many
+                                if status and missed and config.scan.get('retry_missed') and direction == 'forward':
+                                    save_missing_segments(group_name, missed)
+
+                                if status and parts:
+                                    if not pynab.parts.save_all(parts):
+                                        log.error('group: {}: problem saving parts to db, restarting scan'.format(group_name))
+                                        failed = True
+                                        continue
+
+                                completed[index] = max(messages) if direction == 'forward' else min(messages)
+
+                                parts.clear()
+                                del messages[:]
+                                del missed[:]
+
+                            # move the group along as far as we've got without gaps
+                            moved = False
+                            while contiguous in completed:
+                                if direction == 'forward':
+                                    group.last = completed.pop(contiguous)
+                                elif direction == 'backward':
+                                    group.first = completed.pop(contiguous)
+                                contiguous += 1
+                                moved = True
+
+                            if moved:
                                 db.merge(group)
                                 db.commit()
-                            else:
-                                log.error('group: {}: problem saving parts to db, restarting scan'.format(group_name))
-                                return False
-
-                        to_go = abs(target - end)
-                        log.info('group: {}: {:.0f} iterations ({} messages) to go'.format(
-                                group_name,
-                                to_go / config.scan.get('message_scan_limit'),
-                                to_go
-                            )
-                        )
 
-                        parts.clear()
-                        del messages[:]
-                        del missed[:]
+                                begin, end = chunks[contiguous - 1]
+                                to_go = abs(target - (end if direction == 'forward' else begin))
+                                log.info('group: {}: {:.0f} iterations ({} messages) to go'.format(
+                                        group_name,
+                                        to_go / config.scan.get('message_scan_limit'),
+                                        to_go
+                                    )
+                                )
 
-                        iterations += 1
+                    if failed:
+                        return False
 
-                        if limit and iterations >= 3:#* config.scan.get('message_scan_limit') >= limit:
-                            log.info(
-                                'group: {}: scan limit reached, ending early (will continue later)'.format(group_name))
-                            return False
+                    if contiguous < len(chunks):
+                        log.info(
+                            'group: {}: scan limit reached, ending early (will continue later)'.format(group_name))
+                        return False
 
                     log.info('group: {}: scan completed'.format(group_name))
                     return True
 
 
+def plan_scan(group, first, last, direction='forward', date=None, target=None, server=None):
+    """Works out what needs scanning in a group, given the first and last
+    articles on the server, and fixes up the group's own first/last as it goes.
+
+    Returns (direction, target, chunks), where chunks is a list of (begin, end)
+    ranges in the order they should be scanned, or None if there's nothing to do."""
+    # sort out missing first/lasts
+    if not group.first and not group.last:
+        group.first = last
+        group.last = last
+        direction = 'backward'
+    elif not group.first:
+        group.first = group.last
+    elif not group.last:
+        group.last = group.first
+
+    # check that our firsts and lasts are valid
+    if group.first < first:
+        log.error('group: {}: first article was older than first on server'.format(group.name))
+        return direction, target, None
+    elif group.last > last:
+        log.error('group: {}: last article was newer than last on server'.format(group.name))
+        return direction, target, None
+
+    # sort out a target
+    start = 0
+    mult = 0
+    if direction == 'forward':
+        start = group.last
+        target = last
+        mult = 1
+    elif direction == 'backward':
+        start = group.first
+        if not target:
+            target = server.day_to_post(group.name,
+                                        server.days_old(date) if date else config.scan.get('backfill_days', 10))
+        mult = -1
+
+    if not target:
+        log.info('group: {}: unable to continue'.format(group.name))
+        return direction, target, None
+
+    if group.first <= target <= group.last:
+        log.info('group: {}: nothing to do, already have target'.format(group.name))
+        return direction, target, None
+
+    if first > target or last < target:
+        log.error('group: {}: server doesn\'t carry target article'.format(group.name))
+        return direction, target, None
+
+    # build the chunks we want, in the order we want them
+    chunks = []
+    num = config.scan.get('message_scan_limit') * mult
+    for i in range(start, target, num):
+        # set the beginning and ends of the scan to their respective values
+        begin = i + mult
+        end = i + (mult * config.scan.get('message_scan_limit'))
+
+        # check if the target is before our end
+        if abs(begin) <= abs(target) <= abs(end):
+            # we don't want to overscan
+            end = target
+
+        # at this point, we care about order
+        # flip them if one is bigger
+        begin, end = (begin, end) if begin < end else (end, begin)
+
+        chunks.append((begin, end))
+
+    return direction, target, chunks
+
+
+def scan_range(group_name, first, last, provider=None):
+    """Scan part of a group on its own pooled connection, to the named
+    provider if there is one (ie. the one the scan was planned against)."""
+    with Server(provider) as server:
+        return server.scan(group_name, first=first, last=last, save=pynab.parts.save_all)
+
+
 def save_missing_segments(group_name, missing_segments):
     """Handles any missing segments by mashing them into ranges
     and saving them to the db for later checking."""
@@ -197,10 +270,8 @@ def scan_missing_segments(group_name):
             # mash it into ranges
             missing_ranges = intspan(missing_messages).ranges()
 
-            server = Server()
-            server.connect()
-
-            status, parts, messages, missed = server.scan(group_name, message_ranges=missing_ranges)
+            with Server() as server:
+                status, parts, messages, missed = server.scan(group_name, message_ranges=missing_ranges)
 
             # if we got some missing parts, save them
             if parts:
@@ -216,9 +287,3 @@ def scan_missing_segments(group_name):
                 # clear up those we didn't get
                 save_missing_segments(group_name, missed)
 
-            if server.connection:
-                try:
-                    server.connection.quit()
-                except:
-                    pass
-
@@ -0,0 +1,118 @@
+"""Compact storage for message-ids.
+
+Nearly every message-id we store ends in one of a handful of domains
+('@powerpost2000AA.local', '@JBinUp.local' and so on) after a random local
+part, so the domain is most of what's repeated. When parts are saved, the
+domain is swapped for its id in the message_id_domains table, and it's put
+back when the NZB is made:
+
+    'abc123@JBinUp.local' <-> 'abc123\\x1f7'
+
+Anything without the separator is an ordinary message-id, so stored ids
+that were saved with db.compact_message_ids off still work as they are.
+
+The local part is stored as it comes. It's random per segment, so there's
+nothing to intern, and it's already mixed-case letters, digits and
+punctuation from posters that all format it differently - repacking it
+into a denser alphabet would only save a few bytes on the odd hex one, and
+would need a binary column that the packed segment_ids arrays can't hold."""
+
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from pynab import log
+from pynab.db import db_session, MessageIdDomain
+import config
+
+# unit separator, which can't turn up in a real message-id
+SEPARATOR = '\x1f'
+
+
+class MessageIdCodec:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = None
+        self.domains = None
+
+    def reload(self):
+        with db_session() as db:
+            domains = db.query(MessageIdDomain.id, MessageIdDomain.domain).all()
+
+        self.ids = dict((domain, id) for id, domain in domains)
+        self.domains = dict((id, domain) for id, domain in domains)
+
+    def _add(self, domain):
+        """Interns a new domain. Someone else might get there first, in which
+        case we just pick up their id."""
+        with db_session() as db:
+            try:
+                db.add(MessageIdDomain(domain=domain))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+
+        self.reload()
+        log.debug('msgids: interned new domain {}'.format(domain))
+
+    def _domain_id(self, domain):
+        with self.lock:
+            if self.ids is None:
+                self.reload()
+            if domain not in self.ids:
+                self._add(domain)
+            return self.ids[domain]
+
+    def _domain(self, id):
+        with self.lock:
+            if self.domains is None or id not in self.domains:
+                self.reload()
+            return self.domains.get(id)
+
+    def encode(self, message_id):
+        """Swaps the domain of a message-id for its id."""
+        if not message_id or SEPARATOR in message_id or '@' not in message_id:
+            return message_id
+
+        local, domain = message_id.rsplit('@', 1)
+        if not domain or len(domain) > 255:
+            return message_id
+
+        return '{}{}{:d}'.format(local, SEPARATOR, self._domain_id(domain))
+
+    def decode(self, stored):
+        """Turns a stored message-id back into the real thing."""
+        if not stored or SEPARATOR not in stored:
+            return stored
+
+        local, id = stored.rsplit(SEPARATOR, 1)
+        domain = self._domain(int(id))
+        if domain is None:
+            log.error('msgids: unknown domain id {} in message-id {}'.format(id, local))
+            return local
+
+        return '{}@{}'.format(local, domain)
+
+
+codec = MessageIdCodec()
+
+
+def encode(message_id):
+    if not config.db.get('compact_message_ids', True):
+        return message_id
+    return codec.encode(message_id)
+
+
+def decode(stored):
+    return codec.decode(stored)
+
+
+def encode_parts(parts):
+    """Encodes the message-ids of every segment in a batch of parts, in place.
+    Safe to run twice, since encoded ids are left alone."""
+    if not config.db.get('compact_message_ids', True):
+        return
+
+    for part in parts.values():
+        for segment in part['segments'].values():
+            segment['message_id'] = codec.encode(segment['message_id'])
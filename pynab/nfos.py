@@ -60,16 +60,12 @@ def process(limit=None, category=0):
                                 continue
                             nfos.append(part)
 
-                    for nfo in nfos:
-                        try:
-                            article = server.get(release.group.name, [nfo['message_id'], ])
-                        except Exception as e:
-                            # if usenet's not accessible, don't block it forever
-                            log.error('nfo: unable to get nfo: {}'.format(e))
-                            continue
-
+                    # pipeline the lot, and stop at the first one that comes back
+                    for message_id, article in server.get_many(release.group.name,
+                                                               [nfo['message_id'] for nfo in nfos]):
                         if article:
-                            data = gzip.compress(article.encode('utf-8'))
+                            # stored as it always has been: the bytes as latin-1 text, in utf-8
+                            data = gzip.compress(article.decode('latin-1').encode('utf-8'))
                             nfo = NFO(data=data)
                             db.add(nfo)
 
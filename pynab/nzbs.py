@@ -14,6 +14,7 @@ from pynab.db import db_session, NZB, Category, Release, Group
 from pynab import log
 import pynab
 import pynab.binaries
+import pynab.msgids
 
 
 XPATH_FILE = etree.XPath('file/@subject')
@@ -147,11 +148,11 @@ def create(name, parent_category_name, binary):
             xml.write('<group>{}</group>\n'.format(group))
 
         xml.write('</groups>\n<segments>\n')
-        for segment in part.segments:
+        for segment in part.get_segments():
             xml.write('<segment bytes="{}" number="{}">{}</segment>\n'.format(
                 segment.size,
                 segment.segment,
-                escape(segment.message_id)
+                escape(pynab.msgids.decode(segment.message_id))
             ))
         xml.write('</segments>\n</file>\n')
     xml.write('</nzb>')
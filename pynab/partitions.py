@@ -0,0 +1,228 @@
+"""Partitioned, unlogged parts and segments tables (postgres only).
+
+Parts and segments are scratch space: they're copied in by the million,
+then deleted as binaries and releases are made. As ordinary tables that
+means a lot of WAL for data we'd never want back after a crash, and dead
+rows that only VACUUM FULL (and its table lock) really gets rid of.
+
+With db.partitioned_parts on, both tables are partitioned into unlogged
+buckets of db.partition_size part ids. Segments are partitioned on part_id
+with the same bounds, so each bucket of parts has a matching bucket of
+segments. Ids come from a sequence, so buckets fill up in the order parts
+are found, and once everything in an old bucket is past dead_binary_age
+the pair is detached and dropped instead of being deleted row by row.
+
+partition() and unpartition() convert the tables either way. They're run
+by the alembic migration (depending on the setting), by install.py and by
+scripts/switch_partitioning.py, which is how to change an existing db."""
+
+import datetime
+
+import pytz
+
+from pynab import log
+from pynab.db import engine
+import config
+
+PART_INDEXES = ['hash', 'total_segments', 'posted', 'group_name', 'binary_id']
+SEGMENT_INDEXES = ['segment', 'part_id']
+
+
+def enabled():
+    return 'postgre' in config.db.get('engine') and config.db.get('partitioned_parts', False)
+
+
+def partition_size():
+    return config.db.get('partition_size', 1000000)
+
+
+def is_partitioned(conn):
+    """Whether the parts table is currently partitioned."""
+    return bool(conn.execute(
+        "SELECT count(*) FROM pg_partitioned_table WHERE partrelid = 'parts'::regclass"
+    ).scalar())
+
+
+def _current_bucket(conn, size):
+    last_value, = conn.execute('SELECT last_value FROM parts_id_seq').fetchone()
+    return last_value // size
+
+
+def _create_bucket(conn, bucket, size, parts='parts', segments='segments'):
+    start = bucket * size
+    end = (bucket + 1) * size
+
+    conn.execute('CREATE UNLOGGED TABLE IF NOT EXISTS parts_p{} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'
+                 .format(bucket, parts, start, end))
+    conn.execute('CREATE UNLOGGED TABLE IF NOT EXISTS segments_p{} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'
+                 .format(bucket, segments, start, end))
+
+
+def _buckets(conn):
+    """The bucket numbers of every partition of parts, oldest first."""
+    names = conn.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'parts'::regclass"
+    ).fetchall()
+
+    return sorted(int(name[len('parts_p'):]) for name, in names if name.startswith('parts_p'))
+
+
+def _add_constraints(conn, partitioned):
+    if partitioned:
+        # primary and unique keys on a partitioned table have to include the partition key
+        conn.execute('ALTER TABLE parts ADD CONSTRAINT parts_pkey PRIMARY KEY (id)')
+        conn.execute('ALTER TABLE segments ADD CONSTRAINT segments_pkey PRIMARY KEY (id, part_id)')
+        # parts can't be unique on (hash, group_name) any more, so it's just an index
+        conn.execute('CREATE INDEX ix_parts_hash_group_name ON parts (hash, group_name)')
+    else:
+        conn.execute('ALTER TABLE parts ADD CONSTRAINT parts_pkey PRIMARY KEY (id)')
+        conn.execute('ALTER TABLE segments ADD CONSTRAINT segments_pkey PRIMARY KEY (id)')
+        conn.execute('ALTER TABLE parts ADD CONSTRAINT parts_hash_group_name_key UNIQUE (hash, group_name)')
+
+    conn.execute('ALTER TABLE segments ADD CONSTRAINT segments_part_id_segment_key UNIQUE (part_id, segment)')
+
+    conn.execute('ALTER TABLE parts ADD CONSTRAINT parts_binary_id_fkey FOREIGN KEY (binary_id) '
+                 'REFERENCES binaries (id) ON DELETE CASCADE')
+    conn.execute('ALTER TABLE segments ADD CONSTRAINT segments_part_id_fkey FOREIGN KEY (part_id) '
+                 'REFERENCES parts (id) ON DELETE CASCADE')
+
+    for column in PART_INDEXES:
+        conn.execute('CREATE INDEX ix_parts_{0} ON parts ({0})'.format(column))
+    for column in SEGMENT_INDEXES:
+        conn.execute('CREATE INDEX ix_segments_{0} ON segments ({0})'.format(column))
+
+
+def _swap_tables(conn, partitioned):
+    """Copies everything into the new parts_new and segments_new and puts them in place of the old ones."""
+    conn.execute('INSERT INTO parts_new SELECT * FROM parts')
+    # segments without a part can't go in a partition, and they're useless anyway
+    conn.execute('INSERT INTO segments_new SELECT * FROM segments WHERE part_id IS NOT NULL')
+
+    conn.execute('ALTER SEQUENCE parts_id_seq OWNED BY NONE')
+    conn.execute('ALTER SEQUENCE segments_id_seq OWNED BY NONE')
+
+    conn.execute('DROP TABLE segments')
+    conn.execute('DROP TABLE parts')
+
+    conn.execute('ALTER TABLE parts_new RENAME TO parts')
+    conn.execute('ALTER TABLE segments_new RENAME TO segments')
+
+    conn.execute('ALTER SEQUENCE parts_id_seq OWNED BY parts.id')
+    conn.execute('ALTER SEQUENCE segments_id_seq OWNED BY segments.id')
+
+    _add_constraints(conn, partitioned)
+
+
+def partition(conn):
+    """Converts plain parts and segments tables to partitioned, unlogged ones."""
+    if is_partitioned(conn):
+        return
+
+    size = partition_size()
+    log.info('partitions: partitioning parts and segments into buckets of {} parts'.format(size))
+
+    conn.execute('CREATE TABLE parts_new (LIKE parts INCLUDING DEFAULTS) PARTITION BY RANGE (id)')
+    conn.execute('CREATE TABLE segments_new (LIKE segments INCLUDING DEFAULTS) PARTITION BY RANGE (part_id)')
+
+    first = (conn.execute('SELECT min(id) FROM parts').scalar() or 0) // size
+    for bucket in range(first, _current_bucket(conn, size) + 3):
+        _create_bucket(conn, bucket, size, 'parts_new', 'segments_new')
+
+    _swap_tables(conn, True)
+
+
+def unpartition(conn):
+    """Converts partitioned parts and segments tables back to plain ones."""
+    if not is_partitioned(conn):
+        return
+
+    log.info('partitions: converting parts and segments back to plain tables')
+
+    conn.execute('CREATE TABLE parts_new (LIKE parts INCLUDING DEFAULTS)')
+    conn.execute('CREATE TABLE segments_new (LIKE segments INCLUDING DEFAULTS)')
+
+    # nothing enforced uniqueness while partitioned, so merge any duplicates first
+    conn.execute('''
+        UPDATE segments SET part_id = d.keep
+        FROM (SELECT id, max(id) OVER (PARTITION BY hash, group_name) AS keep FROM parts) d
+        WHERE segments.part_id = d.id AND d.id <> d.keep
+    ''')
+    conn.execute('''
+        DELETE FROM parts p USING parts q
+        WHERE p.hash = q.hash AND p.group_name = q.group_name AND p.id < q.id
+    ''')
+    conn.execute('''
+        DELETE FROM segments s USING segments t
+        WHERE s.part_id = t.part_id AND s.segment = t.segment AND s.id < t.id
+    ''')
+
+    _swap_tables(conn, False)
+
+
+def _check(conn):
+    """Whether the parts table is partitioned, complaining if that doesn't
+    match db.partitioned_parts. Buckets are kept up either way, since a
+    partitioned table with nowhere to put new ids stops taking inserts."""
+    partitioned = is_partitioned(conn)
+    if partitioned != bool(config.db.get('partitioned_parts', False)):
+        log.error('partitions: db.partitioned_parts is {} but the parts table is {}partitioned - '
+                  'run scripts/switch_partitioning.py to convert it'.format(
+                      'on' if config.db.get('partitioned_parts', False) else 'off',
+                      '' if partitioned else 'not '))
+    return partitioned
+
+
+def ensure():
+    """Makes sure there are buckets ready for the next few million parts.
+    Run before each scan."""
+    if 'postgre' not in config.db.get('engine'):
+        return
+
+    size = partition_size()
+    with engine.begin() as conn:
+        if not _check(conn):
+            return
+
+        current = _current_bucket(conn, size)
+        for bucket in range(current, current + 3):
+            _create_bucket(conn, bucket, size)
+
+
+def expire(dead_time=None):
+    """Drops every old bucket whose parts are all older than dead_binary_age
+    (or that's empty). Returns the number of buckets dropped."""
+    if 'postgre' not in config.db.get('engine'):
+        return 0
+
+    if not dead_time:
+        dead_time = pytz.utc.localize(datetime.datetime.now()).replace(tzinfo=None) - \
+            datetime.timedelta(days=config.scan.get('dead_binary_age', 1))
+
+    size = partition_size()
+    dropped = 0
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return 0
+
+        current = _current_bucket(conn, size)
+        for bucket in _buckets(conn):
+            # never the one we're filling
+            if bucket >= current:
+                continue
+
+            newest = conn.execute('SELECT max(posted) FROM parts_p{}'.format(bucket)).scalar()
+            if newest and newest > dead_time:
+                continue
+
+            # segments first, so nothing references the parts when they're detached
+            conn.execute('ALTER TABLE segments DETACH PARTITION segments_p{}'.format(bucket))
+            conn.execute('DROP TABLE segments_p{}'.format(bucket))
+            conn.execute('ALTER TABLE parts DETACH PARTITION parts_p{}'.format(bucket))
+            conn.execute('DROP TABLE parts_p{}'.format(bucket))
+            dropped += 1
+
+    if dropped:
+        log.info('partitions: dropped {} expired buckets of parts and segments'.format(dropped))
+
+    return dropped
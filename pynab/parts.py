@@ -5,10 +5,42 @@ import struct
 #from memory_profiler import profile
 
 import regex
+from sqlalchemy import func, select
 from sqlalchemy.orm import Load, subqueryload
 
-from pynab.db import db_session, engine, Part, Segment, copy_file
+from pynab.db import db_session, engine, Part, Segment, copy_file, copy_binary, copy_binary_cursor
 from pynab import log
+import pynab.binaries
+import pynab.msgids
+import pynab.partitions
+import config
+
+
+# column order and postgres types for the bulk copies
+PART_COLUMNS = [
+    ('hash', 'int8'),
+    ('subject', 'text'),
+    ('group_name', 'text'),
+    ('posted', 'timestamp'),
+    ('posted_by', 'text'),
+    ('total_segments', 'int4'),
+    ('xref', 'text')
+]
+
+SEGMENT_COLUMNS = [
+    ('segment', 'int4'),
+    ('size', 'int4'),
+    ('message_id', 'text'),
+    ('part_id', 'int8')
+]
+
+# parts with their segments packed in, for db.packed_segments
+PACKED_PART_COLUMNS = PART_COLUMNS + [
+    ('segment_numbers', 'int4[]'),
+    ('segment_sizes', 'int4[]'),
+    # the column's varchar(256)[], and array elements have to match exactly
+    ('segment_ids', 'varchar[]')
+]
 
 
 def generate_hash(subject, posted_by, group_name, total_segments):
@@ -18,15 +50,269 @@ def generate_hash(subject, posted_by, group_name, total_segments):
     )
 
 
+def _parts_csv(part_inserts):
+    """Builds the csv for copy_file(), for when binary copy isn't available."""
+    s = io.StringIO()
+    for part in part_inserts:
+        for item, _ in PART_COLUMNS:
+            if item == 'posted':
+                s.write('"' + part[item].replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S').replace('"',
+                                                                                                    '\\"') + '",')
+            elif item == 'xref':
+                # leave off the comma
+                s.write('"' + part[item].encode('utf-8', 'replace').decode('utf-8').replace('"', '\\"') + '"')
+            else:
+                s.write('"' + str(part[item]).encode('utf-8', 'replace').decode().replace('"', '\\"') + '",')
+        s.write("\n")
+    s.seek(0)
+    return s
+
+
+def _segments_csv(segment_inserts):
+    """Builds the csv for copy_file(), for when binary copy isn't available."""
+    s = io.StringIO()
+    for segment in segment_inserts:
+        for item, _ in SEGMENT_COLUMNS:
+            if item == 'part_id':
+                # leave off the tab
+                s.write('"' + str(segment[item]).replace('"', '\\"') + '"')
+            else:
+                s.write('"' + str(segment[item]).encode('utf-8', 'replace').decode('utf-8').replace('"', '\\"') + '",')
+        s.write("\n")
+    s.seek(0)
+    return s
+
+
+# one statement to insert new parts and get ids back for the old ones too.
+# the do-nothing update is there so that existing rows get returned
+PART_UPSERT = """
+    INSERT INTO parts (hash, subject, group_name, posted, posted_by, total_segments, xref)
+    SELECT DISTINCT ON (hash, group_name) hash, subject, group_name, posted, posted_by, total_segments, xref
+    FROM parts_staging
+    ON CONFLICT (hash, group_name) DO UPDATE SET hash = EXCLUDED.hash
+    RETURNING id, hash
+"""
+
+# partitioned parts can't have a unique key on (hash, group_name), so no
+# on conflict - find the existing ones and insert the rest in one go instead
+PART_UPSERT_PARTITIONED = """
+    WITH staged AS (
+        SELECT DISTINCT ON (hash, group_name) * FROM parts_staging
+    ), existing AS (
+        SELECT DISTINCT ON (p.hash, p.group_name) p.id, p.hash, p.group_name
+        FROM parts p JOIN staged s ON p.hash = s.hash AND p.group_name = s.group_name
+        ORDER BY p.hash, p.group_name, p.id DESC
+    ), inserted AS (
+        INSERT INTO parts (hash, subject, group_name, posted, posted_by, total_segments, xref)
+        SELECT hash, subject, group_name, posted, posted_by, total_segments, xref FROM staged s
+        WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.hash = s.hash AND e.group_name = s.group_name)
+        RETURNING id, hash
+    )
+    SELECT id, hash FROM existing
+    UNION ALL
+    SELECT id, hash FROM inserted
+"""
+
+# nothing stops two saves inserting the same part at once without a unique key,
+# so they take turns per group. held until commit, and taken in order so
+# two saves with the same groups can't deadlock
+PART_GROUP_LOCK = """
+    SELECT pg_advisory_xact_lock(hashtext(group_name))
+    FROM (SELECT DISTINCT group_name FROM parts_staging ORDER BY group_name) g
+"""
+
+# insert the new segments, and count them onto their parts as we go
+SEGMENT_INSERT = """
+    WITH inserted AS (
+        INSERT INTO segments (segment, size, message_id, part_id)
+        SELECT segment, size, message_id, part_id FROM segments_staging
+        ON CONFLICT (part_id, segment) DO NOTHING
+        RETURNING part_id
+    )
+    UPDATE parts SET available_segments = parts.available_segments + new.count
+    FROM (SELECT part_id, count(*) AS count FROM inserted GROUP BY part_id) new
+    WHERE parts.id = new.part_id
+    RETURNING parts.binary_id, new.count
+"""
+
+
+# new parts go straight in. for existing ones, unpack both sets of segments,
+# keep the first of each number (the ones already saved) and pack them back up
+PACKED_PART_UPSERT = """
+    INSERT INTO parts (hash, subject, group_name, posted, posted_by, total_segments, xref,
+                       segment_numbers, segment_sizes, segment_ids, available_segments)
+    SELECT DISTINCT ON (hash, group_name) hash, subject, group_name, posted, posted_by, total_segments, xref,
+           segment_numbers, segment_sizes, segment_ids, cardinality(segment_numbers)
+    FROM parts_staging
+    ON CONFLICT (hash, group_name) DO UPDATE SET (segment_numbers, segment_sizes, segment_ids, available_segments) = (
+        SELECT array_agg(number ORDER BY number), array_agg(size ORDER BY number), array_agg(message_id ORDER BY number),
+               count(*)
+        FROM (
+            SELECT DISTINCT ON (number) number, size, message_id
+            FROM (
+                SELECT 0 AS source, * FROM unnest(parts.segment_numbers, parts.segment_sizes, parts.segment_ids)
+                    AS old(number, size, message_id)
+                UNION ALL
+                SELECT 1 AS source, * FROM unnest(EXCLUDED.segment_numbers, EXCLUDED.segment_sizes, EXCLUDED.segment_ids)
+                    AS new(number, size, message_id)
+            ) AS merged
+            ORDER BY number, source
+        ) AS segments
+    )
+    RETURNING binary_id
+"""
+
+
+def packed():
+    """Whether segments are packed into their parts rather than saved as rows.
+    Packing needs the unique key on parts, so not with partitioned_parts."""
+    return 'postgre' in config.db.get('engine') and config.db.get('packed_segments', False) \
+        and not pynab.partitions.enabled()
+
+
+def count_segments(db):
+    """Number of segments waiting to be processed, however they're stored."""
+    count = db.query(Segment).count()
+    if packed():
+        count += db.query(func.coalesce(func.sum(func.cardinality(Part.segment_numbers)), 0)).scalar()
+    return count
+
+
+def _packed_rows(parts):
+    for part in parts.values():
+        segments = sorted(part['segments'].values(), key=lambda s: int(s['segment']))
+        row = dict(part)
+        row['segment_numbers'] = [s['segment'] for s in segments]
+        row['segment_sizes'] = [s['size'] for s in segments]
+        row['segment_ids'] = [s['message_id'] for s in segments]
+        yield row
+
+
+def _upsert_packed(parts):
+    """Saves parts with their segments packed into arrays on the part, one
+    row per part instead of one per segment. Existing parts have their
+    arrays merged with the new segments by postgres.
+    Returns False if it didn't work, so save_all() can do it the old way."""
+    start = time.time()
+
+    conn = engine.raw_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            'CREATE TEMPORARY TABLE parts_staging ON COMMIT DROP AS '
+            'SELECT {} FROM parts WITH NO DATA'.format(', '.join(name for name, _ in PACKED_PART_COLUMNS))
+        )
+        copy_binary_cursor(cur, 'parts_staging', _packed_rows(parts), PACKED_PART_COLUMNS)
+
+        cur.execute(PACKED_PART_UPSERT)
+        binary_ids = [binary_id for binary_id, in cur.fetchall()]
+        part_count = len(binary_ids)
+
+        # parts that already belong to a binary might've just finished it
+        pynab.binaries.update_completion(cur, binary_ids)
+
+        conn.commit()
+    except Exception as e:
+        log.error('parts: packed save failed, falling back: {}'.format(e))
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+    end = time.time()
+
+    log.debug('parts: saved {} packed parts with {} segments in {:.2f}s'.format(
+        part_count,
+        sum(len(part['segments']) for part in parts.values()),
+        end - start
+    ))
+
+    return True
+
+
+def _upsert_all(parts):
+    """Saves parts and segments by copying them into temporary staging tables
+    and letting postgres sort out what's new, rather than loading every
+    existing part and segment to diff against. Needs the unique keys on
+    parts (hash, group_name) and segments (part_id, segment).
+    Returns False if it didn't work, so save_all() can do it the old way."""
+    start = time.time()
+
+    conn = engine.raw_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            'CREATE TEMPORARY TABLE parts_staging ON COMMIT DROP AS '
+            'SELECT {} FROM parts WITH NO DATA'.format(', '.join(name for name, _ in PART_COLUMNS))
+        )
+        copy_binary_cursor(cur, 'parts_staging', parts.values(), PART_COLUMNS)
+
+        if pynab.partitions.enabled():
+            cur.execute(PART_GROUP_LOCK)
+            cur.execute(PART_UPSERT_PARTITIONED)
+        else:
+            cur.execute(PART_UPSERT)
+        ids = dict((hash, id) for id, hash in cur.fetchall())
+
+        def segments():
+            for hash, part in parts.items():
+                for segment in part['segments'].values():
+                    segment['part_id'] = ids[hash]
+                    yield segment
+
+        cur.execute(
+            'CREATE TEMPORARY TABLE segments_staging ON COMMIT DROP AS '
+            'SELECT {} FROM segments WITH NO DATA'.format(', '.join(name for name, _ in SEGMENT_COLUMNS))
+        )
+        copy_binary_cursor(cur, 'segments_staging', segments(), SEGMENT_COLUMNS)
+
+        cur.execute(SEGMENT_INSERT)
+        counts = cur.fetchall()
+        segment_count = sum(count for _, count in counts)
+
+        # parts that already belong to a binary might've just finished it
+        pynab.binaries.update_completion(cur, [binary_id for binary_id, _ in counts])
+
+        conn.commit()
+    except Exception as e:
+        log.error('parts: staged save failed, falling back: {}'.format(e))
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+    end = time.time()
+
+    log.debug('parts: upserted {} parts and saved {} new segments in {:.2f}s'.format(
+        len(ids),
+        segment_count,
+        end - start
+    ))
+
+    return True
+
+
 #@profile
 def save_all(parts):
     """Save a set of parts to the DB, in a batch if possible."""
     if parts:
+        pynab.msgids.encode_parts(parts)
+
+        if packed():
+            if _upsert_packed(parts):
+                return True
+        elif 'postgre' in config.db.get('engine') and config.db.get('upsert_parts', True):
+            if _upsert_all(parts):
+                return True
+
         start = time.time()
         group_name = list(parts.values())[0]['group_name']
 
         with db_session() as db:
-            # this is a little tricky. parts have no uniqueness at all.
+            # this is the slow way, for mysql and anything _upsert_all() can't do.
+            # parts have no real uniqueness (just hash+group_name in the db).
             # no uniqid and the posted dates can change since it's based off the first
             # segment that we see in that part, which is different for each scan.
             # what we do is get the next-closest thing (subject+author+group) and
@@ -52,26 +338,12 @@ def save_all(parts):
                     part['segments'] = segments
 
             if part_inserts:
-                ordering = ['hash', 'subject', 'group_name', 'posted', 'posted_by', 'total_segments', 'xref']
-
-                s = io.StringIO()
-                for part in part_inserts:
-                    for item in ordering:
-                        if item == 'posted':
-                            s.write('"' + part[item].replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S').replace('"',
-                                                                                                                '\\"') + '",')
-                        elif item == 'xref':
-                            # leave off the comma
-                            s.write('"' + part[item].encode('utf-8', 'replace').decode('utf-8').replace('"', '\\"') + '"')
-                        else:
-                            s.write('"' + str(part[item]).encode('utf-8', 'replace').decode().replace('"', '\\"') + '",')
-                    s.write("\n")
-                s.seek(0)
-
-                if not copy_file(engine, s, ordering, Part):
-                    return False
+                if not copy_binary(engine, part_inserts, PART_COLUMNS, Part):
+                    s = _parts_csv(part_inserts)
+                    if not copy_file(engine, s, [name for name, _ in PART_COLUMNS], Part):
+                        return False
+                    s.close()
 
-                s.close()
                 db.close()
 
         with db_session() as db:
@@ -109,23 +381,28 @@ def save_all(parts):
                     return False
 
             if segment_inserts:
-                ordering = ['segment', 'size', 'message_id', 'part_id']
-
-                s = io.StringIO()
-                for segment in segment_inserts:
-                    for item in ordering:
-                        if item == 'part_id':
-                            # leave off the tab
-                            s.write('"' + str(segment[item]).replace('"', '\\"') + '"')
-                        else:
-                            s.write('"' + str(segment[item]).encode('utf-8', 'replace').decode('utf-8').replace('"', '\\"') + '",')
-                    s.write("\n")
-                s.seek(0)
+                if not copy_binary(engine, segment_inserts, SEGMENT_COLUMNS, Segment):
+                    s = _segments_csv(segment_inserts)
+                    if not copy_file(engine, s, [name for name, _ in SEGMENT_COLUMNS], Segment):
+                        return False
+                    s.close()
 
-                if not copy_file(engine, s, ordering, Segment):
-                    return False
+                # recount the parts we added to, and their binaries
+                part_ids = sorted(set(segment['part_id'] for segment in segment_inserts))
+                for i in range(0, len(part_ids), 1000):
+                    db.execute(
+                        Part.__table__.update().where(Part.id.in_(part_ids[i:i + 1000])).values(
+                            available_segments=select([func.count(Segment.id)]).where(
+                                Segment.part_id == Part.id).as_scalar()
+                        )
+                    )
+                    pynab.binaries.update_completion(db, [
+                        binary_id for binary_id, in
+                        db.query(Part.binary_id).filter(Part.id.in_(part_ids[i:i + 1000])).filter(
+                            Part.binary_id != None).distinct()
+                    ])
+                db.commit()
 
-                s.close()
                 db.close()
 
         end = time.time()
@@ -143,10 +420,5 @@ def save_all(parts):
 
 
 def is_blacklisted(part, group_name, blacklists):
-    for blacklist in blacklists:
-        if regex.search(blacklist.group_name, group_name):
-            # too spammy
-            # log.debug('{0}: Checking blacklist {1}...'.format(group_name, blacklist['regex']))
-            if regex.search(blacklist.regex, part[blacklist.field]):
-                return True
-    return False
\ No newline at end of file
+    """Checks a part against a pynab.blacklists.BlacklistMatcher."""
+    return blacklists.match(group_name, part) is not None
\ No newline at end of file
@@ -90,14 +90,13 @@ def check_rar(filename):
         return False
 
 
-def get_rar_info(server, group_name, messages):
-    data = server.get(group_name, messages)
-
+def rar_info(data):
+    """Checks a chunk of rar data for passwords and a file list."""
     if data:
         # if we got the requested articles, save them to a temp rar
         t = None
         with tempfile.NamedTemporaryFile('wb', suffix='.rar', delete=False) as t:
-            t.write(data.encode('ISO-8859-1'))
+            t.write(data)
             t.flush()
 
         try:
@@ -175,59 +174,59 @@ def check_release_files(server, group_name, nzb):
     # but also return file info from everything we can get to
     all_info = []
 
+    # get the rar info of the first segment of each rarfile
+    # this should be enough to get a file list
+    # if a rar has no segments, the release is fucked and we should ignore it
+    first_segments = []
     for rar in nzb['rars']:
-        # if the rar has no segments, the release is fucked and we should ignore it
-        if not rar['segments']:
-            continue
-
         for s in rar['segments']:
             if s['message_id']:
-                # get the rar info of the first segment of the rarfile
-                # this should be enough to get a file list
-                passworded, info = get_rar_info(server, group_name, [s['message_id']])
-
-                # if any file info was returned, add it to the pile
-                if info:
-                    all_info += info
-
-                # if the rar itself is passworded, skip everything else
-                if passworded:
-                    highest_password = 'YES'
-
-                # if we got file info and we're not yet 100% certain, have a look
-                if info and highest_password != 'YES':
-                    for file in info:
-                        # if we want to delete spam, check the group and peek inside
-                        if config.postprocess.get('delete_spam', False):
-                            if group_name in config.postprocess.get('delete_spam_groups', []):
-                                result = SPAM_REGEX.search(file['name'])
-                                if result:
-                                    log.debug('rar: release is spam')
-                                    highest_password = 'YES'
-                                    break
-
-
-                        # whether "maybe" releases get deleted or not is a config option
-                        result = MAYBE_PASSWORDED_REGEX.search(file['name'])
-                        if result and (not highest_password or highest_password == 'NO'):
-                            log.debug('rar: release might be passworded')
-                            highest_password = 'MAYBE'
-                            break
+                first_segments.append(s['message_id'])
+                break
 
-                        # as is definitely-deleted
-                        result = PASSWORDED_REGEX.search(file['name'])
-                        if result and (not highest_password or highest_password == 'NO' or highest_password == 'MAYBE'):
-                            log.debug('rar: release is passworded')
+    # fetch them all down one pipeline, and check each as it arrives
+    for message_id, data in server.get_many(group_name, first_segments):
+        passworded, info = rar_info(data)
+
+        # if any file info was returned, add it to the pile
+        if info:
+            all_info += info
+
+        # if the rar itself is passworded, skip everything else
+        if passworded:
+            highest_password = 'YES'
+
+        # if we got file info and we're not yet 100% certain, have a look
+        if info and highest_password != 'YES':
+            for file in info:
+                # if we want to delete spam, check the group and peek inside
+                if config.postprocess.get('delete_spam', False):
+                    if group_name in config.postprocess.get('delete_spam_groups', []):
+                        result = SPAM_REGEX.search(file['name'])
+                        if result:
+                            log.debug('rar: release is spam')
                             highest_password = 'YES'
                             break
 
-                # if we got this far, we got some file info
-                # so we don't want the function to return False, None
-                if not highest_password:
-                    highest_password = 'NO'
 
-                # skip the rest of the segments, we don't want or need them
-                break
+                # whether "maybe" releases get deleted or not is a config option
+                result = MAYBE_PASSWORDED_REGEX.search(file['name'])
+                if result and (not highest_password or highest_password == 'NO'):
+                    log.debug('rar: release might be passworded')
+                    highest_password = 'MAYBE'
+                    break
+
+                # as is definitely-deleted
+                result = PASSWORDED_REGEX.search(file['name'])
+                if result and (not highest_password or highest_password == 'NO' or highest_password == 'MAYBE'):
+                    log.debug('rar: release is passworded')
+                    highest_password = 'YES'
+                    break
+
+        # if we got this far, we got some file info
+        # so we don't want the function to return False, None
+        if not highest_password:
+            highest_password = 'NO'
 
     # if we got info from at least one segment, return what we found
     if highest_password:
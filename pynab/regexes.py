@@ -0,0 +1,346 @@
+"""Compiled binary regex matching for binaries.process.
+
+With a few thousand regexes loaded, trying every one against every part
+(and skipping the ones for other groups with a string comparison) is
+where binary processing spends its time, and nearly all of those attempts
+fail. So rather than that, regexes are compiled once and kept until the
+regexes table changes, bucketed by group (with the '.*' ones merged into
+every bucket, in ordinal order), and each one gets a prefilter: the
+longest run of literal text that any match has to contain. If that isn't
+in the subject, the regex can't match and we don't bother running it."""
+
+import hashlib
+import threading
+import time
+
+import regex
+
+from pynab import log
+from pynab.db import db_session, Regex
+import config
+
+QUANTIFIER_REGEX = regex.compile(r'\{(\d*)(?:,(\d*))?\}')
+INLINE_FLAGS_REGEX = regex.compile(r'\(\?([a-zA-Z]+)[:)]')
+
+# escapes that take an argument, ie. \x41, \p{L}, \g<name>
+ESCAPES_WITH_ARGUMENTS = 'xuUNpPgk0123456789'
+
+
+def _skip_quantifier(pattern, i):
+    """Returns the position after the quantifier at i (if there is one),
+    and whether that quantifier allows zero repeats."""
+    if i >= len(pattern):
+        return i, False
+
+    c = pattern[i]
+    if c in '?*+':
+        optional = c != '+'
+        i += 1
+    elif c == '{':
+        result = QUANTIFIER_REGEX.match(pattern, i)
+        if not result:
+            # just a literal brace
+            return i, False
+        optional = not int(result.group(1) or 0)
+        i = result.end()
+    else:
+        return i, False
+
+    # lazy or possessive
+    if i < len(pattern) and pattern[i] in '?+':
+        i += 1
+
+    return i, optional
+
+
+def _skip_class(pattern, i):
+    """Returns the position after the character class starting at i, or
+    None if it has anything nested in it ([:alpha:], sets, set operations),
+    since then the first ] isn't necessarily the end."""
+    i += 1
+    if i < len(pattern) and pattern[i] == '^':
+        i += 1
+    if i < len(pattern) and pattern[i] == ']':
+        i += 1
+    while i < len(pattern) and pattern[i] != ']':
+        if pattern[i] == '[':
+            return None
+        i += 2 if pattern[i] == '\\' else 1
+    return i + 1
+
+
+def _skip_group(pattern, i):
+    """Returns the position after the group starting at i, or None if it never closes."""
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            i = _skip_class(pattern, i)
+            if i is None:
+                return None
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return None
+
+
+def required_literals(pattern):
+    """Runs of literal text that have to appear in anything the pattern
+    matches. Conservative: groups, classes and anything optional just end
+    the current run, and a top-level alternation means there's nothing
+    we can rely on at all. Only ascii is kept, so case folding stays simple."""
+    literals = []
+    run = []
+
+    def end_run():
+        if run:
+            literals.append(''.join(run))
+            del run[:]
+
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+
+        if c == '|' or c == ')':
+            # alternation (or something broken), so nothing's required
+            return []
+
+        if c == '(':
+            end_run()
+            i = _skip_group(pattern, i)
+            if i is None:
+                return []
+            i, _ = _skip_quantifier(pattern, i)
+            continue
+
+        if c == '[':
+            end_run()
+            i = _skip_class(pattern, i)
+            if i is None:
+                # can't tell where it ends, so we can't rely on anything after it
+                return []
+            i, _ = _skip_quantifier(pattern, i)
+            continue
+
+        if c in '.^$':
+            end_run()
+            i, _ = _skip_quantifier(pattern, i + 1)
+            continue
+
+        if c in '*+?':
+            # a quantifier on something we've already dealt with
+            end_run()
+            i += 1
+            continue
+
+        if c == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if not escaped:
+                return []
+            if escaped.isalnum():
+                # \d, \b, \x41 and friends
+                end_run()
+                i += 2
+                if escaped in ESCAPES_WITH_ARGUMENTS:
+                    while i < len(pattern) and pattern[i].isalnum():
+                        i += 1
+                    if i < len(pattern) and pattern[i] in '{<':
+                        close = pattern.find('}' if pattern[i] == '{' else '>', i)
+                        i = len(pattern) if close == -1 else close + 1
+                i, _ = _skip_quantifier(pattern, i)
+                continue
+            c = escaped
+            i += 2
+        else:
+            i += 1
+
+        after, optional = _skip_quantifier(pattern, i)
+        quantified = after != i
+        i = after
+
+        if optional or not c.isascii() or (c.isspace() and c != ' '):
+            end_run()
+            continue
+
+        run.append(c)
+        if quantified:
+            # repeated, so the run can't carry on past it
+            end_run()
+
+    end_run()
+    return literals
+
+
+def fold(subject):
+    """Case folds a subject to check against case-insensitive literals.
+    Dotless i matches i case-insensitively, but doesn't fold to it."""
+    return subject.casefold().replace('\u0131', 'i')
+
+
+def convert(php_regex):
+    r"""Converts a php-style regex to python, ie. /(\w+)/i -> (\w+), regex.I.
+    No need to handle s, as it doesn't exist in python.
+
+    Why not store it as python to begin with? Some regex shouldn't be
+    case-insensitive, and this notation allows for that."""
+    flags = php_regex[php_regex.rfind('/') + 1:]
+    pattern = php_regex[php_regex.find('/') + 1:php_regex.rfind('/')]
+    return pattern, 'i' in flags
+
+
+class RegexEngine:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.check_interval = config.scan.get('regex_check_interval', 60)
+        self.checked = 0
+        self.signature = None
+        # bumped whenever the compiled regexes change, so caches know to clear
+        self.generation = 0
+        self.reload()
+
+    @staticmethod
+    def _signature():
+        """A hash of every active regex, so any change at all shows up
+        (an edit that keeps the length, swapped ordinals and so on)."""
+        digest = hashlib.md5()
+        with db_session() as db:
+            for row in db.query(Regex.id, Regex.regex, Regex.group_name, Regex.ordinal) \
+                    .filter(Regex.status == True).order_by(Regex.id):
+                digest.update(repr(tuple(row)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def reload(self):
+        with db_session() as db:
+            regexes = db.query(Regex.id, Regex.regex, Regex.group_name, Regex.ordinal) \
+                .filter(Regex.status == True).all()
+
+        # group_name: [(ordinal, id, compiled, literal, insensitive), ...]
+        self.buckets = {}
+        broken = []
+        prefiltered = 0
+        for id, php_regex, group_name, ordinal in regexes:
+            pattern, insensitive = convert(php_regex)
+            try:
+                compiled = regex.compile(pattern, regex.I if insensitive else 0)
+            except Exception:
+                broken.append(id)
+                continue
+
+            flags = ''.join(INLINE_FLAGS_REGEX.findall(pattern))
+            literal = None
+            if 'x' not in flags:
+                literals = required_literals(pattern)
+                if literals:
+                    literal = max(literals, key=len)
+                    if len(literal) < 2:
+                        literal = None
+
+            insensitive = insensitive or 'i' in flags
+            if literal:
+                prefiltered += 1
+                if insensitive:
+                    literal = fold(literal)
+
+            # nulls last, same as postgres does for order by ordinal
+            order = (ordinal is None, ordinal or 0, id)
+            self.buckets.setdefault(group_name, []).append((order, id, compiled, literal, insensitive))
+
+        # group_name: every regex that applies to it, in order. built as needed
+        self.merged = {}
+        self.generation += 1
+
+        self.signature = self._signature()
+        self.checked = time.time()
+
+        for id in broken:
+            self.remove(id)
+
+        log.info('regex: compiled {} regexes ({} prefiltered)'.format(len(regexes) - len(broken), prefiltered))
+
+    def refresh(self):
+        """Reload if the table's changed, checking at most every regex_check_interval seconds."""
+        with self.lock:
+            if time.time() - self.checked < self.check_interval:
+                return
+
+            self.checked = time.time()
+            if self._signature() != self.signature:
+                log.info('regex: regexes changed, reloading')
+                self.reload()
+
+    def remove(self, id):
+        """Drops a broken regex, from here and from the db."""
+        log.error('binary: broken regex detected. id: {:d}, removing...'.format(id))
+
+        for group_name, entries in self.buckets.items():
+            self.buckets[group_name] = [entry for entry in entries if entry[1] != id]
+        self.merged = {}
+        self.generation += 1
+
+        with db_session() as db:
+            db.query(Regex).filter(Regex.id == id).delete()
+            db.commit()
+
+        self.signature = self._signature()
+
+    def _for_group(self, group_name):
+        try:
+            return self.merged[group_name]
+        except KeyError:
+            pass
+
+        entries = self.buckets.get(group_name, [])
+        if group_name != '.*':
+            entries = sorted(entries + self.buckets.get('.*', []), key=lambda entry: entry[0])
+
+        # drop the sort order, it's done its job
+        entries = [entry[1:] for entry in entries]
+        self.merged[group_name] = entries
+        return entries
+
+    def search(self, group_name, subject):
+        """Yields (regex id, match) for every regex for the group that
+        matches the subject, in ordinal order. Stop whenever you like."""
+        folded = None
+        for id, compiled, literal, insensitive in self._for_group(group_name):
+            if literal:
+                if insensitive:
+                    if folded is None:
+                        folded = fold(subject)
+                    if literal not in folded:
+                        continue
+                elif literal not in subject:
+                    continue
+
+            try:
+                result = compiled.search(subject)
+            except Exception:
+                self.remove(id)
+                continue
+
+            if result:
+                yield id, result
+
+
+_engine = None
+_lock = threading.Lock()
+
+
+def engine():
+    """Returns the shared engine, reloading it if the regexes have changed."""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = RegexEngine()
+            return _engine
+
+    _engine.refresh()
+    return _engine
@@ -7,7 +7,8 @@ from requests_futures.sessions import FuturesSession
 from sqlalchemy.orm import *
 
 from pynab import log
-from pynab.db import to_json, db_session, engine, Binary, Part, Release, Group, Category, Blacklist
+from pynab.db import to_json, db_session, engine, Binary, Part, Release, Group, Category
+import pynab.blacklists
 import pynab.categories
 import pynab.nzbs
 import pynab.rars
@@ -152,27 +153,14 @@ def process():
     start = time.time()
 
     with db_session() as db:
-        binary_query = """
-            SELECT
-                binaries.id, binaries.name, binaries.posted, binaries.total_parts
-            FROM binaries
-            INNER JOIN (
-                SELECT
-                    parts.id, parts.binary_id, parts.total_segments, count(*) as available_segments
-                FROM parts
-                    INNER JOIN segments ON parts.id = segments.part_id
-                GROUP BY parts.id
-                ) as parts
-                ON binaries.id = parts.binary_id
-            GROUP BY binaries.id
-            HAVING count(*) >= binaries.total_parts AND (sum(parts.available_segments) / sum(parts.total_segments)) * 100 >= {}
-            ORDER BY binaries.posted DESC
-        """.format(config.postprocess.get('min_completion', 100))
+        # completion is counted up as parts and segments are saved
+        # (see pynab.binaries.update_completion), so this is just an index lookup
+        binary_query = db.query(Binary.id, Binary.name, Binary.posted, Binary.total_parts) \
+            .filter(Binary.complete == True) \
+            .order_by(Binary.posted.desc())
 
         # pre-cache blacklists and group them
-        blacklists = db.query(Blacklist).filter(Blacklist.status == True).all()
-        for blacklist in blacklists:
-            db.expunge(blacklist)
+        blacklists = pynab.blacklists.matcher()
 
         # cache categories
         parent_categories = {}
@@ -183,7 +171,7 @@ def process():
         # 38,000 releases uses 8.9mb of memory here
         # no real need to batch it, since this will mostly be run with
         # < 1000 releases per run
-        for completed_binary in engine.execute(binary_query).fetchall():
+        for completed_binary in binary_query.all():
             # some optimisations here. we used to take the binary id and load it
             # then compare binary.name and .posted to any releases
             # in doing so, we loaded the binary into the session
@@ -215,7 +203,7 @@ def process():
                 try:
                     est_size = (abs(binary.total_parts - 2) *
                                 binary.parts[int(binary.total_parts / 2)].total_segments *
-                                binary.parts[int(binary.total_parts / 2)].segments[0].size)
+                                binary.parts[int(binary.total_parts / 2)].get_segments()[0].size)
                 except IndexError:
                     log.error('release: binary [{}] - couldn\'t estimate size - bad regex: {}?'.format(binary.id, binary.regex_id))
                     continue
@@ -242,22 +230,19 @@ def process():
                     binary = db.query(Binary).options(
                         subqueryload('parts'),
                         subqueryload('parts.segments'),
-                        Load(Part).load_only(Part.id, Part.subject, Part.segments),
+                        Load(Part).load_only(Part.id, Part.subject, Part.segments,
+                                             Part.segment_numbers, Part.segment_sizes, Part.segment_ids),
                     ).filter(Binary.id == completed_binary[0]).first()
 
-                blacklisted = False
-                for blacklist in blacklists:
-                    if regex.search(blacklist.group_name, binary.group_name):
-                        # we're operating on binaries, not releases
-                        field = 'name' if blacklist.field == 'subject' else blacklist.field
-                        if regex.search(blacklist.regex, getattr(binary, field)):
-                            log.debug('release: [{}] - removed (blacklisted: {})'.format(binary.name, blacklist.id))
-                            db.query(Binary).filter(Binary.id == binary.id).delete()
-                            db.commit()
-                            blacklisted = True
-                            break
-
+                # we're operating on binaries, not releases
+                blacklisted = blacklists.match(
+                    binary.group_name, binary,
+                    lambda field: getattr(binary, 'name' if field == 'subject' else field)
+                )
                 if blacklisted:
+                    log.debug('release: [{}] - removed (blacklisted: {})'.format(binary.name, blacklisted))
+                    db.query(Binary).filter(Binary.id == binary.id).delete()
+                    db.commit()
                     continue
 
                 binary_count += 1
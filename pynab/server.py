@@ -2,54 +2,500 @@ import time
 import datetime
 import random
 import socket
+import threading
+import collections
 
 import regex
-import dateutil.parser
 import pytz
 
 import lib.nntplib as nntplib
 from pynab import log
-from pynab.db import db_session, Blacklist
+from pynab.db import db_session, ArticleDate
 import pynab.util
 import pynab.parts
+import pynab.blacklists
 import pynab.yenc
+import pynab.cache
+import pynab.chunks
+import pynab.dates
 import config
 import contextlib
 
 SEGMENT_REGEX = regex.compile('\((\d+)[\/](\d+)\)', regex.I)
 
+# news config items that belong to the pool, not nntplib
+POOL_OPTIONS = ('max_connections', 'idle_timeout', 'name', 'role', 'priority', 'providers')
+
+# primary: scanned from (load-balanced) and fetched from
+# fill: only used for articles the primaries don't have
+# backup: only used when nothing else will connect
+ROLES = ('primary', 'fill', 'backup')
+
+# how long a connection can sit idle before we check it's still alive
+POOL_CHECK_INTERVAL = 60
+
 
 class AuthException(Exception):
     pass
 
 
+def providers():
+    """Returns the configured providers, best (lowest priority) first.
+    config.news is the main primary, and anything in its providers
+    list comes along with it."""
+    main = dict(config.news)
+    main.setdefault('name', 'news')
+    main.setdefault('priority', 0)
+    main['role'] = 'primary'
+
+    extra = []
+    for provider in config.news.get('providers', []):
+        provider = dict(provider)
+        provider.setdefault('name', provider.get('host'))
+        provider.setdefault('role', 'fill')
+        provider.setdefault('priority', 10)
+        if provider['role'] not in ROLES:
+            log.error('server: {}: unknown provider role {}, ignoring'.format(provider['name'], provider['role']))
+            continue
+        extra.append(provider)
+
+    return sorted([main] + extra, key=lambda p: p['priority'])
+
+
+class ConnectionPool:
+    """A thread-safe pool of NNTP connections to one provider.
+
+    Every Server in the process checks its connection out of one of these, so
+    the total number of connections never exceeds the provider limit and we
+    don't renegotiate TLS/auth/compression for every scan or post-process."""
+
+    def __init__(self, provider=None, max_connections=None, idle_timeout=None):
+        self.provider = provider or providers()[0]
+        self.name = self.provider['name']
+        self.role = self.provider['role']
+        self.priority = self.provider['priority']
+
+        self.max_connections = max_connections or self.provider.get('max_connections', 10)
+        self.idle_timeout = idle_timeout or self.provider.get('idle_timeout', 300)
+
+        self.condition = threading.Condition()
+
+        # (connection, compression, last_used), most recently used last
+        self.idle = []
+        self.in_use = 0
+
+        # groups this provider told us it doesn't carry
+        self.missing_groups = set()
+
+    @property
+    def load(self):
+        """How much of the connection limit is in use, 0 to 1."""
+        return self.in_use / self.max_connections
+
+    def _create(self, compression):
+        news_config = self.provider.copy()
+
+        # i do this because i'm lazy
+        ssl = news_config.pop('ssl', False)
+        for option in POOL_OPTIONS:
+            news_config.pop(option, None)
+
+        if ssl:
+            return nntplib.NNTP_SSL(compression=compression, **news_config)
+        else:
+            return nntplib.NNTP(compression=compression, **news_config)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except:
+            pass
+
+    @staticmethod
+    def _healthy(connection):
+        """Check that an idle connection is still usable."""
+        try:
+            connection.date()
+        except (nntplib.NNTPTemporaryError, nntplib.NNTPPermanentError,
+                nntplib.NNTPReplyError, nntplib.NNTPDataError):
+            # the server answered, it just doesn't like DATE
+            return True
+        except:
+            return False
+        return True
+
+    def _reap(self):
+        """Pull out any connections that have been idle too long.
+        Must be called with the lock held, and the returned
+        connections closed once it's released."""
+        now = time.time()
+        expired = [c for c, _, last_used in self.idle if now - last_used > self.idle_timeout]
+        if expired:
+            self.idle = [i for i in self.idle if now - i[2] <= self.idle_timeout]
+        return expired
+
+    def checkout(self, compression=True):
+        """Get a connection from the pool, creating one if we're under
+        the limit and blocking until one is returned if we're not."""
+        while True:
+            connection = None
+            last_used = None
+
+            with self.condition:
+                while True:
+                    expired = self._reap()
+                    if expired:
+                        break
+
+                    match = [i for i, c in enumerate(self.idle) if c[1] == compression]
+                    if match:
+                        connection, _, last_used = self.idle.pop(match[-1])
+                        self.in_use += 1
+                        break
+                    elif self.idle and self.in_use + len(self.idle) >= self.max_connections:
+                        # we're full of connections with the wrong compression, recycle one
+                        expired = [self.idle.pop(0)[0]]
+                        break
+                    elif self.in_use + len(self.idle) < self.max_connections:
+                        self.in_use += 1
+                        break
+
+                    self.condition.wait()
+
+            if expired:
+                for c in expired:
+                    self._close(c)
+                continue
+
+            if connection:
+                if time.time() - last_used < POOL_CHECK_INTERVAL or self._healthy(connection):
+                    return connection
+
+                log.debug('server: pooled connection went stale, replacing it')
+                self._close(connection)
+
+            try:
+                connection = self._create(compression)
+                connection.pool_compression = compression
+                return connection
+            except:
+                with self.condition:
+                    self.in_use -= 1
+                    self.condition.notify()
+                raise
+
+    def checkin(self, connection):
+        """Return a working connection to the pool. One that's been left
+        out of sync with the server gets discarded instead."""
+        if getattr(connection, 'dirty', False):
+            self.discard(connection)
+            return
+
+        with self.condition:
+            self.in_use -= 1
+            self.idle.append((connection, getattr(connection, 'pool_compression', True), time.time()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        """Close a broken connection and free its slot."""
+        self._close(connection)
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify()
+
+    def close_all(self):
+        """Close every idle connection, ie. on shutdown."""
+        with self.condition:
+            idle = [c for c, _, _ in self.idle]
+            self.idle = []
+            self.condition.notify_all()
+
+        for connection in idle:
+            self._close(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name):
+    """Returns the pool for the named provider."""
+    with _pools_lock:
+        if name not in _pools:
+            for provider in providers():
+                if provider['name'] == name:
+                    _pools[name] = ConnectionPool(provider)
+                    break
+            else:
+                raise KeyError('no such provider: {}'.format(name))
+
+        return _pools[name]
+
+
+def close_pools():
+    """Close every pooled connection, ie. on shutdown."""
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    for pool in pools:
+        pool.close_all()
+
+
+def get_pools(roles=ROLES, group_name=None):
+    """Returns the pools for providers with the given roles, least loaded
+    first, leaving out any that don't carry group_name."""
+    pools = [get_pool(provider['name']) for provider in providers() if provider['role'] in roles]
+    if group_name:
+        pools = [p for p in pools if group_name not in p.missing_groups]
+
+    return sorted(pools, key=lambda p: (p.load, p.priority))
+
+
+def dirty(conn):
+    """Whether a Server's connection was left out of sync with the server."""
+    return bool(conn.connection and getattr(conn.connection, 'dirty', False))
+
+
 @contextlib.contextmanager
 def nntp_handler(conn, group=None):
     def reconn(conn, delay=5, group=None):
         time.sleep(delay)
-        conn.reconnect()
-        if group:
-            conn.group(group)
+        try:
+            conn.reconnect()
+            if group:
+                conn.group(group)
+        except Exception as e:
+            log.warning('server: couldn\'t reconnect: {}'.format(e))
     try:
         yield
-    except (socket.timeout, socket.error, IOError) as e:
+    except (socket.timeout, socket.error, IOError, EOFError) as e:
         log.warning('server: local socket error ({}), reconnecting in 10s...'.format(e.__repr__().encode('utf-8', 'ignore').decode('utf-8')))
         reconn(conn, 10, group)
         raise e
+    except (nntplib.NNTPTemporaryError, nntplib.NNTPPermanentError) as e:
+        log.warning('server: nntp error: {}'.format(e.__repr__().encode('utf-8', 'ignore').decode('utf-8')))
+        # a single-line status reply, so the stream's still in sync
+        # unless something was pipelined behind it
+        if dirty(conn):
+            reconn(conn, 0, group)
+        raise e
     except nntplib.NNTPProtocolError as e:
         log.warning('server: unrecoverable nntp error')
+        reconn(conn, 0, group)
         raise e
-    except (nntplib.NNTPError, nntplib.NNTPTemporaryError) as e:
+    except nntplib.NNTPError as e:
+        # bad data or an unexpected reply, which might have left half a
+        # response (or a few pipelined ones) on the socket
         log.warning('server: nntp error: {}'.format(e.__repr__().encode('utf-8', 'ignore').decode('utf-8')))
+        reconn(conn, 0, group)
         raise e
     except Exception as e:
+        # not the connection's fault, so only replace it if it was left mid-response
         log.error('server: error: {}'.format(e.__repr__().encode('utf-8', 'ignore').decode('utf-8')))
+        if dirty(conn):
+            reconn(conn, 0, group)
         raise e
 
 
+class HeaderCache:
+    """Decodes subjects and posters, remembering what it's seen.
+
+    Posters and subject stems repeat thousands of times a chunk, so one of
+    these lives for a scan and hands back the same decoded (and interned)
+    string each time. Headers without encoded-words skip email.header."""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or config.scan.get('header_cache_size', 50000)
+        self.cache = {}
+
+    def decode(self, header):
+        try:
+            return self.cache[header]
+        except KeyError:
+            pass
+
+        if '=?' not in header:
+            try:
+                header.encode('ascii')
+                decoded = header
+            except UnicodeEncodeError:
+                decoded = header.encode('utf-8', 'replace').decode('latin-1')
+        else:
+            decoded = nntplib.decode_header(header).encode('utf-8', 'replace').decode('latin-1')
+
+        # it's per-scan anyway, so just start again if it fills up
+        if len(self.cache) >= self.max_size:
+            self.cache.clear()
+        self.cache[header] = decoded
+
+        return decoded
+
+
+def add_segment(parts, group_name, overview, headers=None):
+    """Adds the segment in a single overview to a dict of parts keyed by hash.
+    Returns True if it was added, False if it wasn't a binary segment
+    and None if the overview was broken. headers is a HeaderCache to
+    decode the subject and poster with, if the caller's keeping one."""
+
+    # some messages don't have subjects? who knew
+    if 'subject' not in overview:
+        return None
+
+    # get the current segment number
+    results = SEGMENT_REGEX.findall(overview['subject'])
+
+    # it might match twice, so just get the last one
+    # the first is generally the part number
+    if results:
+        (segment_number, total_segments) = results[-1]
+    else:
+        # if there's no match at all, it's probably not a binary
+        return False
+
+    # make sure the header contains everything we need
+    try:
+        size = int(overview[':bytes'])
+    except:
+        # TODO: cull this later
+        log.debug('server: bad message: {}'.format(overview))
+        return None
+
+    # assuming everything didn't fuck up, continue
+    if not (int(segment_number) > 0 and int(total_segments) > 0):
+        # :getout:
+        return False
+
+    # strip the segment number off the subject so
+    # we can match binary parts together
+    if headers is None:
+        headers = HeaderCache()
+
+    subject = headers.decode(overview['subject'].replace(
+        '(' + str(segment_number) + '/' + str(total_segments) + ')', ''
+    ).strip())
+
+    posted_by = headers.decode(overview['from'])
+
+    # generate a hash to perform matching
+    hash = pynab.parts.generate_hash(subject, posted_by, group_name, int(total_segments))
+
+    # this is spammy as shit, for obvious reasons
+    # pynab.log.debug('Binary part found: ' + subject)
+
+    # build the segment, make sure segment number and size are ints
+    segment = {
+        'message_id': overview['message-id'][1:-1],
+        'segment': int(segment_number),
+        'size': size
+    }
+
+    # if we've already got a binary by this name, add this segment
+    if hash in parts:
+        # only count it if we haven't had it already (ie. a retried range)
+        if segment_number not in parts[hash]['segments']:
+            parts[hash]['available_segments'] += 1
+        parts[hash]['segments'][segment_number] = segment
+    else:
+        # parse the date as whatever it is, keeping its offset
+        # some subjects/posters have odd encoding, which will break pymongo
+        # so we make sure it doesn't
+        try:
+            message = {
+                'hash': hash,
+                'subject': subject,
+                'posted': pynab.dates.parse_date(overview['date']),
+                'posted_by': posted_by,
+                'group_name': group_name,
+                'xref': pynab.util.smart_truncate(overview['xref'], length=1024),
+                'total_segments': int(total_segments),
+                'available_segments': 1,
+                'segments': {segment_number: segment, },
+            }
+
+            parts[hash] = message
+        except Exception as e:
+            log.error('server: bad message parse: {}'.format(e))
+            return None
+
+    return True
+
+
+def take_batch(parts):
+    """Pulls the parts worth saving mid-scan out of a dict of parts: the
+    finished ones, or everything if that wouldn't free up at least half."""
+    finished = [k for k, v in parts.items() if len(v['segments']) >= v['total_segments']]
+    if len(finished) < len(parts) / 2:
+        finished = list(parts.keys())
+
+    return {k: parts.pop(k) for k in finished}
+
+
+def parse_date(date_header):
+    """Parses a post's date header into a UTC-aware datetime."""
+    try:
+        date = pynab.dates.parse_date(date_header)
+    except Exception as e:
+        log.error('server: date parse failed while dating message: {}'.format(e))
+        return None
+
+    try:
+        date = pytz.utc.localize(date)
+    except:
+        # no problem, it's already localised
+        pass
+
+    return date
+
+
+def known_dates(group_name, first=None, last=None):
+    """Returns the (article, date) samples we've seen for a group, in
+    article order, optionally only those between first and last."""
+    with db_session() as db:
+        query = db.query(ArticleDate.article, ArticleDate.date).filter(ArticleDate.group_name == group_name)
+        if first:
+            query = query.filter(ArticleDate.article >= first)
+        if last:
+            query = query.filter(ArticleDate.article <= last)
+
+        return [(article, pytz.utc.localize(date)) for article, date in query.order_by(ArticleDate.article).all()]
+
+
+def save_dates(group_name, dates, first=None):
+    """Saves a dict of article: date samples for a group, and throws
+    out any that have expired off the server (older than first)."""
+    with db_session() as db:
+        if first:
+            db.query(ArticleDate).filter(ArticleDate.group_name == group_name).filter(
+                ArticleDate.article < first).delete(False)
+
+        if dates:
+            existing = {article for article, in db.query(ArticleDate.article).filter(
+                ArticleDate.group_name == group_name).filter(ArticleDate.article.in_(list(dates))).all()}
+
+            new_dates = [
+                {
+                    'group_name': group_name,
+                    'article': article,
+                    'date': date.astimezone(pytz.utc).replace(tzinfo=None)
+                }
+                for article, date in dates.items() if article not in existing
+            ]
+
+            if new_dates:
+                db.execute(ArticleDate.__table__.insert(), new_dates)
+
+        db.commit()
+
+
 class Server:
-    def __init__(self):
+    def __init__(self, provider=None, roles=('primary',)):
+        """Connect to a named provider, or the least-loaded one with one of
+        the given roles (falling back to backups if none of them work)."""
         self.connection = None
+        self.provider = provider
+        self.roles = roles
+        self.pool = None
 
     def __enter__(self):
         return self
@@ -58,81 +504,196 @@ class Server:
         self.quit()
 
     def reconnect(self):
-        self.quit()
-        self.connect()
+        """Swaps the connection for a fresh one from the same provider.
+        Article numbers are per provider, so a scan can't move to another one."""
+        if not self.pool:
+            return self.connect()
+
+        # the old connection is probably broken, so don't give it back
+        compression = True
+        if self.connection:
+            compression = getattr(self.connection, 'pool_compression', True)
+            self.pool.discard(self.connection)
+            self.connection = None
+
+        try:
+            self.connection = self.pool.checkout(compression)
+        except Exception as e:
+            log.error('server: could not reconnect to news server {}: {}'.format(self.pool.name, e))
+            return False
+
+        return True
 
     def quit(self):
+        """Hands the connection back to the pool."""
         if self.connection:
-            try:
-                self.connection.quit()
-            except:
-                self.connection = None
-            finally:
-                self.connection = None
+            self.pool.checkin(self.connection)
+            self.connection = None
 
     def group(self, group_name):
-        self.connect()
+        # if a primary doesn't carry the group, try the next one
+        for _ in range(len(get_pools(self.roles)) if not self.provider else 1):
+            self.connect(group_name=group_name)
+
+            if not self.connection:
+                break
 
-        if self.connection:
             try:
                 with nntp_handler(self):
                     response, count, first, last, name = self.connection.group(group_name)
+            except nntplib.NNTPTemporaryError as e:
+                if str(e).startswith('411'):
+                    log.info('server: {}: {} doesn\'t carry this group'.format(group_name, self.pool.name))
+                    self.pool.missing_groups.add(group_name)
+                    self.quit()
+                    continue
+                return None, False, None, None, None
             except:
                 return None, False, None, None, None
 
             return response, count, first, last, name
-        else:
-            return None, False, None, None, None
 
-    def connect(self, compression=True):
-        """Creates a connection to a news server."""
-        if not self.connection:
-            news_config = config.news.copy()
+        return None, False, None, None, None
 
-            # i do this because i'm lazy
-            ssl = news_config.pop('ssl', False)
+    def select_group(self, group_name):
+        """Selects a group, unless it's already selected on this connection."""
+        if self.connection.current_group != group_name:
+            self.connection.group(group_name)
 
-            try:
-                if ssl:
-                    self.connection = nntplib.NNTP_SSL(compression=compression, **news_config)
-                else:
-                    self.connection = nntplib.NNTP(compression=compression, **news_config)
-            except Exception as e:
-                log.error('server: could not connect to news server: {}'.format(e))
+    def connect(self, compression=True, group_name=None):
+        """Checks a connection to the news server out of the pool."""
+        if not self.connection:
+            if self.provider:
+                pools = [get_pool(self.provider)]
+            else:
+                pools = get_pools(self.roles, group_name) + get_pools(('backup',), group_name)
+
+            for pool in pools:
+                try:
+                    self.connection = pool.checkout(compression)
+                    self.pool = pool
+                    break
+                except Exception as e:
+                    log.error('server: could not connect to news server {}: {}'.format(pool.name, e))
+            else:
                 return False
 
         return True
 
     def get(self, group_name, messages=None):
-        """Get a set of messages from the server for the specified group."""
-        self.connect()
+        """Get a set of messages from the server for the specified group,
+        joined together. Returns None if any of them couldn't be had."""
+        if not messages:
+            return None
 
-        data = ''
-        if messages:
-            try:
-                with nntp_handler(self, group_name):
-                    _, total, first, last, _ = self.connection.group(group_name)
-                    for message in messages:
-                        article = '<{}>'.format(message)
-                        response, (number, message_id, lines) = self.connection.body(article)
-                        res = pynab.yenc.yenc_decode(lines)
-                        if res:
-                            data += res
-                        else:
-                            return None
-            except:
+        # get_many() yields them as they come (cached ones first),
+        # so put them back in order before joining them up
+        data = {}
+        for message_id, res in self.get_many(group_name, messages):
+            if not res:
                 return None
+            data[message_id] = res
+
+        return b''.join(data[message] for message in messages)
+
+    def get_many(self, group_name, messages):
+        """Fetch and decode a set of messages with pipelined BODYs, yielding
+        (message_id, data) for each as soon as it arrives. data is None if
+        that article was missing, broken or not yEnc, rather than failing
+        the whole batch.
+
+        Messages are fetched by message-id, so the group doesn't need
+        selecting - group_name is just for logging. Anything in the local
+        article cache comes from there instead, and comes first, so results
+        aren't necessarily in the order they were asked for."""
+        missing = []
+        for message in messages:
+            data = pynab.cache.cache.get(message)
+            if data:
+                yield message, data
+            else:
+                missing.append(message)
 
-            return data
-        else:
-            return None
+        if not missing:
+            return
+
+        # anything the primary doesn't have (or couldn't give us)
+        # gets another go on each fill server, best first
+        failed = []
+        for message_id, data, retry in self._fetch(group_name, missing):
+            if retry:
+                failed.append(message_id)
+            else:
+                yield message_id, data
+
+        for provider in providers():
+            if not failed:
+                break
+            if provider['role'] != 'fill' or (self.pool and provider['name'] == self.pool.name):
+                continue
+
+            still_failed = []
+            with Server(provider['name']) as fill:
+                fetched = fill._fetch(group_name, failed)
+                try:
+                    for message_id, data, retry in fetched:
+                        if retry:
+                            still_failed.append(message_id)
+                        else:
+                            log.debug('server: {}: got {} from fill server {}'.format(
+                                group_name, message_id, provider['name']))
+                            yield message_id, data
+                finally:
+                    fetched.close()
+            failed = still_failed
+
+        for message_id in failed:
+            yield message_id, None
+
+    def _fetch(self, group_name, messages):
+        """Fetch messages from this server with pipelined BODYs, yielding
+        (message_id, data, retry), where retry is True if another server
+        might have it (the server said 430 or the connection went)."""
+        self.connect()
 
-    def scan(self, group_name, first=None, last=None, message_ranges=None):
-        """Scan a group for segments and return a list."""
+        depth = config.postprocess.get('body_pipeline_depth', 8)
+        done = set()
+        try:
+            with nntp_handler(self):
+                articles = ['<{}>'.format(message) for message in messages]
+                responses = self.connection.body_pipelined(articles, depth)
+                try:
+                    for article, resp, lines in responses:
+                        message_id = article[1:-1]
+                        done.add(message_id)
+                        if lines is None:
+                            log.debug('server: {}: couldn\'t get {}: {}'.format(group_name, message_id, resp))
+                            yield message_id, None, resp.startswith('430')
+                        else:
+                            data = pynab.yenc.yenc_decode(lines)
+                            pynab.cache.cache.put(message_id, data)
+                            yield message_id, data, False
+                finally:
+                    # if the caller stopped early, this reads off the rest
+                    responses.close()
+        except Exception as e:
+            # the connection went, so whatever's left is a bust this time
+            log.debug('server: {}: problem fetching articles: {}'.format(group_name, e))
+            for message in messages:
+                if message not in done:
+                    yield message, None, True
+
+    def scan(self, group_name, first=None, last=None, message_ranges=None, save=None):
+        """Scan a group for segments and return a list.
+
+        Overviews are parsed one at a time as they come off the wire. If
+        `save` is given, parts are handed to it in batches of roughly
+        part_save_batch segments as the scan goes, so memory use doesn't
+        grow with the size of the range, and only the leftovers are returned."""
         self.connect()
 
         messages_missed = []
-        overviews = []
+        messages = []
 
         start = time.time()
 
@@ -146,149 +707,165 @@ class Server:
                 if check == 3:
                     return False, None, None, None
                 with nntp_handler(self):
-                    self.connection.group(group_name)
+                    self.select_group(group_name)
                     break
             except:
                 continue
 
-        if message_ranges:
-            for first, last in message_ranges:
-                range_overviews = None
-                while True:
-                    i += 1
-                    log.debug('server: {}: getting range {}-{}'.format(group_name, first, last))
-                    try:
-                        with nntp_handler(self, group_name):
-                            status, range_overviews = self.connection.over((first, last))
-                    except:
-                        # 3 attempts
-                        if i == 3:
-                            log.warning('server: {}: timed out a bunch, we\'ll try again later'.format(group_name))
-                            break
-                        continue
-
-                    if range_overviews:
-                        overviews += range_overviews
-                    else:
-                        # we missed them
-                        messages_missed += range(first, last + 1)
-                    break
-        else:
-            while True:
-                i += 1
-                log.debug('server: {}: getting range {}-{}'.format(group_name, first, last))
-                try:
-                    with nntp_handler(self, group_name):
-                        status, overviews = self.connection.over((first, last))
-                        break
-                except:
-                    # 3 attempts
-                    if i == 3:
-                        log.warning('server: {}: timed out a bunch, we\'ll try again later'.format(group_name))
-                        break
-                    continue
+        blacklists = pynab.blacklists.matcher()
 
         parts = {}
-        messages = []
+        dates = {}
+        headers = HeaderCache()
+        buffered = 0
         ignored = 0
+        total_parts = 0
+        blacklisted_parts = 0
+        batch_size = config.scan.get('part_save_batch', 50000)
 
-        if overviews:
-            with db_session() as db:
-                blacklists = db.query(Blacklist).filter(Blacklist.status == True).all()
-                for blacklist in blacklists:
-                    db.expunge(blacklist)
-
-            for (id, overview) in overviews:
-                # keep track of which messages we received so we can
-                # optionally check for ones we missed later
-                messages.append(id)
-
-                # some messages don't have subjects? who knew
-                if 'subject' not in overview:
-                    continue
+        def flush(batch):
+            nonlocal total_parts, blacklisted_parts
+            # instead of checking every single individual segment, package them first
+            # so we typically only end up checking the blacklist for ~150 parts instead of thousands
+            blacklist = [k for k, v in batch.items() if pynab.parts.is_blacklisted(v, group_name, blacklists)]
+            blacklisted_parts += len(blacklist)
+            total_parts += len(batch)
+            for k in blacklist:
+                del batch[k]
 
-                # get the current segment number
-                results = SEGMENT_REGEX.findall(overview['subject'])
+            if save and batch:
+                return save(batch)
+            return True
 
-                # it might match twice, so just get the last one
-                # the first is generally the part number
-                if results:
-                    (segment_number, total_segments) = results[-1]
-                else:
-                    # if there's no match at all, it's probably not a binary
-                    ignored += 1
-                    continue
+        # ranges still to be sent. when scanning first-last, they're cut
+        # from `cursor` as we go, so they're sized as the sizer adapts
+        if message_ranges:
+            pending = collections.deque(message_ranges)
+            cursor = None
+        else:
+            pending = collections.deque()
+            cursor = first
+
+        sizer = pynab.chunks.sizer(group_name)
+        # ranges sent but not yet finished with, in order
+        sent = collections.deque()
+
+        def ranges():
+            nonlocal cursor
+            while pending:
+                sent.append(pending.popleft())
+                yield sent[-1]
+            while cursor is not None and cursor <= last:
+                sent.append((cursor, min(cursor + sizer.size - 1, last)))
+                cursor = sent[-1][1] + 1
+                yield sent[-1]
+
+        # articles we got from a range that broke halfway, so they
+        # aren't counted twice when it's retried
+        already_received = set()
+        received = len(messages)
+
+        # pipeline the OVERs so we're not paying a round trip per range
+        depth = config.scan.get('over_pipeline_depth', 4)
+        while pending or (cursor is not None and cursor <= last):
+            i += 1
+            try:
+                with nntp_handler(self, group_name):
+                    for (range_first, range_last), overviews in \
+                            self.connection.over_pipelined(ranges(), depth):
+                        received = len(messages)
+                        got = 0
+                        sampled = False
+                        range_start = time.time()
+                        bytes_start = self.connection.bytes_received
+                        saving = 0
+
+                        for (id, overview) in overviews:
+                            got += 1
+                            if id in already_received:
+                                continue
+
+                            # keep track of which messages we received so we can
+                            # optionally check for ones we missed later
+                            messages.append(id)
+
+                            # remember a date per range, for day_to_post
+                            if not sampled and overview.get('date'):
+                                sampled = True
+                                date = parse_date(overview['date'])
+                                if date:
+                                    dates[id] = date
+
+                            result = add_segment(parts, group_name, overview, headers)
+                            if result is False:
+                                ignored += 1
+                                continue
+                            elif not result:
+                                continue
+                            buffered += 1
+
+                            # pass finished parts on to be saved once we've got enough,
+                            # and everything if that doesn't free up enough
+                            if save and buffered >= batch_size:
+                                save_start = time.time()
+                                # a db problem isn't a connection problem, so don't
+                                # let it get retried like one
+                                try:
+                                    saved = flush(take_batch(parts))
+                                except Exception as e:
+                                    log.error('server: {}: error saving parts: {}'.format(group_name, e))
+                                    saved = False
+
+                                if not saved:
+                                    log.error('server: {}: problem saving parts, stopping scan'.format(group_name))
+                                    return False, None, None, None
+
+                                buffered = sum(len(v['segments']) for v in parts.values())
+                                saving += time.time() - save_start
+
+                        # don't count time spent in the db against the server
+                        sizer.record(
+                            len(messages) - received,
+                            self.connection.bytes_received - bytes_start,
+                            time.time() - range_start - saving
+                        )
+
+                        log.debug('server: {}: got range {}-{}'.format(group_name, range_first, range_last))
+                        sent.popleft()
+
+                        if not got and message_ranges:
+                            # we missed them
+                            messages_missed += range(range_first, range_last + 1)
+            except:
+                sizer.error()
 
-                # make sure the header contains everything we need
-                try:
-                    size = int(overview[':bytes'])
-                except:
-                    # TODO: cull this later
-                    log.debug('server: bad message: {}'.format(overview))
-                    continue
+                # put anything that didn't finish back on the front, remembering
+                # what we'd already had from the one that was going
+                already_received.update(messages[received:])
+                pending.extendleft(reversed(sent))
+                sent.clear()
 
-                # assuming everything didn't fuck up, continue
-                if int(segment_number) > 0 and int(total_segments) > 0:
-                    # strip the segment number off the subject so
-                    # we can match binary parts together
-                    subject = nntplib.decode_header(overview['subject'].replace(
-                        '(' + str(segment_number) + '/' + str(total_segments) + ')', ''
-                    ).strip()).encode('utf-8', 'replace').decode('latin-1')
-
-                    posted_by = nntplib.decode_header(overview['from']).encode('utf-8', 'replace').decode('latin-1')
-
-                    # generate a hash to perform matching
-                    hash = pynab.parts.generate_hash(subject, posted_by, group_name, int(total_segments))
-
-                    # this is spammy as shit, for obvious reasons
-                    # pynab.log.debug('Binary part found: ' + subject)
-
-                    # build the segment, make sure segment number and size are ints
-                    segment = {
-                        'message_id': overview['message-id'][1:-1],
-                        'segment': int(segment_number),
-                        'size': size
-                    }
-
-                    # if we've already got a binary by this name, add this segment
-                    if hash in parts:
-                        parts[hash]['segments'][segment_number] = segment
-                        parts[hash]['available_segments'] += 1
-                    else:
-                        # dateutil will parse the date as whatever and convert to UTC
-                        # some subjects/posters have odd encoding, which will break pymongo
-                        # so we make sure it doesn't
-                        try:
-                            message = {
-                                'hash': hash,
-                                'subject': subject,
-                                'posted': dateutil.parser.parse(overview['date']),
-                                'posted_by': posted_by,
-                                'group_name': group_name,
-                                'xref': pynab.util.smart_truncate(overview['xref'], length=1024),
-                                'total_segments': int(total_segments),
-                                'available_segments': 1,
-                                'segments': {segment_number: segment, },
-                            }
-
-                            parts[hash] = message
-                        except Exception as e:
-                            log.error('server: bad message parse: {}'.format(e))
-                            continue
-                else:
-                    # :getout:
-                    ignored += 1
+                # 3 attempts
+                if i == 3:
+                    log.warning('server: {}: timed out a bunch, we\'ll try again later'.format(group_name))
+                    break
+                continue
 
-            # instead of checking every single individual segment, package them first
-            # so we typically only end up checking the blacklist for ~150 parts instead of thousands
-            blacklist = [k for k, v in parts.items() if pynab.parts.is_blacklisted(v, group_name, blacklists)]
-            blacklisted_parts = len(blacklist)
-            total_parts = len(parts)
-            for k in blacklist:
-                del parts[k]
-        else:
-            total_parts = 0
-            blacklisted_parts = 0
+        try:
+            sizer.save()
+        except Exception as e:
+            log.warning('server: {}: couldn\'t save over size: {}'.format(group_name, e))
+
+        if not flush(parts):
+            log.error('server: {}: problem saving parts, stopping scan'.format(group_name))
+            return False, None, None, None
+        if save:
+            parts = {}
+
+        try:
+            save_dates(group_name, dates)
+        except Exception as e:
+            log.warning('server: {}: couldn\'t save article dates: {}'.format(group_name, e))
 
         # check for missing messages if desired
         # don't do this if we're grabbing ranges, because it won't work
@@ -316,7 +893,8 @@ class Server:
         return status, parts, messages, messages_missed
 
     def post_date(self, group_name, article):
-        """Retrieves the date of the specified post."""
+        """Retrieves the date of the specified post, from its overview
+        if the server will give us one, otherwise from its headers."""
         self.connect()
 
         art_num = 0
@@ -324,7 +902,24 @@ class Server:
 
         try:
             with nntp_handler(self, group_name):
-                self.connection.group(group_name)
+                self.select_group(group_name)
+                _, overviews = self.connection.over((article, article))
+        except:
+            # usually the article's missing, which HEAD won't fix
+            return None
+
+        if overviews:
+            _, fields = overviews[0]
+            if fields.get('date'):
+                date = parse_date(fields['date'])
+                if date:
+                    return date
+
+        # the overview didn't have a date we can read, so try the headers
+
+        try:
+            with nntp_handler(self, group_name):
+                self.select_group(group_name)
                 art_num, overview = self.connection.head('{0:d}'.format(article))
         except:
             return None
@@ -345,19 +940,7 @@ class Server:
                     date_header = head.replace('Date: ', '')
 
                 if date_header:
-                    try:
-                        date = dateutil.parser.parse(date_header)
-                    except Exception as e:
-                        log.error('server: date parse failed while dating message: {}'.format(e))
-                        return None
-
-                    try:
-                        date = pytz.utc.localize(date)
-                    except:
-                        # no problem, it's already localised
-                        pass
-
-                    return date
+                    return parse_date(date_header)
         else:
             return None
 
@@ -383,38 +966,68 @@ class Server:
         else:
             tolerance = 20
 
-        # get first, last and target dates
-        candidate_post = None
         target_date = datetime.datetime.now(pytz.utc) - datetime.timedelta(days)
-        bottom_date = self.post_date(group_name, first)
 
-        if not bottom_date:
-            log.error('server: {}: can\'t get first date on group, fatal group error. try again later?'.format(
-                group_name
-            ))
-            return None
+        # keep every date we find out, so the next search starts closer
+        dates = {}
+        try:
+            return self._find_post(group_name, first, last, target_date, tolerance, dates)
+        finally:
+            try:
+                save_dates(group_name, dates, first)
+            except Exception as e:
+                log.warning('server: {}: couldn\'t save article dates: {}'.format(group_name, e))
 
-        # check bottom_date
-        if target_date < bottom_date:
-            log.info('server: {}: post was before first available, starting from the beginning'.format(
-                group_name
-            ))
-            return first
+    def _find_post(self, group_name, first, last, target_date, tolerance, dates):
+        """Searches for the post nearest target_date, starting from the
+        closest dates we already know either side of it."""
+        candidate_post = None
 
-        top_date = self.post_date(group_name, last)
+        samples = known_dates(group_name, first, last)
+        below = [(a, d) for a, d in samples if d <= target_date]
+        above = [(a, d) for a, d in samples if d > target_date]
 
-        if not top_date:
-            log.warning('server: {}: can\'t get first date on group, fatal group error. try again later?'.format(
-                group_name
-            ))
-            return None
+        if below:
+            bottom, bottom_date = max(below)
+        else:
+            bottom = first
+            bottom_date = self.post_date(group_name, first)
 
-        if target_date > top_date:
-            log.info('server: {}: requested post was newer than most recent, ending'.format(group_name))
-            return None
+            if not bottom_date:
+                log.error('server: {}: can\'t get first date on group, fatal group error. try again later?'.format(
+                    group_name
+                ))
+                return None
+
+            dates[first] = bottom_date
+
+            # check bottom_date
+            if target_date < bottom_date:
+                log.info('server: {}: post was before first available, starting from the beginning'.format(
+                    group_name
+                ))
+                return first
+
+        if above and min(above)[0] > bottom:
+            top, top_date = min(above)
+        else:
+            top = last
+            top_date = self.post_date(group_name, last)
+
+            if not top_date:
+                log.warning('server: {}: can\'t get first date on group, fatal group error. try again later?'.format(
+                    group_name
+                ))
+                return None
+
+            dates[last] = top_date
+
+            if target_date > top_date:
+                log.info('server: {}: requested post was newer than most recent, ending'.format(group_name))
+                return None
 
-        bottom = first
-        top = last
+        if abs(target_date - bottom_date) < datetime.timedelta(days=tolerance):
+            return bottom
 
         # Keep track of previously seen candidate posts so that we
         # can adjust and avoid getting into a loop.
@@ -440,6 +1053,7 @@ class Server:
                 candidate_post = int(abs(bottom + ((top - bottom) * perc)))
                 candidate_date = self.post_date(group_name, candidate_post)
                 if candidate_date:
+                    dates[candidate_post] = candidate_date
                     break
                 else:
                     addition = (random.choice([-1, 1]) / 100) * perc
@@ -60,14 +60,12 @@ def process(limit=None, category=0):
                                 continue
                             sfvs.append(part)
 
-                    for sfv in sfvs:
-                        try:
-                            article = server.get(release.group.name, [sfv['message_id'], ])
-                        except:
-                            article = None
-
+                    # pipeline the lot, and stop at the first one that comes back
+                    for message_id, article in server.get_many(release.group.name,
+                                                               [sfv['message_id'] for sfv in sfvs]):
                         if article:
-                            data = gzip.compress(article.encode('utf-8'))
+                            # stored as it always has been: the bytes as latin-1 text, in utf-8
+                            data = gzip.compress(article.decode('latin-1').encode('utf-8'))
                             sfv = SFV(data=data)
                             db.add(sfv)
 
@@ -1,30 +1,38 @@
 """With big thanks to SABNZBD, since they're maybe the only ones with yenc code that
 works in Python 3"""
 
+import zlib
+
 import regex
 
 from pynab import log
 
-YDEC_TRANS = ''.join([chr((i + 256 - 42) % 256) for i in range(256)])
+# every byte is shifted by 42, escaped bytes by a further 64
+YDEC_TRANS = bytes((i + 256 - 42) % 256 for i in range(256))
+YDEC_ESCAPE_TRANS = bytes((i + 256 - 64) % 256 for i in range(256))
 
 
 def yenc_decode(lines):
-    """Decodes a yEnc-encoded fileobj.
+    """Decodes a list of yEnc-encoded lines (as bytes, already dot-unstuffed
+    by nntplib) and returns the decoded data as bytes, or None if it wasn't
+    yEnc or failed the CRC check.
     Should use python-yenc 0.4 for this, but it's not py3.3 compatible.
     """
 
-    data = yenc_strip([l.decode('ISO-8859-1') for l in lines])
+    data = yenc_strip(lines)
 
     if data:
         yenc, data = yenc_check(data)
         ybegin, ypart, yend = yenc
 
         if ybegin and yend:
-            data = ''.join(data)
-            for i in (0, 9, 10, 13, 27, 32, 46, 61):
-                j = '=%c' % (i + 64)
-                data = data.replace(j, chr(i))
-            return data.translate(YDEC_TRANS)
+            decoded = yenc_unescape(b''.join(data)).translate(YDEC_TRANS)
+
+            if not yenc_crc_ok(decoded, ypart, yend):
+                log.debug('yenc: crc mismatch, discarding article')
+                return None
+
+            return decoded
         else:
             log.debug('File wasn\'t yenc.')
             log.debug(data)
@@ -34,6 +42,38 @@ def yenc_decode(lines):
     return None
 
 
+def yenc_unescape(data):
+    """Undoes the =x escapes, leaving the 42-shift for translate. Each '='
+    escapes exactly the byte after it, even if that's another '='."""
+    start = data.find(b'=')
+    if start == -1:
+        return data
+
+    unescaped = bytearray(data[:start])
+    i = start
+    while i != -1:
+        if i + 1 < len(data):
+            unescaped.append((data[i + 1] - 64) % 256)
+        j = data.find(b'=', i + 2)
+        unescaped += data[i + 2:] if j == -1 else data[i + 2:j]
+        i = j
+
+    return bytes(unescaped)
+
+
+def yenc_crc_ok(data, ypart, yend):
+    """Check the decoded data against the part (or whole-file) crc, if there is one."""
+    crc = yend.get('pcrc32') if ypart else yend.get('crc32')
+    if not crc:
+        return True
+
+    try:
+        return zlib.crc32(data) & 0xffffffff == int(crc, 16)
+    except ValueError:
+        # a crc we can't read isn't worth throwing the data away for
+        return True
+
+
 def yenc_check(data):
     ybegin = None
     ypart = None
@@ -42,17 +82,18 @@ def yenc_check(data):
     ## Check head
     for i in range(min(40, len(data))):
         try:
-            if data[i].startswith('=ybegin '):
+            if data[i].startswith(b'=ybegin '):
+                line = data[i].decode('ISO-8859-1')
                 splits = 3
-                if data[i].find(' part=') > 0:
+                if line.find(' part=') > 0:
                     splits += 1
-                if data[i].find(' total=') > 0:
+                if line.find(' total=') > 0:
                     splits += 1
 
-                ybegin = yenc_split(data[i], splits)
+                ybegin = yenc_split(line, splits)
 
-                if data[i + 1].startswith('=ypart '):
-                    ypart = yenc_split(data[i + 1])
+                if data[i + 1].startswith(b'=ypart '):
+                    ypart = yenc_split(data[i + 1].decode('ISO-8859-1'))
                     data = data[i + 2:]
                     break
                 else:
@@ -64,8 +105,8 @@ def yenc_check(data):
     ## Check tail
     for i in range(-1, -11, -1):
         try:
-            if data[i].startswith('=yend '):
-                yend = yenc_split(data[i])
+            if data[i].startswith(b'=yend '):
+                yend = yenc_split(data[i].decode('ISO-8859-1'))
                 data = data[:i]
                 break
         except IndexError:
@@ -96,13 +137,14 @@ def yenc_split(line, splits=None):
 
 
 def yenc_strip(data):
-    while data and not data[0]:
-        data.pop(0)
+    # nntplib has already undone the dot-stuffing, so just trim blank lines
+    start = 0
+    end = len(data)
+
+    while start < end and not data[start]:
+        start += 1
 
-    while data and not data[-1]:
-        data.pop()
+    while end > start and not data[end - 1]:
+        end -= 1
 
-    for i in range(len(data)):
-        if data[i][:2] == '..':
-            data[i] = data[i][1:]
-    return data
\ No newline at end of file
+    return data[start:end]
@@ -21,14 +21,17 @@ import dateutil.parser
 from docopt import docopt
 
 from pynab import log, log_init
-from pynab.db import db_session, Group, Binary, Miss, Segment, vacuum
+from pynab.db import db_session, Group, Binary, Miss, vacuum
 import pynab.groups
+import pynab.parts
 import pynab.binaries
 import pynab.releases
 import pynab.rars
 import pynab.nfos
 import pynab.debug
 import pynab.server
+import pynab.aioscan
+import pynab.partitions
 import config
 
 
@@ -43,11 +46,15 @@ def update(group_name):
         ))
 
 
-def backfill(group_name, date=None, target=None):
+def backfill_date(date=None):
     if date:
-        date = pytz.utc.localize(dateutil.parser.parse(date))
+        return pytz.utc.localize(dateutil.parser.parse(date))
     else:
-        date = pytz.utc.localize(datetime.datetime.now() - datetime.timedelta(config.scan.get('backfill_days', 10)))
+        return pytz.utc.localize(datetime.datetime.now() - datetime.timedelta(config.scan.get('backfill_days', 10)))
+
+
+def backfill(group_name, date=None, target=None):
+    date = backfill_date(date)
     try:
         return pynab.groups.scan(group_name, direction='backward', date=date, target=target,
                                  limit=config.scan.get('group_scan_limit', 2000000))
@@ -57,6 +64,14 @@ def backfill(group_name, date=None, target=None):
         ))
 
 
+def find_target(group_name, days):
+    try:
+        with pynab.server.Server() as server:
+            return server.day_to_post(group_name, days)
+    except Exception as e:
+        log.error('scan: {}: couldn\'t find a backfill target: {}'.format(group_name, e))
+
+
 def scan_missing(group_name):
     try:
         return pynab.groups.scan_missing_segments(group_name)
@@ -86,29 +101,35 @@ def main(mode='update', group=None, date=None):
 
     if mode == 'backfill':
         log.info('scan: finding targets for backfill...')
-        with pynab.server.Server() as server:
-            with db_session() as db:
-                if not group:
-                    groups = [group.name for group in db.query(Group).filter(Group.active == True).all()]
-                else:
-                    if db.query(Group).filter(Group.name == group).first():
-                        groups = [group]
-                for group in groups:
-                    target = server.day_to_post(group,
-                                                server.days_old(pytz.utc.localize(dateutil.parser.parse(date)))
-                                                if date else config.scan.get('backfill_days', 10)
-                                                )
-                    if target:
-                        active_groups[group] = target
+        with db_session() as db:
+            if not group:
+                groups = [group.name for group in db.query(Group).filter(Group.active == True).all()]
+            else:
+                if db.query(Group).filter(Group.name == group).first():
+                    groups = [group]
+
+        days = pynab.server.Server.days_old(pytz.utc.localize(dateutil.parser.parse(date))) \
+            if date else config.scan.get('backfill_days', 10)
+
+        # each search is a handful of round trips, so do the groups side by side
+        with concurrent.futures.ThreadPoolExecutor(config.scan.get('update_threads', None)) as executor:
+            targets = {executor.submit(find_target, group, days): group for group in groups}
+            for r in concurrent.futures.as_completed(targets):
+                target = r.result()
+                if target:
+                    active_groups[targets[r]] = target
 
     iterations = 0
     while True:
         iterations += 1
         data = []
 
+        # make sure there are partitions to save parts into, if we're using them
+        pynab.partitions.ensure()
+
         # refresh the db session each iteration, just in case
         with db_session() as db:
-            if db.query(Segment).count() > config.scan.get('early_process_threshold', 50000000):
+            if pynab.parts.count_segments(db) > config.scan.get('early_process_threshold', 50000000):
                 if mode == 'update':
                     log.info('scan: backlog of segments detected, processing first')
                     process()
@@ -130,23 +151,33 @@ def main(mode='update', group=None, date=None):
                         return
 
             if active_groups:
-                with concurrent.futures.ThreadPoolExecutor(config.scan.get('update_threads', None)) as executor:
-                    # if maxtasksperchild is more than 1, everything breaks
-                    # they're long processes usually, so no problem having one task per child
+                if config.scan.get('async_scan', False):
+                    # scan every group from one event loop instead of a thread each
                     if mode == 'backfill':
-                        result = [executor.submit(backfill, active_group, date, target) for active_group, target in active_groups.items()]
+                        data = pynab.aioscan.run(active_groups, direction='backward', date=backfill_date(date),
+                                                 limit=config.scan.get('group_scan_limit', 2000000))
                     else:
-                        result = [executor.submit(update, active_group) for active_group in active_groups.keys()]
-
-                    for r in concurrent.futures.as_completed(result):
-                        data.append(r.result())
-
-                    if mode == 'backfill':
-                        if all(data):
-                            return
+                        data = pynab.aioscan.run(dict.fromkeys(active_groups),
+                                                 limit=config.scan.get('group_scan_limit', 2000000))
+                else:
+                    with concurrent.futures.ThreadPoolExecutor(config.scan.get('update_threads', None)) as executor:
+                        # if maxtasksperchild is more than 1, everything breaks
+                        # they're long processes usually, so no problem having one task per child
+                        if mode == 'backfill':
+                            result = [executor.submit(backfill, active_group, date, target) for active_group, target in active_groups.items()]
+                        else:
+                            result = [executor.submit(update, active_group) for active_group in active_groups.keys()]
+
+                        for r in concurrent.futures.as_completed(result):
+                            data.append(r.result())
+
+                if mode == 'backfill':
+                    if all(data):
+                        return
 
-                    # don't retry misses during backfill, it ain't gonna happen
-                    if config.scan.get('retry_missed') and not mode == 'backfill':
+                # don't retry misses during backfill, it ain't gonna happen
+                if config.scan.get('retry_missed') and not mode == 'backfill':
+                    with concurrent.futures.ThreadPoolExecutor(config.scan.get('update_threads', None)) as executor:
                         miss_groups = [group_name for group_name, in
                                        db.query(Miss.group_name).group_by(Miss.group_name).all()]
                         miss_result = [executor.submit(scan_missing, miss_group) for miss_group in miss_groups]
@@ -169,6 +200,9 @@ def main(mode='update', group=None, date=None):
                         db.commit()
 
                         log.info('scan: deleted {} dead binaries'.format(dead_binaries))
+
+                        # and drop whole partitions of parts and segments that have expired
+                        pynab.partitions.expire(dead_time)
             else:
                 log.info('scan: no groups active, cancelling pynab.py...')
                 break
@@ -203,4 +237,8 @@ if __name__ == '__main__':
     else:
         mode = 'update'
 
-    main(mode=mode, group=arguments['<group>'], date=arguments['--date'])
+    try:
+        main(mode=mode, group=arguments['<group>'], date=arguments['--date'])
+    finally:
+        # say goodbye to the provider rather than just dropping the sockets
+        pynab.server.close_pools()
@@ -7,7 +7,7 @@ import colorama
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
-from pynab.db import Part, Binary, Release, db_session
+from pynab.db import Part, Binary, Release, Group, db_session
 import config
 from pynab import log, log_init
 
@@ -37,6 +37,23 @@ def get_stats():
         return parts, binaries, releases, others
 
 
+def get_over_sizes():
+    """
+    Retrieve the current adaptive OVER size of each active group.
+    """
+    with db_session() as db:
+        return db.query(Group.name, Group.over_size).filter(Group.active == True).order_by(Group.name).all()
+
+
+def build_over_sizes():
+    """
+    Generate a line of the current OVER sizes.
+    """
+    return 'OVER sizes: ' + ', '.join(
+        '{}={}'.format(name, size or config.scan.get('over_pipeline_size', 5000)) for name, size in get_over_sizes()
+    )
+
+
 def colored(num):
     """
     Colour the numbers depending on value.
@@ -64,6 +81,8 @@ if __name__ == '__main__':
     logging_dir = config.log.get('logging_dir')
     csv_path = os.path.join(logging_dir, 'stats.csv')
 
+    if config.stats.get('show_over_sizes', True):
+        log.info(build_over_sizes())
     log.info(build_header())
 
     i = 1
@@ -91,6 +110,8 @@ if __name__ == '__main__':
 
         if i % config.stats.get('header_every_nth', 0) == 0:
             i = 1
+            if config.stats.get('show_over_sizes', True):
+                log.info(build_over_sizes())
             log.info(build_header())
 
         log.info('{:^10} {:^20}|{:^10} {:^20}|{:^10} {:^20}|{:^10} {:^20}'.format(
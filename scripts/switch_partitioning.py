@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from pynab.db import engine
+import pynab.partitions
+import config
+
+
+def switch():
+    if 'postgre' not in config.db.get('engine'):
+        print('Partitioned parts are postgres only, nothing to do.')
+        return
+
+    with engine.begin() as conn:
+        if config.db.get('partitioned_parts', False):
+            if pynab.partitions.is_partitioned(conn):
+                print('Parts and segments are already partitioned.')
+                return
+
+            # partitioned parts don't read packed segments, so they'd just be lost
+            if conn.execute('SELECT count(*) FROM parts WHERE segment_numbers IS NOT NULL').scalar():
+                print('There are packed segments waiting. Turn off packed_segments and let scan.py '
+                      'process them before partitioning.')
+                return
+
+            print('Partitioning parts and segments...')
+            pynab.partitions.partition(conn)
+        else:
+            if not pynab.partitions.is_partitioned(conn):
+                print('Parts and segments are already plain tables.')
+                return
+
+            print('Converting parts and segments back to plain tables...')
+            pynab.partitions.unpartition(conn)
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    print('''
+    Switch Partitioning
+
+    Converts the parts and segments tables to match db.partitioned_parts in config.py,
+    without touching any other migrations. Stop scan.py first - this copies both tables
+    and locks them while it runs.
+    ''')
+    input('To continue, press enter. To exit, press ctrl-c.')
+    switch()